@@ -1,306 +1,374 @@
-from opentrons import protocol_api, types
-
-
-metadata = {
-    "apiLevel": "2.16",
-    "protocolName": "NB3: Adapter Ligation",
-    "description": """Third part of the SQK-NBD114.24 Nanopore protocol. Uses same reagents. Protocol assumes kit tubes are used.""",
-    "author": "Didrik Anttila"
-    }
-
-""" Material requirements
-
-PBs: Pooled Barcoded Sample 
-NA: Native Adapter
-QL: Quickl ligation T4 Ligase
-QB: Quick Ligation buffer
-LFB: Long Fragment Buffer
-EB: Elution Buffer
-AXP: AXP beads
-H2O: de-ionized milliQ water
-Eth: 96% Ethanol
-QB: Invitrogen 1X dsDNA BR Working Solution
-
-Positioning in labware
-
-Ep tuberack
-A1: AXP
-A2: Empty 1.5mL eppendorf
-
-Temperature module
-A1: PBs ((30µL))
-A2: NA ((5µL))
-B1: LFB ((300µL))
-B2: EB ((15µL))
-C1: QL ((5µL))
-C2: QB ((10µL))
-
-Falcon tube rack
-A1: QB ((3-4mL?))
-A3: H2O ((? nearly full))
-B3: 80% Eth ((Near empty or empty))
-B4: 96% Eth ((Near full))
-"""
-
-
-num_samples = 2
-if num_samples not in range(1, 24):
-    raise Exception("Number of samples not between 1 and 24.")
-
-
-
-
-def run(protocol: protocol_api.ProtocolContext):
-    # Labware
-    big_tips = protocol.load_labware("opentrons_96_tiprack_300ul", 8) 
-    small_tips = protocol.load_labware("opentrons_96_tiprack_20ul", 4)
-    reservoir = protocol.load_labware("nest_1_reservoir_290ml", 5) # Actually pipette tip box lid
-    plate = protocol.load_labware("corning_96_wellplate_360ul_flat", 2) 
-    ep_tuberack = protocol.load_labware("opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap", 10)
-    falcon_tuberack = protocol.load_labware("opentrons_10_tuberack_falcon_4x50ml_6x15ml_conical", 6)
-    
-    # Hardware modules
-    hs_mod = protocol.load_module(
-        module_name="heaterShakerModuleV1", 
-        location="1")
-    hs_adapter = hs_mod.load_adapter(
-        "opentrons_96_pcr_adapter") # ? I think this is the adapter we will use.
-    hs_plate = hs_adapter.load_labware(
-        "nest_96_wellplate_100ul_pcr_full_skirt") # ? 
-    
-
-    mag_mod = protocol.load_module(
-        module_name = "magnetic module gen2", 
-        location="9")
-    mag_plate = mag_mod.load_labware(
-        "nest_96_wellplate_100ul_pcr_full_skirt") 
-    
-    temp_mod = protocol.load_module(
-        module_name = "temperature module gen2",
-        location = "3")
-    temp_labware = temp_mod.load_labware("opentrons_24_aluminumblock_nest_1.5ml_snapcap")
-
-    # Pipette
-    # The p300 pipette is generally best suited for volumes in the range 30-300µL. 
-    # The P20 pipette is best suited for volumes in the range 1-20µL.
-    left_pipette = protocol.load_instrument("p300_single_gen2", "left", tip_racks=[big_tips]) 
-    right_pipette = protocol.load_instrument("p20_single_gen2", "right", tip_racks=[small_tips])
-
-
-
-    # Procedure / commands
-    hs_mod.close_labware_latch()
-
-    protocol.comment("* Adding SUSPENDED beads to hs plate.")
-    left_pipette.pick_up_tip()
-    left_pipette.mix(5, 100, ep_tuberack["A1"])
-    left_pipette.blow_out()
-    left_pipette.aspirate(35, ep_tuberack["A1"])
-    left_pipette.touch_tip(radius=0.85, speed=5)
-    left_pipette.touch_tip(radius=0.85, speed=5)
-    left_pipette.air_gap(volume=5)
-    left_pipette.dispense(40, hs_plate["H3"])
-    left_pipette.blow_out()
-    left_pipette.drop_tip()
-    
-    temp_mod.set_temperature(celsius=4)
-
-    protocol.comment("* Adding and mixing barcoded sample with quick ligation reagents. Mixing before use.")
-    
-    # Barcoded sample
-    #left_pipette.transfer(30, temp_labware["A1"], mag_plate["G1"], mix_before=(10, 30), blow_out=True, blowout_location="destination well") # Barcoded sample
-    left_pipette.pick_up_tip()
-    left_pipette.mix(10, 28, temp_labware["A1"])
-    left_pipette.aspirate(30, temp_labware["A1"], rate=0.5)
-    left_pipette.default_speed = 100
-    left_pipette.dispense(30, mag_plate["G1"].top(z=-2))
-    left_pipette.blow_out()
-    left_pipette.default_speed = 400
-    left_pipette.drop_tip()
-
-    # Native adapter
-    #right_pipette.transfer(5, temp_labware["A2"], mag_plate["G1"].bottom(z=-1.5), mix_before=(10, 5), blow_out=True, blowout_location="destination well") # Native adapter
-    right_pipette.pick_up_tip()
-    right_pipette.mix(10, 5, temp_labware["A2"])
-    right_pipette.aspirate(5, temp_labware["A2"], rate=0.5)
-    right_pipette.default_speed = 50
-    right_pipette.dispense(5, mag_plate["G1"])
-    right_pipette.blow_out()
-    right_pipette.touch_tip(mag_plate["G1"], radius=0.6, v_offset=-2, speed=2)
-    right_pipette.default_speed = 400
-    right_pipette.drop_tip()
-
-    # Ligation buffer
-    right_pipette.transfer(10, temp_labware["C2"], mag_plate["G1"], mix_before=(10, 10), blow_out=True, blowout_location="destination well") # Ligation buffer
-    right_pipette.pick_up_tip()
-    right_pipette.mix(10, 20, temp_labware["C2"])
-    right_pipette.air_gap(volume=5) # why is this before aspiration?
-    right_pipette.aspirate(10, temp_labware["C2"], rate=0.5)
-    right_pipette.touch_tip(temp_labware["C2"], radius=0.55, speed=5)
-    right_pipette.default_speed = 100
-    right_pipette.dispense(15, mag_plate["G1"].top(z=-1))
-    right_pipette.blow_out()
-    right_pipette.touch_tip(mag_plate["G1"], radius=0.75, v_offset=-2, speed=2)
-    right_pipette.default_speed = 400
-    right_pipette.drop_tip()
-    
-    # T4 Ligase
-    right_pipette.pick_up_tip()
-    right_pipette.mix(10, 20, temp_labware["C1"])
-    right_pipette.blow_out()
-    right_pipette.aspirate(5, temp_labware["C1"], rate=0.2)
-    right_pipette.default_speed = 50
-    right_pipette.touch_tip(temp_labware["C1"], radius=0.55, speed=5)
-    right_pipette.dispense(5, mag_plate["G1"])
-    right_pipette.blow_out()
-    right_pipette.touch_tip(mag_plate["G1"], radius=0.85, v_offset=-1, speed=2)
-    right_pipette.default_speed = 400
-    right_pipette.drop_tip()
-    ###
-
-    # Mixing solution
-    left_pipette.pick_up_tip()
-    left_pipette.mix(5, 25, mag_plate["G1"], rate=0.5)
-    left_pipette.blow_out()
-    left_pipette.touch_tip(mag_plate["G1"], radius=0.85, speed=1)
-    left_pipette.drop_tip()
-
-    protocol.comment("* Incubating for 20 min at RT.")
-    protocol.delay(minutes=20)
-
-    protocol.comment("* Suspending beads and adding 20uL to sample. Suspending.")
-    hs_mod.set_and_wait_for_shake_speed(900)
-    protocol.delay(2)
-    hs_mod.deactivate_shaker()
-
-    left_pipette.pick_up_tip()
-    left_pipette.mix(10, 20, hs_plate["H3"])
-    left_pipette.blow_out(hs_plate["H3"])
-    left_pipette.aspirate(20, hs_plate["H3"])
-    left_pipette.touch_tip(hs_plate["H3"], radius=0.85, speed=2)
-    left_pipette.touch_tip(hs_plate["H3"], radius=0.85, speed=2)
-    left_pipette.dispense(20, mag_plate["G1"].top(z=0))
-    left_pipette.mix(8, 60, mag_plate["G1"])
-
-    protocol.comment("* Hula mixing for 10 minutes.")
-    left_pipette.mix(117, 35, mag_plate["G1"], rate=0.25) # 117 needs to be doubled from barcode ligation, since nearly half the sample.
-
-    left_pipette.blow_out(mag_plate["G1"])
-    left_pipette.touch_tip(mag_plate["G1"], radius=0.85, speed=2)
-    left_pipette.drop_tip()
-
-    protocol.comment("* Pelleting beads on magnet.")
-    mag_mod.engage(height_from_base=8.5)
-    protocol.delay(minutes=5)
-
-    protocol.comment("* Dumping supernatant")
-    left_pipette.pick_up_tip()
-    right_pipette.pick_up_tip()
-    left_pipette.aspirate(70, mag_plate["G1"], rate=0.02)
-    left_pipette.dispense(70, reservoir["A1"].bottom(z=30))
-    left_pipette.drop_tip()
-    right_pipette.aspirate(20, mag_plate["G1"], rate=0.1)
-    right_pipette.drop_tip()
-
-    hs_mod.set_target_temperature(37) # Setting target temp in advance
-
-    protocol.comment("* Washing beads with Long Fragment Buffer twice, dumping the supernatant.")
-    mag_mod.disengage()
-    for i in range(2): # Repeat once
-        left_pipette.pick_up_tip()
-        right_pipette.pick_up_tip()
-        left_pipette.mix(10, 300, temp_labware["B1"])
-        left_pipette.aspirate(125, temp_labware["B1"]) # Height offset?
-        left_pipette.touch_tip(temp_labware["B1"], radius=0.55, speed=5)
-        left_pipette.dispense(125, mag_plate["G1"])
-        left_pipette.mix(5, 120, mag_plate["G1"])
-        left_pipette.blow_out(mag_plate["G1"])
-        left_pipette.drop_tip()
-        # 8.5 extension first time, then lower to 4.5
-        if i == 0:
-            protocol.comment("* Engaging magnet with height 8.5")
-            mag_mod.engage(height_from_base=(8.5))
-        elif i == 1:
-            protocol.comment("* Engaging magnet with height 4.5")
-            mag_mod.engage(height_from_base=(4.5))
-        protocol.delay(minutes=5)
-        left_pipette.pick_up_tip()
-        left_pipette.aspirate(150, mag_plate["G1"], rate=0.02)
-        left_pipette.air_gap(volume=30)
-        left_pipette.dispense(180, reservoir["A1"].bottom(z=30))
-        left_pipette.blow_out()
-        left_pipette.drop_tip()
-        protocol.delay(seconds=30) # Because no spin down, allow fluid to slowly collect.
-        right_pipette.aspirate(10, mag_plate["G1"], rate=0.1)
-        right_pipette.drop_tip()
-
-        mag_mod.disengage()
-
-    protocol.comment("* Suspending pellet in Elution Buffer, and moving to hs plate.")
-    # ! Perhaps in this step, one could simply use only the large pipette by having it aspirate a 5µL air gap before aspirating the 15µL Elution Buffer?
-    right_pipette.pick_up_tip()
-    right_pipette.mix(10, 14, temp_labware["B2"])
-    right_pipette.aspirate(7, temp_labware["B2"])
-    right_pipette.default_speed = 100
-    right_pipette.dispense(7, mag_plate["G1"])
-    right_pipette.blow_out(mag_plate["G1"])
-    right_pipette.touch_tip(mag_plate["G1"])
-    right_pipette.default_speed = 400
-    right_pipette.mix(5, 6, mag_plate["G1"])
-    right_pipette.aspirate(15, mag_plate["G1"], rate=0.5) # Aspirate slowly to attempt to get as much solution as possible.
-    right_pipette.air_gap(volume = 5)
-    right_pipette.dispense(20, hs_plate["E1"])
-    right_pipette.blow_out()
-    right_pipette.touch_tip(hs_plate["E1"], radius=0.85, speed=2)
-    right_pipette.drop_tip()
-
-    hs_mod.wait_for_temperature()
-    protocol.comment("* Incubating for 10 minutes, agitating sample each second minute for 10 seconds.")
-    protocol.delay(minutes=2)
-    for i in range(4): # Repeating this step 4 times
-        hs_mod.set_and_wait_for_shake_speed(500) 
-        protocol.delay(seconds=10)
-        hs_mod.deactivate_shaker()
-        protocol.delay(seconds=110)
-    # Total time 10 minutes. (ignoring spinup time)
-    hs_mod.deactivate_heater()
-
-    protocol.comment("* Suspending solution and pelleting on magnet for 5 minutes.")
-    right_pipette.pick_up_tip()
-    right_pipette.mix(10, 10, hs_plate["E1"])
-    protocol.pause("Suspended enough? (hs well E1)")
-    right_pipette.aspirate(15, hs_plate["E1"], rate=0.5)
-    right_pipette.dispense(15, mag_plate["H1"])
-    right_pipette.blow_out(mag_plate["H1"])
-    right_pipette.touch_tip(radius=0.85, speed=1)
-    right_pipette.drop_tip()
-
-    mag_mod.engage(height_from_base=8.5)
-    # Protocol recommends 1 minute. 
-    # Experience recommends 2 minutes. 
-    # Apply 5 minutes, because beads will not have been spun down and be fully suspended when put on magnet.
-    protocol.delay(minutes=5) 
-
-
-
-    left_pipette.pick_up_tip()
-    left_pipette.aspirate(199, falcon_tuberack["A1"].bottom(z=3))
-    left_pipette.dispense(199, plate["E1"])
-
-
-    protocol.comment("* Extracting supernatant and placing in empty eppendorf in temp module slot D1")
-    right_pipette.pick_up_tip()
-    right_pipette.aspirate(10, mag_plate["H1"], rate=0.1)
-    right_pipette.dispense(10, ep_tuberack["A2"])
-    right_pipette.blow_out()
-    right_pipette.touch_tip(ep_tuberack["A2"], radius=0.85, speed=3)
-
-    right_pipette.aspirate(1, ep_tuberack["A2"])
-    right_pipette.dispense(1, plate["E1"])
-    left_pipette.mix(5, 100, plate["E1"])
-
-    right_pipette.drop_tip()
-    left_pipette.drop_tip()
-
-
-    hs_mod.open_labware_latch()
\ No newline at end of file
+from opentrons import protocol_api, types
+import sys
+sys.path.append("/var/lib/jupyter/notebooks") # protocol_helpers.py has to be uploaded here, see README
+import protocol_helpers as helpers
+
+
+metadata = {
+    "apiLevel": "2.18", # Labware.set_offset(), for protocol_helpers.apply_offsets()
+    "protocolName": "NB3: Adapter Ligation",
+    "description": """Third part of the SQK-NBD114.24 Nanopore protocol. Uses same reagents. Protocol assumes kit tubes are used.""",
+    "author": "Didrik Anttila"
+    }
+
+""" Material requirements
+
+PBs: Pooled Barcoded Sample 
+NA: Native Adapter
+QL: Quickl ligation T4 Ligase
+QB: Quick Ligation buffer
+LFB: Long Fragment Buffer
+EB: Elution Buffer
+AXP: AXP beads
+H2O: de-ionized milliQ water
+Eth: 96% Ethanol
+QB: Invitrogen 1X dsDNA BR Working Solution
+
+Positioning in labware, for one pool. With more pools each gets its own PBs tube, Library tube and wells, print their
+positions with e.g. "python layout.py AdapterligationFin.py --set pools=['Flongle 1','Flongle 2']".
+
+Ep tuberack
+A1: AXP ((105µL))
+A2: Empty 1.5mL eppendorf
+
+Temperature module
+A1: PBs ((35µL))
+(The barcoded pool stays where BarcodeLigationFin.py left it instead, when it ran today, see use_deck_state.)
+A2: NA ((10µL))
+B1: LFB ((430µL))
+B2: EB ((19µL))
+C1: QL ((25µL))
+C2: QB ((25µL))
+
+Falcon tube rack
+A1: QB ((at least 3.5mL, see reagent_plan.py))
+A3: H2O ((Nearly full, see reagent_plan.py))
+B3: 80% Eth ((Near empty or empty))
+B4: 96% Eth ((Near full))
+"""
+
+
+# Minutes of gentle pipette-mixing of the sample with the beads, in lieu of a hula mixer.
+binding_mix_minutes = 10
+
+num_samples = 2
+if num_samples not in range(1, 25):
+    raise Exception("Number of samples not between 1 and 24.")
+
+# Pooled barcoded libraries, one per flow cell. The pools are processed side by side in their own wells,
+# and share the incubations, the magnet steps and the elution on the heater shaker.
+pools = ["Flongle 1"]
+num_pools = len(pools)
+
+# Whether to take the barcoded pools from where BarcodeLigationFin.py left them today, with their volumes, as it saved them
+# in deck_state.json. Set to False when the tubes were moved, and place them as in "Positioning in labware" above.
+use_deck_state = True
+deck_state = helpers.read_deck_state("adapter") if use_deck_state else None
+
+# Starting volume of the Long Fragment Buffer: two 125µL washes per pool, and 50µL for mixing.
+lfb_vol = 250*num_pools + 180 # 125µL per pool and wash, and the 300µL mix with 5µL left before the last draw
+if lfb_vol > 1500:
+    raise Exception(f"{num_pools} pools need {lfb_vol}µL Long Fragment Buffer, more than its 1.5mL tube holds. At most 5 pools.")
+
+# Positions of the tubes and wells, see "Positioning in labware" above. The samples are pooled, so they don't change with num_samples.
+layout = helpers.plan_layout("adapter", num_samples, deck_state=deck_state, pools=num_pools)
+
+# Starting volume (µL) of each reagent: (labware, well, µL). They are shown in the liquid setup of the Opentrons app,
+# and preflight.py checks that no tube runs dry. The shared tubes hold what every pool needs, plus 5µL that the pipette can't
+# reach, and enough for the mix before each draw (see reagent_plan.py).
+# The AXP tube fills the bead wells with 20µL per pool plus 15µL each, and keeps 70µL, so it can be mixed with 100µL first.
+reagents = layout.reagents({
+    "AXP": sum(helpers.bead_aliquots([20]*num_pools, 15)) + 70,
+    "PBs": [tube["volume"] for tube in deck_state] if deck_state else 35,
+    "NA": 5*(num_pools - 1) + 5 + 5,
+    "LFB": lfb_vol,
+    "EB": 7*(num_pools - 1) + 14 + 5,
+    "QL": 5*(num_pools - 1) + 20 + 5,
+    "QB": 10*(num_pools - 1) + 20 + 5,
+    "Qubit": max(3500, helpers.QUBIT_VOL*num_pools + 1000),
+    "H2O": 45000,
+})
+
+
+
+
+def run(protocol: protocol_api.ProtocolContext):
+    # Labware
+    big_tips = protocol.load_labware("opentrons_96_tiprack_300ul", 8) 
+    small_tips = protocol.load_labware("opentrons_96_tiprack_20ul", 4)
+    reservoir = protocol.load_labware("nest_1_reservoir_290ml", 5) # Actually pipette tip box lid
+    plate = protocol.load_labware("corning_96_wellplate_360ul_flat", 2) 
+    ep_tuberack = protocol.load_labware("opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap", 10)
+    falcon_tuberack = protocol.load_labware("opentrons_10_tuberack_falcon_4x50ml_6x15ml_conical", 6)
+    
+    # Hardware modules
+    hs_mod = protocol.load_module(
+        module_name="heaterShakerModuleV1", 
+        location="1")
+    hs_adapter = hs_mod.load_adapter(
+        "opentrons_96_pcr_adapter") # ? I think this is the adapter we will use.
+    hs_plate = hs_adapter.load_labware(
+        "nest_96_wellplate_100ul_pcr_full_skirt") # ? 
+    
+
+    mag_mod = protocol.load_module(
+        module_name = "magnetic module gen2", 
+        location="9")
+    mag_plate = mag_mod.load_labware(
+        "nest_96_wellplate_100ul_pcr_full_skirt") 
+    
+    temp_mod = protocol.load_module(
+        module_name = "temperature module gen2",
+        location = "3")
+    temp_labware = temp_mod.load_labware("opentrons_24_aluminumblock_nest_1.5ml_snapcap")
+
+    # Pipette
+    # The p300 pipette is generally best suited for volumes in the range 30-300µL. 
+    # The P20 pipette is best suited for volumes in the range 1-20µL.
+    left_pipette = protocol.load_instrument("p300_single_gen2", "left", tip_racks=[big_tips]) 
+    right_pipette = protocol.load_instrument("p20_single_gen2", "right", tip_racks=[small_tips])
+
+
+
+    # The Qubit falcon tube is aspirated from just below its tracked liquid surface.
+    tracker = helpers.LiquidTracker()
+    labware = {"ep_tuberack": ep_tuberack, "temp_labware": temp_labware, "falcon_tuberack": falcon_tuberack,
+               "hs_plate": hs_plate, "mag_plate": mag_plate, "plate": plate}
+    helpers.apply_offsets(protocol, [big_tips, small_tips, reservoir, hs_adapter] + list(labware.values()))
+    helpers.load_reagents(protocol, reagents, labware, tracker)
+    wells = layout.wells(labware)
+
+    # Procedure / commands
+    hs_mod.close_labware_latch()
+    pool_wells = list(zip(pools, wells["PBs"], wells["Ligation"]))
+    if deck_state is not None:
+        for i, (tube, pool) in enumerate(zip(deck_state, pools), start=1):
+            if tube["volume"] < 30:
+                raise Exception(f"Pool {pool} needs 30µL, but BarcodeLigationFin.py left {tube['volume']}µL in {layout.where(f'PBs {i}')}.")
+            protocol.comment(f"* Pool {pool}: barcoded samples {tube['sample']}, as left by BarcodeLigationFin.py in {helpers.DECK_STATE_FILE}.")
+
+    protocol.comment("* Adding SUSPENDED beads to hs plate.")
+    # Each bead well holds the beads of up to helpers.BEAD_WELL_SAMPLES pools, 20µL each plus 15µL.
+    left_pipette.pick_up_tip()
+    left_pipette.mix(5, 100, wells["AXP"])
+    left_pipette.blow_out()
+    for bead_well, bead_vol in zip(wells["Beads"], helpers.bead_aliquots([20]*len(pools), 15)):
+        left_pipette.aspirate(bead_vol, wells["AXP"])
+        left_pipette.touch_tip(radius=0.85, speed=5)
+        left_pipette.touch_tip(radius=0.85, speed=5)
+        left_pipette.air_gap(volume=5)
+        left_pipette.dispense(bead_vol + 5, bead_well)
+        left_pipette.blow_out()
+    left_pipette.drop_tip()
+    
+    temp_mod.set_temperature(celsius=4)
+
+    protocol.comment("* Adding and mixing barcoded sample with quick ligation reagents. Mixing before use.")
+    
+    for pool, sample, well in pool_wells:
+        if num_pools > 1:
+            protocol.comment(f"* Pool {pool}: {layout.where(f'Ligation {pools.index(pool) + 1}')}.")
+
+        # Barcoded sample
+        #left_pipette.transfer(30, sample, well, mix_before=(10, 30), blow_out=True, blowout_location="destination well") # Barcoded sample
+        left_pipette.pick_up_tip()
+        left_pipette.mix(10, 28, sample)
+        left_pipette.aspirate(30, sample, rate=0.5)
+        left_pipette.default_speed = 100
+        left_pipette.dispense(30, well.top(z=-2))
+        left_pipette.blow_out()
+        left_pipette.default_speed = 400
+        left_pipette.drop_tip()
+
+        # Native adapter
+        #right_pipette.transfer(5, wells["NA"], well.bottom(z=-1.5), mix_before=(10, 5), blow_out=True, blowout_location="destination well") # Native adapter
+        right_pipette.pick_up_tip()
+        right_pipette.mix(10, 5, wells["NA"])
+        right_pipette.aspirate(5, wells["NA"], rate=0.5)
+        right_pipette.default_speed = 50
+        right_pipette.dispense(5, well)
+        right_pipette.blow_out()
+        right_pipette.touch_tip(well, radius=0.6, v_offset=-2, speed=2)
+        right_pipette.default_speed = 400
+        right_pipette.drop_tip()
+
+        # Ligation buffer
+        #right_pipette.transfer(10, wells["QB"], well, mix_before=(10, 10), blow_out=True, blowout_location="destination well") # Ligation buffer
+        right_pipette.pick_up_tip()
+        right_pipette.mix(10, 20, wells["QB"])
+        right_pipette.air_gap(volume=5) # why is this before aspiration?
+        right_pipette.aspirate(10, wells["QB"], rate=0.5)
+        right_pipette.touch_tip(wells["QB"], radius=0.55, speed=5)
+        right_pipette.default_speed = 100
+        right_pipette.dispense(15, well.top(z=-1))
+        right_pipette.blow_out()
+        right_pipette.touch_tip(well, radius=0.75, v_offset=-2, speed=2)
+        right_pipette.default_speed = 400
+        right_pipette.drop_tip()
+        
+        # T4 Ligase
+        right_pipette.pick_up_tip()
+        right_pipette.mix(10, 20, wells["QL"])
+        right_pipette.blow_out()
+        right_pipette.aspirate(5, wells["QL"], rate=0.2)
+        right_pipette.default_speed = 50
+        right_pipette.touch_tip(wells["QL"], radius=0.55, speed=5)
+        right_pipette.dispense(5, well)
+        right_pipette.blow_out()
+        right_pipette.touch_tip(well, radius=0.85, v_offset=-1, speed=2)
+        right_pipette.default_speed = 400
+        right_pipette.drop_tip()
+        ###
+
+        # Mixing solution
+        left_pipette.pick_up_tip()
+        left_pipette.mix(5, 25, well, rate=0.5)
+        left_pipette.blow_out()
+        left_pipette.touch_tip(well, radius=0.85, speed=1)
+        left_pipette.drop_tip()
+
+    protocol.comment("* Incubating for 20 min at RT.")
+    protocol.delay(minutes=20)
+
+    protocol.comment("* Suspending beads and adding 20uL to sample. Suspending.")
+    hs_mod.set_and_wait_for_shake_speed(900)
+    protocol.delay(2)
+    hs_mod.deactivate_shaker()
+
+    # The pools bind side by side: each is hula mixed for its share of binding_mix_minutes right after it gets its beads,
+    # and the last one then binds for the rest of the time, so no pool binds for less than binding_mix_minutes.
+    mix_minutes = round(binding_mix_minutes/num_pools, 1)
+    for i, (pool, sample, well) in enumerate(pool_wells):
+        bead_well = wells["Beads"][i // helpers.BEAD_WELL_SAMPLES]
+        left_pipette.pick_up_tip()
+        left_pipette.mix(10, 20, bead_well)
+        left_pipette.blow_out(bead_well)
+        left_pipette.aspirate(20, bead_well)
+        left_pipette.touch_tip(bead_well, radius=0.85, speed=2)
+        left_pipette.touch_tip(bead_well, radius=0.85, speed=2)
+        left_pipette.dispense(20, well.top(z=0))
+        left_pipette.mix(8, 60, well)
+
+        protocol.comment(f"* Hula mixing for {mix_minutes:g} minutes.")
+        helpers.timed_mix(protocol, left_pipette, mix_minutes, 35, well, rate=0.25)
+
+        left_pipette.blow_out(well)
+        left_pipette.touch_tip(well, radius=0.85, speed=2)
+        left_pipette.drop_tip()
+    if num_pools > 1:
+        protocol.delay(minutes=binding_mix_minutes - mix_minutes)
+
+    protocol.comment("* Pelleting beads on magnet.")
+    mag_mod.engage(height_from_base=8.5)
+    protocol.delay(minutes=5)
+
+    protocol.comment("* Dumping supernatant")
+    for pool, sample, well in pool_wells:
+        left_pipette.pick_up_tip()
+        right_pipette.pick_up_tip()
+        left_pipette.aspirate(70, well, rate=0.02)
+        left_pipette.dispense(70, reservoir["A1"].bottom(z=30))
+        left_pipette.drop_tip()
+        right_pipette.aspirate(20, well, rate=0.1)
+        right_pipette.drop_tip()
+
+    hs_mod.set_target_temperature(37) # Setting target temp in advance
+
+    protocol.comment("* Washing beads with Long Fragment Buffer twice, dumping the supernatant.")
+    mag_mod.disengage()
+    for i in range(2): # Repeat once
+        for pool, sample, well in pool_wells:
+            left_pipette.pick_up_tip()
+            left_pipette.mix(10, 300, wells["LFB"])
+            left_pipette.aspirate(125, wells["LFB"]) # Height offset?
+            left_pipette.touch_tip(wells["LFB"], radius=0.55, speed=5)
+            left_pipette.dispense(125, well)
+            left_pipette.mix(5, 120, well)
+            left_pipette.blow_out(well)
+            left_pipette.drop_tip()
+        # 8.5 extension first time, then lower to 4.5
+        if i == 0:
+            protocol.comment("* Engaging magnet with height 8.5")
+            mag_mod.engage(height_from_base=(8.5))
+        elif i == 1:
+            protocol.comment("* Engaging magnet with height 4.5")
+            mag_mod.engage(height_from_base=(4.5))
+        protocol.delay(minutes=5)
+        for pool, sample, well in pool_wells:
+            left_pipette.pick_up_tip()
+            left_pipette.aspirate(150, well, rate=0.02)
+            left_pipette.air_gap(volume=30)
+            left_pipette.dispense(180, reservoir["A1"].bottom(z=30))
+            left_pipette.blow_out()
+            left_pipette.drop_tip()
+        protocol.delay(seconds=30) # Because no spin down, allow fluid to slowly collect.
+        for pool, sample, well in pool_wells:
+            right_pipette.pick_up_tip()
+            right_pipette.aspirate(10, well, rate=0.1)
+            right_pipette.drop_tip()
+
+        mag_mod.disengage()
+
+    protocol.comment("* Suspending pellet in Elution Buffer, and moving to hs plate.")
+    # The P300 isn't accurate for the 7µL Elution Buffer (helpers.plan_transfer picks the P20), so the P20 does the whole step.
+    for (pool, sample, well), elution_well in zip(pool_wells, wells["Elution"]):
+        right_pipette.pick_up_tip()
+        right_pipette.mix(10, 14, wells["EB"])
+        right_pipette.aspirate(7, wells["EB"])
+        right_pipette.default_speed = 100
+        right_pipette.dispense(7, well)
+        right_pipette.blow_out(well)
+        right_pipette.touch_tip(well)
+        right_pipette.default_speed = 400
+        right_pipette.mix(5, 6, well)
+        right_pipette.aspirate(15, well, rate=0.5) # Aspirate slowly to attempt to get as much solution as possible.
+        right_pipette.air_gap(volume = 5)
+        right_pipette.dispense(20, elution_well)
+        right_pipette.blow_out()
+        right_pipette.touch_tip(elution_well, radius=0.85, speed=2)
+        right_pipette.drop_tip()
+
+    hs_mod.wait_for_temperature()
+    protocol.comment("* Incubating for 10 minutes, agitating sample each second minute for 10 seconds.")
+    protocol.delay(minutes=2)
+    for i in range(4): # Repeating this step 4 times
+        hs_mod.set_and_wait_for_shake_speed(500) 
+        protocol.delay(seconds=10)
+        hs_mod.deactivate_shaker()
+        protocol.delay(seconds=110)
+    # Total time 10 minutes. (ignoring spinup time)
+    hs_mod.deactivate_heater()
+
+    protocol.comment("* Suspending solution and pelleting on magnet for 5 minutes.")
+    for elution_well, eluate_well in zip(wells["Elution"], wells["Eluate"]):
+        right_pipette.pick_up_tip()
+        right_pipette.mix(10, 10, elution_well)
+        protocol.pause(f"Suspended enough? (hs well {elution_well.well_name})")
+        right_pipette.aspirate(15, elution_well, rate=0.5)
+        right_pipette.dispense(15, eluate_well)
+        right_pipette.blow_out(eluate_well)
+        right_pipette.touch_tip(radius=0.85, speed=1)
+        right_pipette.drop_tip()
+
+    mag_mod.engage(height_from_base=8.5)
+    # Protocol recommends 1 minute. 
+    # Experience recommends 2 minutes. 
+    # Apply 5 minutes, because beads will not have been spun down and be fully suspended when put on magnet.
+    with helpers.during_delay(protocol, minutes=5):
+        helpers.fill_qubit_wells(protocol, left_pipette, wells["Qubit"], wells["Quant"], tracker=tracker)
+
+
+    for pool, eluate_well, library, quant_well in zip(pools, wells["Eluate"], wells["Library"], wells["Quant"]):
+        protocol.comment(f"* Extracting supernatant and placing in empty eppendorf in {layout.where(f'Library {pools.index(pool) + 1}')}, then putting 1uL on corning plate well {quant_well.well_name}.")
+        right_pipette.pick_up_tip()
+        right_pipette.aspirate(10, eluate_well, rate=0.1)
+        right_pipette.dispense(10, library)
+        right_pipette.blow_out()
+        right_pipette.touch_tip(library, radius=0.85, speed=3)
+        helpers.add_quant_aliquot(right_pipette, library, quant_well)
+        right_pipette.drop_tip()
+
+
+    hs_mod.open_labware_latch()
+    # The libraries, 10µL less the quantification aliquot each, are ready to load on their flow cells.
+    layout.save_state(protocol, {f"Library {i}": ("Adapter-ligated library", 10 - helpers.QUANT_VOL, pool) for i, pool in enumerate(pools, start=1)})
\ No newline at end of file
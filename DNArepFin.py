@@ -1,402 +1,496 @@
-from opentrons import protocol_api, types
-
-
-metadata = {
-    "apiLevel": "2.16",
-    "protocolName": "NBD1: DNA repair & end-prep",
-    "description": """First part of the SQK-NBD114.24 Nanopore protocol. Uses same reagents. Protocol assumes kit tubes are used.""",
-    "author": "Didrik Anttila"
-    }
-
-""" Material requirements
-
-DNA: DNA samples (either 1 but 2 replicates, or 2 unique)
-DCS: DNA Control Sample
-AXP: AXP beads 
-EB: Elution Buffer
-UII: NEBNext Ultra II End Prep Enzyme mix
-Ub: NEBNext Ultra II End Prep Reaction Buffer
-RM: NEBNext FFPE DNA Repair Mix
-RB: NEBNext FFPE DNA Repair Buffer
-H2O: de-ionized milliQ water
-Eth: 96% Ethanol
-QB: Invitrogen 1X dsDNA BR Working Solution
-
-Positioning in labware
-
-Ep tuberack
-A1: AXP 
-A2: 1.5mL Eppendorf
-A3: 1.5mL Eppendorf
-
-Temperature module
-A1: DNA ((400-1000ng))
-A2: DNA ((400-1000ng))
-A3: DCS ((1µL))
-B1: RM ((0.5µL))
-B2: UII ((0.75µL))
-C1: RB ((0.875µL))
-C2: Ub ((0.875µL))
-C3: EB ((105µL))
-D1: 1.5mL Eppendorf
-D2: 1.5mL Eppendorf
-
-Falcon tube rack
-A1: QB ((3-4mL?))
-A3: H2O ((? nearly full))
-B3: 80% Eth ((Near empty or empty))
-B4: 96% Eth ((Near full))
-"""
-
-# FSC454
-sample1_conc = 296 # ng/µL
-
-# FSC454
-sample2_conc = 296 # ng/µL
-
-# Because less than 4 barcodes, 1000ng used. (if more than 4, use 400ng)
-sample1_vol = round(1000.0/sample1_conc, 1)
-sample2_vol = round(1000.0/sample2_conc, 1)
-
-# Whether to dilute DCS with Elution buffer. Leave only as True if fresh DCS tube without Elution buffer added to it.
-# Pre-diluted tube should have a minimum of 1µL per sample. 
-dilute_DCS = True
-
-num_samples = 2
-if num_samples not in range(1, 24):
-    raise Exception("Number of samples not between 1 and 24.")
-
-
-
-def run(protocol: protocol_api.ProtocolContext):
-    # Labware
-    big_tips = protocol.load_labware("opentrons_96_tiprack_300ul", 8) 
-    small_tips = protocol.load_labware("opentrons_96_tiprack_20ul", 4)
-    reservoir = protocol.load_labware("nest_1_reservoir_290ml", 5) 
-    plate = protocol.load_labware("corning_96_wellplate_360ul_flat", 2) 
-    ep_tuberack = protocol.load_labware("opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap", 10)
-    falcon_tuberack = protocol.load_labware("opentrons_10_tuberack_falcon_4x50ml_6x15ml_conical", 6)
-
-    # Hardware modules
-    hs_mod = protocol.load_module(
-        module_name="heaterShakerModuleV1", 
-        location="1")
-    hs_adapter = hs_mod.load_adapter(
-        "opentrons_96_pcr_adapter") 
-    hs_plate = hs_adapter.load_labware(
-        "nest_96_wellplate_100ul_pcr_full_skirt") # ? 
-    
-
-    mag_mod = protocol.load_module(
-        module_name = "magnetic module gen2", 
-        location="9")
-    mag_plate = mag_mod.load_labware(
-        "nest_96_wellplate_100ul_pcr_full_skirt") 
-    
-    temp_mod = protocol.load_module(
-        module_name = "temperature module gen2",
-        location = "3")
-    temp_labware = temp_mod.load_labware("opentrons_24_aluminumblock_nest_1.5ml_snapcap")
-
-    # Pipette
-    # The p300 pipette is generally best suited for volumes in the range 30-300µL. 
-    # The P20 pipette is best suited for volumes in the range 1-20µL.
-    left_pipette = protocol.load_instrument("p300_single_gen2", "left", tip_racks=[big_tips]) 
-    right_pipette = protocol.load_instrument("p20_single_gen2", "right", tip_racks=[small_tips])
-
-
-
-
-    # Procedure / commands
-    hs_mod.close_labware_latch()
-
-    # User check before starting
-    protocol.pause(f"Sample concentrations are {sample1_conc} and {sample2_conc}, and their volumes are {sample1_vol} and {sample2_vol}. Does that seem correct?")
-    protocol.pause(f"Diluting DCS is set to {dilute_DCS}, is that correct?")
-
-    # Assumes beads in eppendorf tube in slot A1 were suspended immediately before starting the protocol.
-    protocol.comment("* Adding SUSPENDED beads to heater shaker wells")
-
-    left_pipette.pick_up_tip()
-    left_pipette.aspirate(50, ep_tuberack["A1"], rate=0.5) # Reactant tube
-    left_pipette.default_speed = 100
-    left_pipette.touch_tip(ep_tuberack["A1"], radius=0.6, speed=2)
-    left_pipette.touch_tip(ep_tuberack["A1"], radius=0.6, speed=2)
-    left_pipette.air_gap(volume=10)
-    left_pipette.dispense(60, hs_plate["H1"])
-    left_pipette.blow_out()
-    left_pipette.drop_tip()
-    left_pipette.default_speed = 400
-
-
-    temp_mod.set_temperature(celsius=4) # The protocol will wait for the temperature to be reached before proceeding, omit this step while testing.
-    protocol.comment(f"* Temperature module now 4C. The number of samples is {num_samples}")
-
-
-    
-    # Thaw AXP & DCS @ RT. Will assume this is done manually.
-    # skip to Dilute DCS with EB
-
-    
-    if dilute_DCS == True: # Set to false if you already have some
-        protocol.comment("* Diluting DCS with 105uL Elution buffer...")
-        #protocol.max_speeds['x'] = 20
-        left_pipette.transfer(105, temp_labware["C3"], temp_labware["A3"].bottom(z=18), rate=0.5, mix_after=(4, 105)) 
-        #del protocol.max_speeds['x']
-
-    # Add DNA sample & water to 11µL. ! (User must give the volume of sample)
-    
-
-    ############# The part of the protocol where the sample reaction mixture is made and handled before pelletting (This is the part where I am not sure what procedure is appropriate)
-    
-
-
-    # Multiply this 2-fold instead.
-    # if num_samples > 8:
-    #     mmix_factor = num_samples
-    # else:
-    #     mmix_factor = 8
-    mmix_factor = num_samples
-
-    mmix_tot_vol = mmix_factor * float(1+0.875+0.875+0.75+0.5)
-
-
-
-
-    # # Make sample master mix. Doing 8fold mix to avoid sub-1uL volume (which the pipette can't handle accurately).
-    protocol.comment(f"* Forgoing making DNA sample elution master mix by directly mixing it in the plate wells. Enough for {mmix_factor} samples)") 
-
-
-    # non-dynamic version, removes need for falcon tuberack A1.
-    #-Gets and dispenses DCS
-    right_pipette.pick_up_tip()
-    right_pipette.mix(5, 20, temp_labware["A3"].bottom(z=18))
-    right_pipette.blow_out()
-    right_pipette.aspirate(2*1, temp_labware["A3"].bottom(z=18), rate=0.5) # Reactant tube
-    right_pipette.dispense(1, hs_plate["A1"], rate=0.5)
-    right_pipette.dispense(1, hs_plate["A2"], rate=0.5)
-    right_pipette.drop_tip()
-    #-Gets and dispenses Repair buffer
-    right_pipette.pick_up_tip()
-    right_pipette.mix(5, 20, temp_labware["C1"])
-    right_pipette.blow_out()
-    right_pipette.aspirate(2*0.875, temp_labware["C1"], rate=0.5) # Reactant tube
-    right_pipette.dispense(0.875, hs_plate["A1"], rate=0.5) # It's uncertain if the robot can dispense these volumes with sufficient accuracy.
-    right_pipette.dispense(0.875, hs_plate["A2"], rate=0.5)
-    right_pipette.drop_tip()
-    #-Gets and dispenses End-prep buffer
-    right_pipette.pick_up_tip()
-    right_pipette.mix(5, 20, temp_labware["C2"])
-    right_pipette.blow_out()
-    right_pipette.aspirate(2*0.875, temp_labware["C2"], rate=0.5) # Reactant tube
-    right_pipette.dispense(0.875, hs_plate["A1"], rate=0.5)
-    right_pipette.dispense(0.875, hs_plate["A2"], rate=0.5)
-    right_pipette.drop_tip()
-    #-Gets and dispenses Ultra II
-    right_pipette.pick_up_tip()
-    right_pipette.mix(10, 20, temp_labware["B2"])
-    right_pipette.blow_out()
-    right_pipette.aspirate(2*0.75, temp_labware["B2"], rate=0.5) # Reactant tube
-    right_pipette.dispense(0.75, hs_plate["A1"], rate=0.5)
-    right_pipette.dispense(0.75, hs_plate["A2"], rate=0.5)
-    right_pipette.drop_tip()
-    #-Gets and dispenses FFPE DNA Repair mix
-    right_pipette.pick_up_tip()
-    right_pipette.mix(10, 20, temp_labware["B1"])
-    right_pipette.blow_out()
-    right_pipette.aspirate(2*0.5, temp_labware["B1"], rate=0.5) # Reactant tube
-    right_pipette.dispense(0.5, hs_plate["A1"], rate=0.5)
-    right_pipette.dispense(0.5, hs_plate["A2"], rate=0.5)
-    right_pipette.drop_tip()
-
-
-
-    protocol.comment(f"* Moving DNA samples to HS, and adding water to samples to a total of 11uL.")
-
-
-
-    right_pipette.transfer(
-        int(11-sample1_vol), 
-        falcon_tuberack["A3"].bottom(z=70), 
-        hs_plate["A1"]
-    ) 
-    right_pipette.transfer(
-        int(11-sample2_vol), 
-        falcon_tuberack["A3"].bottom(z=70), 
-        hs_plate["A2"]
-    ) 
-    
-    right_pipette.transfer(sample1_vol, temp_labware["A1"], hs_plate["A1"], mix_after=(4, 6), blow_out=True) 
-    right_pipette.transfer(sample2_vol, temp_labware["A1"], hs_plate["A2"], mix_after=(4, 6), blow_out=True) 
-
-    # Should use a thermal cycler for this, but in the meantime will code for heater shaker.
-
-    protocol.comment("* Initiating incubation. 5 min at RT, then 5 min at 65C.")
-    
-    protocol.delay(minutes=5)
-    hs_mod.set_target_temperature(65)
-    hs_mod.wait_for_temperature()
-    protocol.delay(minutes=5)
-    hs_mod.deactivate_heater()
-    
-    protocol.comment("* Transferring mixture to eppendorf tubes, and suspending beads.")
-    right_pipette.transfer(15+5, hs_plate["A1"], ep_tuberack["A2"], rate=0.7)
-    right_pipette.transfer(15+5, hs_plate["A2"], ep_tuberack["A3"], rate=0.7)
-
-    hs_mod.set_and_wait_for_shake_speed(900)
-    protocol.delay(seconds=2)
-    hs_mod.deactivate_shaker()
-
-    protocol.comment("* Transferring 15uL suspended AXP beads to samples. Mixing.")
-    
-    
-    
-    left_pipette.pick_up_tip()
-
-    for tube in [ep_tuberack["A2"], ep_tuberack["A3"]]:
-        
-        left_pipette.mix(3, 30, hs_plate["H1"])
-        left_pipette.blow_out()
-        left_pipette.touch_tip(hs_plate["H1"], radius=0.85, v_offset=-2, speed=3)
-        
-        right_pipette.pick_up_tip()
-        right_pipette.aspirate(15, hs_plate["H1"], rate=0.5)
-        right_pipette.default_speed = 100
-        #right_pipette.air_gap(volume=5)
-        right_pipette.touch_tip(hs_plate["H1"], radius=0.85, v_offset=-2, speed=3) # Perhaps greater radius needed to touch
-        right_pipette.touch_tip(hs_plate["H1"], radius=0.85, v_offset=-2, speed=3)
-        
-        right_pipette.dispense(15, tube)
-        right_pipette.default_speed = 400
-        right_pipette.drop_tip()
-        
-    left_pipette.drop_tip()
-
-
-    # Incubate on hula mixer for 5 min at RT (heater shaker)
-    
-    # Heater shaker + Pipette solution for this? Pipette mixing over time would cost too many pipette tips I think, if we have more than 1 sample.
-    protocol.pause("PAUSE: Take eppendorf tubes from tuberack position A2 and A3, and incubate for 5 minutes on Hula mixer. Handle with care! Or take directly to flexstation for quantification if you want to skip the washing step, in which case cancel the run.")
-    protocol.comment("* Incubate at RT for 5 min.")
-    protocol.pause("PAUSE: Resume ONLY if you have reattached eppendorf tubes with mixture to tube rack positions A2 and A3.")    
-    
-
-    # Put sample on magnet. Should be 30µL at this point.
-    mag_mod.engage(height_from_base=3.5) # 8.5 is the maximum engage height without raising the plate. 3.5 will make sure the pellet is close to the bottom.
-    protocol.comment("* Engaging magnet, and putting samples on it.")
-    left_pipette.transfer(30+5, ep_tuberack["A2"], mag_plate["A1"], blow_out=True)
-    left_pipette.transfer(30+5, ep_tuberack["A3"], mag_plate["A2"], blow_out=True)
-    
-    protocol.delay(minutes=5)
-    #################################################### End of the part of the protocol that handles the sample and reaction mixture
-    # Alternative in the future could be to put plastic film on plate and put the entire film on hula mixer.
-
-
-
-    # for 500µL 80% ethanol, we need 444 H2O & 55 96% Eth. # For two samples, double all of it!!!!
-    # left_pipette.transfer(444, falcon_tuberack["B3"], falcon_tuberack["A3"]) ! This actually automatically divides this into multiple transfer steps.
-    protocol.comment("* Per sample: transfer 444ul water to empty falcon tube, then add 56uL 96percent ethanol. Mix")
-    
-    left_pipette.transfer(num_samples*444, falcon_tuberack["A3"].bottom(z=60), falcon_tuberack["B3"].bottom(z=60))
-    
-    left_pipette.transfer(num_samples*55, falcon_tuberack["B4"].bottom(z=70), falcon_tuberack["B3"].bottom(z=60), mix_after=(3, 300)) # If volume greater than 300, it will contaminate the 96%eth
-
-
-    protocol.comment("* Dumping supernatants before washing.")
-    left_pipette.transfer(40, mag_plate["A1"], reservoir["A1"].bottom(z=30), rate=0.02)
-    left_pipette.transfer(40, mag_plate["A2"], reservoir["A1"].bottom(z=30), rate=0.02)
-    
-    protocol.comment("* Washing pellets, and dumping supernatant.")
-    
-    # With offset to pipette directly onto pellets. 
-    # Pellets form on the right side of wells of uneven number, and left side of wells of even number.
-    for i in range(2): # Repeat once
-
-        for mag_well in [mag_plate["A1"], mag_plate["A2"]]: # Once per well
-            left_pipette.pick_up_tip()
-            left_pipette.aspirate(200, falcon_tuberack["B3"]) # Height offset?
-            left_pipette.dispense(200, mag_well)
-            protocol.delay(seconds=10)
-            left_pipette.aspirate(210, mag_well, rate=0.3)
-            left_pipette.air_gap(volume=30)
-            left_pipette.dispense(240, reservoir["A1"].bottom(z=30))
-            left_pipette.blow_out()
-            left_pipette.drop_tip()
-
-
-    
-    protocol.comment("* Allowing pellets to dry for 30 sec, then disengaging magnet.")
-    protocol.delay(seconds=30)
-    mag_mod.disengage()
-
-    # No need to put samples on heater shaker, since only incubation is happening and the sample is going back to the magnet later anyway.
-    # ! Unless? Beads will probably not be suspended from this pipette mixing.
-    protocol.comment("* Resuspending pellet in 10uL water. Then incubating for 2 minutes at RT.") # Assuming room is RT
-    # !!! Will the water level be high enough to touch the pellet? If not, consider lower magnet height.
-    # ! Perhaps offset to splash on pellet?
-
-    # !!! Something happened that caused different volumes in the two wells. What happened? How to prevent it?
-    right_pipette.transfer(10, falcon_tuberack["A3"].bottom(z=60), mag_plate["A1"]) # Total volume about 15? No clue, evaluate through tests. 
-    right_pipette.transfer(10, falcon_tuberack["A3"].bottom(z=60), mag_plate["A2"])
-
-    # Resuspending beads via pip-mixing.
-    for mag_well in [mag_plate["A1"], mag_plate["A2"]]:
-        left_pipette.pick_up_tip()
-        left_pipette.mix(6, 20, mag_well)
-        left_pipette.blow_out()
-        left_pipette.drop_tip()
-
-    
-    protocol.delay(minutes=0.2) # Perhaps subtract pipmixing time
-    
-
-    protocol.comment("* Re-engaging magnet, and allowing pellet to form for 5 minutes.")
-    mag_mod.engage(height_from_base=8.5) # More magnet engagement is fine since we are now only interested in the eluate and no further washing will be done.
-    protocol.delay(minutes=5)
-    
-    protocol.comment("* Adding Broad Range Qubit solution to corning plate wells.")
-    left_pipette.transfer(199, falcon_tuberack["A1"].bottom(z=3), [plate["A1"], plate["A2"]]) # Double check before running
-
-    protocol.comment("* Putting 1ul eluted samples on flexstation plate for DNA quantification. (Position A1 & A2)") # ! Will be a flexstation plate.
-    
-    right_pipette.pick_up_tip()
-    right_pipette.aspirate(10+5, mag_plate["A1"], rate=0.1) 
-    
-    protocol.comment("* Putting End-prepped DNA sample 1 in empty eppendorf in temp module.")
-    right_pipette.dispense(10+5, temp_labware["D1"]) 
-    right_pipette.mix(5, 5, temp_labware["D1"]) 
-    right_pipette.blow_out()
-    protocol.comment("* Adding 1uL to corning plate well A1.")
-    right_pipette.aspirate(1, temp_labware["D1"])
-    right_pipette.dispense(1, plate["A1"])
-    right_pipette.blow_out()
-    right_pipette.drop_tip()
-
-    right_pipette.pick_up_tip()
-    right_pipette.aspirate(10+5, mag_plate["A2"], rate=0.1) 
-
-    
-    protocol.comment("* Putting End-prepped DNA sample 2 in empty eppendorf in temp module.")
-    right_pipette.dispense(10+5, temp_labware["D2"])
-    right_pipette.mix(5, 5, temp_labware["D2"]) 
-    right_pipette.blow_out()
-    protocol.comment("* Adding 1uL to corning plate well A2.")
-    right_pipette.aspirate(1, temp_labware["D2"])
-    right_pipette.dispense(1, plate["A2"])
-    right_pipette.blow_out()
-    right_pipette.drop_tip()
-
-    for well in [plate["A1"], plate["A2"]]:
-        left_pipette.pick_up_tip()
-        left_pipette.mix(5, 100, well)
-        left_pipette.blow_out()
-        left_pipette.drop_tip()
-
-
-    mag_mod.disengage()
-    hs_mod.open_labware_latch()
-    # Now quantify that eluate plate in Flexstation.
-
-
-
-    
+from opentrons import protocol_api, types
+import sys
+sys.path.append("/var/lib/jupyter/notebooks") # protocol_helpers.py has to be uploaded here, see README
+import protocol_helpers as helpers
+
+
+metadata = {
+    "apiLevel": "2.18", # Labware.set_offset(), for protocol_helpers.apply_offsets()
+    "protocolName": "NBD1: DNA repair & end-prep",
+    "description": """First part of the SQK-NBD114.24 Nanopore protocol. Uses same reagents. Protocol assumes kit tubes are used.""",
+    "author": "Didrik Anttila"
+    }
+
+""" Material requirements
+
+DNA: DNA samples (either 1 but 2 replicates, or 2 unique)
+DCS: DNA Control Sample
+AXP: AXP beads 
+EB: Elution Buffer
+UII: NEBNext Ultra II End Prep Enzyme mix
+Ub: NEBNext Ultra II End Prep Reaction Buffer
+RM: NEBNext FFPE DNA Repair Mix
+RB: NEBNext FFPE DNA Repair Buffer
+H2O: de-ionized milliQ water
+Eth: 96% Ethanol
+QB: Invitrogen 1X dsDNA BR Working Solution
+
+Positioning in labware, for 2 samples. For other numbers of samples the positions are planned by protocol_helpers.plan_layout(),
+print them with e.g. "python layout.py DNArepFin.py --set sample_concs=[296,296,296,296]".
+
+Ep tuberack
+A1: AXP ((60µL))
+A2: 1.5mL Eppendorf (not used if unattended)
+A3: 1.5mL Eppendorf (not used if unattended)
+B1: Qubit dsDNA BR Standard #2 100ng/µL ((min 40µL), only if include_standard_curve)
+B2: Qubit dsDNA BR Standard #1 0ng/µL ((min 40µL), only if include_standard_curve)
+
+Temperature module
+A1: DNA ((400-1000ng))
+A2: DNA ((400-1000ng))
+A3: DCS ((1µL))
+B1: RM ((0.5µL per sample, at least 25µL))
+B2: UII ((0.75µL per sample, at least 25µL))
+C1: RB ((0.875µL per sample, at least 25µL))
+C2: Ub ((0.875µL per sample, at least 25µL))
+C3: EB ((110µL))
+D1: 1.5mL Eppendorf
+D2: 1.5mL Eppendorf
+
+Falcon tube rack
+A1: QB ((at least 3.5mL, see reagent_plan.py))
+A3: H2O ((Nearly full, see reagent_plan.py))
+B3: 80% Eth ((Near empty or empty))
+B4: 96% Eth ((Near full))
+
+With use_thermocycler the thermocycler covers slots 7, 8, 10 and 11. The 300µL tips go in slot 5 instead of the waste reservoir,
+the waste in an empty 50mL falcon tube in A4, and the Eppendorf tubes on the temperature module, see layout.py.
+"""
+
+# Concentration of each sample in ng/µL, one per sample.
+# FSC454, FSC454
+sample_concs = [296, 296]
+
+# Up to 4 barcodes, 1000ng used. (if more than 4, use 400ng)
+num_samples = len(sample_concs)
+sample_ng = 1000 if num_samples <= 4 else 400
+sample_vols = [round(sample_ng/conc, 1) for conc in sample_concs]
+
+# Sample IDs, as given to handoff.py with --sample. BarcodeLigationFin.py finds the end-prepped samples by them in deck_state.json.
+sample_ids = [str(i) for i in range(1, num_samples + 1)]
+
+# Whether to dilute DCS with Elution buffer. Leave only as True if fresh DCS tube without Elution buffer added to it.
+# Pre-diluted tube should have a minimum of 1µL per sample. 
+dilute_DCS = True
+
+# Whether to make the Qubit standard series in column 3 of the corning plate, next to the samples, while the end-prep incubates.
+# One Flexstation read then gives both the standard curve and the sample concentrations.
+include_standard_curve = False
+standard_column = 3
+
+# Whether to continue an interrupted run from its first unfinished step. Set to False to always start from the beginning.
+resume_run = True
+
+# Whether to dispense the wash ethanol of both washes into all mag wells with one tip, and remove the supernatant of each well
+# with one tip for both washes (returned to the rack in between). Otherwise every well gets a new tip for each wash.
+single_tip_wash = True
+
+# Unattended mode runs from sample loading to the quantification plate without any operator pauses.
+# The confirmations are replaced by the checks below, and the 5 minute bead incubation is done on the heater shaker instead of a hula mixer.
+unattended = False
+
+# Whether to run the end-prep incubation (5 min at 20C, 5 min at 65C) in a thermocycler with a heated lid, instead of on the heater shaker.
+# The reactions are then made in the thermocycler plate and moved to heater shaker wells for the beads, which are shaken
+# in lieu of hula mixing. Up to 8 samples (7 with the standard curve), as the Eppendorf tubes move to the temperature module.
+use_thermocycler = False
+
+if num_samples not in range(1, 25):
+    raise Exception("Number of samples not between 1 and 24.")
+if len(sample_ids) != num_samples:
+    raise Exception(f"{len(sample_ids)} sample IDs for {num_samples} samples.")
+
+# Pre-flight checks, so that a bad value stops the protocol before it starts instead of halfway.
+for conc, vol in zip(sample_concs, sample_vols):
+    if vol > 11:
+        raise Exception(f"A sample of {conc}ng/µL needs {vol}µL for {sample_ng}ng, which does not fit in the 11µL reaction.")
+if not isinstance(dilute_DCS, bool):
+    raise Exception("dilute_DCS has to be True or False.")
+
+# Positions of the tubes and wells for the number of samples, see "Positioning in labware" above.
+layout = helpers.plan_layout("endprep", num_samples, standard_curve=include_standard_curve, standard_column=standard_column,
+                             dilute_DCS=dilute_DCS, unattended=unattended, thermocycler=use_thermocycler)
+
+# Starting volume (µL) of each reagent: (labware, well, µL). They are shown in the liquid setup of the Opentrons app,
+# and preflight.py checks that no tube runs dry. Shared kit tubes hold what the samples need plus 5µL that the pipette can't reach,
+# and at least the 20µL each tube is mixed with before it is dosed (see reagent_plan.py).
+# The AXP tube fills the bead wells with 15µL per sample plus 20µL each, and keeps 10µL.
+reagents = layout.reagents({
+    "AXP": sum(helpers.bead_aliquots([15]*num_samples, 20)) + 10,
+    "DNA": [vol + 5 for vol in sample_vols],
+    "DCS": 1 if dilute_DCS else num_samples + 5,
+    "RM": max(0.5*num_samples, 20) + 5,
+    "UII": max(0.75*num_samples, 20) + 5,
+    "RB": max(0.875*num_samples, 20) + 5,
+    "Ub": max(0.875*num_samples, 20) + 5,
+    "EB": 110 if dilute_DCS else 0,
+    "Standard #2": 40 if include_standard_curve else 0,
+    "Standard #1": 40 if include_standard_curve else 0,
+    "Qubit": max(3500, helpers.QUBIT_VOL*num_samples + helpers.STANDARD_QUBIT_VOL*len(helpers.STANDARD_SERIES) + 1000),
+    "H2O": 45000,
+    "96% Eth": 45000,
+})
+
+
+
+def run(protocol: protocol_api.ProtocolContext):
+    # Labware
+    small_tips = protocol.load_labware("opentrons_96_tiprack_20ul", 4)
+    plate = protocol.load_labware("corning_96_wellplate_360ul_flat", 2) 
+    if use_thermocycler:
+        # The thermocycler covers slots 7, 8, 10 and 11.
+        big_tips = protocol.load_labware("opentrons_96_tiprack_300ul", 5)
+        tc_mod = protocol.load_module("thermocyclerModuleV2")
+        tc_plate = tc_mod.load_labware("nest_96_wellplate_100ul_pcr_full_skirt")
+    else:
+        big_tips = protocol.load_labware("opentrons_96_tiprack_300ul", 8) 
+        reservoir = protocol.load_labware("nest_1_reservoir_290ml", 5) 
+        ep_tuberack = protocol.load_labware("opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap", 10)
+    falcon_tuberack = protocol.load_labware("opentrons_10_tuberack_falcon_4x50ml_6x15ml_conical", 6)
+
+    # Hardware modules
+    hs_mod = protocol.load_module(
+        module_name="heaterShakerModuleV1", 
+        location="1")
+    hs_adapter = hs_mod.load_adapter(
+        "opentrons_96_pcr_adapter") 
+    hs_plate = hs_adapter.load_labware(
+        "nest_96_wellplate_100ul_pcr_full_skirt") # ? 
+    
+
+    mag_mod = protocol.load_module(
+        module_name = "magnetic module gen2", 
+        location="9")
+    mag_plate = mag_mod.load_labware(
+        "nest_96_wellplate_100ul_pcr_full_skirt") 
+    
+    temp_mod = protocol.load_module(
+        module_name = "temperature module gen2",
+        location = "3")
+    temp_labware = temp_mod.load_labware("opentrons_24_aluminumblock_nest_1.5ml_snapcap")
+
+    # Pipette
+    # The p300 pipette is generally best suited for volumes in the range 30-300µL. 
+    # The P20 pipette is best suited for volumes in the range 1-20µL.
+    left_pipette = protocol.load_instrument("p300_single_gen2", "left", tip_racks=[big_tips]) 
+    right_pipette = protocol.load_instrument("p20_single_gen2", "right", tip_racks=[small_tips])
+    pipettes = [left_pipette, right_pipette] # helpers.transfer() picks the pipette for each volume
+
+
+
+
+    # Falcon tubes are aspirated from just below their tracked liquid surface. The kit tubes in the temperature module
+    # aren't the 1.5mL tubes of its labware definition, so they keep their fixed heights.
+    labware = {"temp_labware": temp_labware, "falcon_tuberack": falcon_tuberack, "hs_plate": hs_plate, "mag_plate": mag_plate, "plate": plate}
+    if use_thermocycler:
+        labware["tc_plate"] = tc_plate
+    else:
+        labware["ep_tuberack"] = ep_tuberack
+    labware = layout.load_spare_racks(protocol, labware)
+    helpers.apply_offsets(protocol, [big_tips, small_tips, hs_adapter] + ([] if use_thermocycler else [reservoir]) + list(labware.values()))
+    tracker = helpers.LiquidTracker()
+    helpers.load_reagents(protocol, reagents, labware, tracker)
+    wells = layout.wells(labware)
+    waste = wells["Waste"].top(z=-5) if use_thermocycler else reservoir["A1"].bottom(z=30)
+
+    # Procedure / commands
+    hs_mod.close_labware_latch()
+    if use_thermocycler:
+        tc_mod.open_lid() # Also when a resumed run stopped during the incubation
+    settings = {"sample_concs": sample_concs, "sample_ids": sample_ids, "dilute_DCS": dilute_DCS, "unattended": unattended,
+                "use_thermocycler": use_thermocycler, "include_standard_curve": include_standard_curve,
+                "standard_column": standard_column, "single_tip_wash": single_tip_wash}
+    steps = helpers.Checkpoint(protocol, "DNArepFin", pipettes, resume=resume_run, tracker=tracker, settings=settings, attended=not unattended)
+    quant_wells = wells["Quant"]
+
+    # User check before starting
+    concs = ", ".join(str(conc) for conc in sample_concs)
+    vols = ", ".join(str(vol) for vol in sample_vols)
+    if unattended:
+        protocol.comment(f"* Sample concentrations are {concs}, and their volumes are {vols}. Diluting DCS is set to {dilute_DCS}.")
+    else:
+        protocol.pause(f"Sample concentrations are {concs}, and their volumes are {vols}. Does that seem correct?")
+        protocol.pause(f"Diluting DCS is set to {dilute_DCS}, is that correct?")
+    # Wells where the beads bind the DNA. Unattended, this happens in the heater shaker wells of the reaction,
+    # and with the thermocycler in the heater shaker wells the reactions are moved to. These are shaken in lieu of hula mixing.
+    shake_binding = unattended or use_thermocycler
+    if unattended and not use_thermocycler:
+        binding_wells = wells["Reaction"]
+    else:
+        binding_wells = wells["Binding"]
+
+    if steps.pending("add_beads"):
+        # Assumes beads in eppendorf tube in slot A1 were suspended immediately before starting the protocol.
+        # Each bead well holds the beads of up to helpers.BEAD_WELL_SAMPLES samples, 15µL each plus 20µL.
+        protocol.comment("* Adding SUSPENDED beads to heater shaker wells")
+
+        left_pipette.pick_up_tip()
+        for bead_well, bead_vol in zip(wells["Beads"], helpers.bead_aliquots([15]*len(binding_wells), 20)):
+            left_pipette.aspirate(bead_vol, wells["AXP"], rate=0.5) # Reactant tube
+            left_pipette.default_speed = 100
+            left_pipette.touch_tip(wells["AXP"], radius=0.6, speed=2)
+            left_pipette.touch_tip(wells["AXP"], radius=0.6, speed=2)
+            left_pipette.air_gap(volume=10)
+            left_pipette.dispense(bead_vol + 10, bead_well)
+            left_pipette.blow_out()
+            left_pipette.default_speed = 400
+        left_pipette.drop_tip()
+        steps.finish("add_beads")
+
+
+
+    temp_mod.set_temperature(celsius=4) # The protocol will wait for the temperature to be reached before proceeding, omit this step while testing.
+    protocol.comment(f"* Temperature module now 4C. The number of samples is {num_samples}")
+
+
+    
+    # Thaw AXP & DCS @ RT. Will assume this is done manually.
+    # skip to Dilute DCS with EB
+
+    
+    if dilute_DCS == True and steps.pending("dilute_dcs"): # Set to false if you already have some
+        protocol.comment("* Diluting DCS with 105uL Elution buffer...")
+        #protocol.max_speeds['x'] = 20
+        helpers.transfer(pipettes, 105, wells["EB"], wells["DCS"].bottom(z=18), rate=0.5, mix_after=(4, 105)) 
+        #del protocol.max_speeds['x']
+        steps.finish("dilute_dcs")
+
+    if steps.pending("reaction_setup"):
+        # Add DNA sample & water to 11µL. ! (User must give the volume of sample)
+
+
+        ############# The part of the protocol where the sample reaction mixture is made and handled before pelletting (This is the part where I am not sure what procedure is appropriate)
+
+
+
+        # Multiply this 2-fold instead.
+        # if num_samples > 8:
+        #     mmix_factor = num_samples
+        # else:
+        #     mmix_factor = 8
+        mmix_factor = num_samples
+
+        mmix_tot_vol = mmix_factor * float(1+0.875+0.875+0.75+0.5)
+
+
+
+
+        # # Make sample master mix. Doing 8fold mix to avoid sub-1uL volume (which the pipette can't handle accurately).
+        protocol.comment(f"* Forgoing making DNA sample elution master mix by directly mixing it in the plate wells. Enough for {mmix_factor} samples)") 
+
+        def dose(source, volume, mixes):
+            # Mixes a reagent tube and doses it to all reaction wells with one tip, as many wells per trip as fit in the P20.
+            right_pipette.pick_up_tip()
+            right_pipette.mix(mixes, 20, source)
+            right_pipette.blow_out()
+            per_trip = int(right_pipette.max_volume // volume)
+            for start in range(0, num_samples, per_trip):
+                trip = wells["Reaction"][start:start+per_trip]
+                right_pipette.aspirate(len(trip)*volume, source, rate=0.5) # Reactant tube
+                for well in trip:
+                    right_pipette.dispense(volume, well, rate=0.5) # It's uncertain if the robot can dispense these volumes with sufficient accuracy.
+            right_pipette.drop_tip()
+
+        # non-dynamic version, removes need for falcon tuberack A1.
+        dose(wells["DCS"].bottom(z=18), 1, 5) # DCS
+        dose(wells["RB"], 0.875, 5) # Repair buffer
+        dose(wells["Ub"], 0.875, 5) # End-prep buffer
+        dose(wells["UII"], 0.75, 10) # Ultra II
+        dose(wells["RM"], 0.5, 10) # FFPE DNA Repair mix
+
+
+
+        protocol.comment(f"* Moving DNA samples to HS, and adding water to samples to a total of 11uL.")
+
+
+
+        for vol, well in zip(sample_vols, wells["Reaction"]):
+            # To 0.1µL, the pipettes' resolution. Less water than the P20 can move is left out.
+            water = round(11 - vol, 1)
+            if water < right_pipette.min_volume:
+                protocol.comment(f"* {water}uL water is below the P20 minimum, so {well.well_name} gets no water.")
+                continue
+            helpers.transfer(
+                pipettes, 
+                water, 
+                tracker.source(wells["H2O"], water), 
+                well
+            ) 
+
+        for vol, sample, well in zip(sample_vols, wells["DNA"], wells["Reaction"]):
+            helpers.transfer(pipettes, vol, sample, well, mix_after=(4, 6), blow_out=True) 
+        steps.finish("reaction_setup")
+ 
+
+    if steps.pending("incubation"):
+        # Without the thermocycler the heater shaker does the incubation, with a slower ramp and no lid.
+        if use_thermocycler:
+            protocol.comment("* Initiating incubation in the thermocycler. 5 min at 20C, then 5 min at 65C.")
+            tc_mod.set_block_temperature(20)
+            tc_mod.set_lid_temperature(75) # Keeps condensation off the lid during the 65C step
+            tc_mod.close_lid()
+        else:
+            protocol.comment("* Initiating incubation. 5 min at RT, then 5 min at 65C.")
+
+        with helpers.during_delay(protocol, minutes=5):
+            if include_standard_curve and steps.pending("standard_curve"):
+                std_wells = wells["Standard series"]
+                helpers.fill_qubit_wells(protocol, left_pipette, wells["Qubit"], quant_wells, std_wells, tracker=tracker)
+                helpers.add_standard_curve(protocol, right_pipette, wells["Standard #2"], wells["Standard #1"], std_wells)
+                steps.finish("standard_curve")
+        if use_thermocycler:
+            tc_mod.set_block_temperature(65, hold_time_minutes=5, block_max_volume=15)
+            tc_mod.set_block_temperature(20) # Cooled back for the beads
+            tc_mod.deactivate_lid()
+            tc_mod.open_lid()
+        else:
+            hs_mod.set_target_temperature(65)
+            hs_mod.wait_for_temperature()
+            protocol.delay(minutes=5)
+            hs_mod.deactivate_heater()
+        steps.finish("incubation")
+
+    
+    if steps.pending("bead_binding"):
+        if binding_wells is not wells["Reaction"]:
+            protocol.comment(f"* Transferring mixture to {'heater shaker wells' if use_thermocycler else 'eppendorf tubes'}, and suspending beads.")
+            for well, tube in zip(wells["Reaction"], binding_wells):
+                helpers.transfer(pipettes, 15+5, well, tube, rate=0.7)
+
+        hs_mod.set_and_wait_for_shake_speed(900)
+        protocol.delay(seconds=2)
+        hs_mod.deactivate_shaker()
+
+        protocol.comment("* Transferring 15uL suspended AXP beads to samples.")
+        # One P20 tip for all samples, dispensing above the 35µL each holds with its beads, and a bead well is only mixed again
+        # once its beads have had time to settle (see helpers.add_beads).
+        helpers.add_beads(protocol, left_pipette, right_pipette, wells["Beads"], binding_wells, 15, 30, sample_vol=15+5, tracker=tracker)
+        steps.finish("bead_binding")
+
+
+
+    if steps.pending("hula_incubation"):
+        if shake_binding:
+            protocol.comment("* Incubating at RT for 5 min on the heater shaker, in lieu of hula mixing.")
+            hs_mod.set_and_wait_for_shake_speed(1000)
+            protocol.delay(minutes=5)
+            hs_mod.deactivate_shaker()
+        else:
+            # Incubate on hula mixer for 5 min at RT (heater shaker)
+
+            # Heater shaker + Pipette solution for this? Pipette mixing over time would cost too many pipette tips I think, if we have more than 1 sample.
+            protocol.pause(f"PAUSE: Take eppendorf tubes from {layout.where('Binding')}, and incubate for 5 minutes on Hula mixer. Handle with care! Or take directly to flexstation for quantification if you want to skip the washing step, in which case cancel the run (a later run of the same samples today offers to resume after this step).")
+            protocol.comment("* Incubate at RT for 5 min.")
+            protocol.pause(f"PAUSE: Resume ONLY if you have reattached eppendorf tubes with mixture to {layout.where('Binding')}.")
+        steps.finish("hula_incubation")
+    
+    
+
+    if steps.pending("to_magnet"):
+        # Put sample on magnet. Should be 30µL at this point.
+        mag_mod.engage(height_from_base=3.5) # 8.5 is the maximum engage height without raising the plate. 3.5 will make sure the pellet is close to the bottom.
+        protocol.comment("* Engaging magnet, and putting samples on it.")
+        for tube, mag_well in zip(binding_wells, wells["Mag"]):
+            helpers.transfer(pipettes, 30+5, tube, mag_well, blow_out=True)
+
+        # The 80% ethanol for the washes is made while the beads pellet.
+        with helpers.during_delay(protocol, minutes=5):
+            helpers.prepare_ethanol(
+                protocol, 
+                left_pipette, 
+                wells["H2O"], 
+                wells["96% Eth"], 
+                wells["80% Eth"], 
+                helpers.ethanol_volume(num_samples),
+                tracker=tracker
+            )
+        #################################################### End of the part of the protocol that handles the sample and reaction mixture
+        # Alternative in the future could be to put plastic film on plate and put the entire film on hula mixer.
+        steps.finish("to_magnet")
+
+
+
+    if steps.pending("washes"):
+        protocol.comment("* Dumping supernatants before washing.")
+        mag_mod.engage(height_from_base=3.5) # Already engaged, unless the run was resumed from this step.
+        for mag_well in wells["Mag"]:
+            helpers.transfer(pipettes, 40, mag_well, waste, rate=0.02)
+
+        protocol.comment("* Washing pellets, and dumping supernatant.")
+
+        # With offset to pipette directly onto pellets. 
+        # Pellets form on the right side of wells of uneven number, and left side of wells of even number.
+        helpers.ethanol_wash(
+            protocol, 
+            left_pipette, 
+            wells["80% Eth"], 
+            wells["Mag"], 
+            waste, 
+            single_tip=single_tip_wash, 
+            removal_rate=0.3,
+            tracker=tracker
+        )
+
+
+        protocol.comment("* Allowing pellets to dry for 30 sec, then disengaging magnet.")
+        protocol.delay(seconds=30)
+        mag_mod.disengage()
+        steps.finish("washes")
+
+
+    if steps.pending("elution"):
+        # No need to put samples on heater shaker, since only incubation is happening and the sample is going back to the magnet later anyway.
+        # ! Unless? Beads will probably not be suspended from this pipette mixing.
+        protocol.comment("* Resuspending pellet in 10uL water. Then incubating for 2 minutes at RT.") # Assuming room is RT
+        # !!! Will the water level be high enough to touch the pellet? If not, consider lower magnet height.
+        # ! Perhaps offset to splash on pellet?
+
+        # !!! Something happened that caused different volumes in the two wells. What happened? How to prevent it?
+        for mag_well in wells["Mag"]:
+            helpers.transfer(pipettes, 10, tracker.source(wells["H2O"], 10), mag_well) # Total volume about 15? No clue, evaluate through tests. 
+
+        # Resuspending beads via pip-mixing.
+        for mag_well in wells["Mag"]:
+            left_pipette.pick_up_tip()
+            left_pipette.mix(6, 20, mag_well)
+            left_pipette.blow_out()
+            left_pipette.drop_tip()
+
+
+        protocol.delay(minutes=0.2) # Perhaps subtract pipmixing time
+        steps.finish("elution")
+
+    
+
+    if steps.pending("quantification"):
+        protocol.comment("* Re-engaging magnet, and allowing pellet to form for 5 minutes.")
+        mag_mod.engage(height_from_base=8.5) # More magnet engagement is fine since we are now only interested in the eluate and no further washing will be done.
+        with helpers.during_delay(protocol, minutes=5):
+            if not include_standard_curve: # Otherwise already filled during the incubation
+                helpers.fill_qubit_wells(protocol, left_pipette, wells["Qubit"], quant_wells, tracker=tracker)
+
+        protocol.comment(f"* Putting 1ul eluted samples on flexstation plate for DNA quantification. ({layout.where('Quant')})") # ! Will be a flexstation plate.
+
+        for i, (mag_well, eluate, quant_well) in enumerate(zip(wells["Mag"], wells["Eluate"], quant_wells), start=1):
+            right_pipette.pick_up_tip()
+            right_pipette.aspirate(10+5, mag_well, rate=0.1) 
+
+            protocol.comment(f"* Putting End-prepped DNA sample {i} in empty eppendorf in {layout.where(f'Eluate {i}')}.")
+            right_pipette.dispense(10+5, eluate) 
+            right_pipette.mix(5, 5, eluate) 
+            right_pipette.blow_out()
+            protocol.comment(f"* Adding 1uL to corning plate well {quant_well.well_name}.")
+            helpers.add_quant_aliquot(right_pipette, eluate, quant_well)
+            right_pipette.drop_tip()
+        steps.finish("quantification")
+
+
+
+    mag_mod.disengage()
+    hs_mod.open_labware_latch()
+    if use_thermocycler:
+        tc_mod.deactivate_block()
+    # The end-prepped samples stay in their tubes for BarcodeLigationFin.py, 15µL each less the quantification aliquot.
+    layout.save_state(protocol, {f"Eluate {i}": ("End-prepped DNA", 10 + 5 - helpers.QUANT_VOL, sample)
+                                 for i, sample in enumerate(sample_ids, start=1)})
+    steps.close()
+    # Now quantify that eluate plate in Flexstation.
\ No newline at end of file
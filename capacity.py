@@ -0,0 +1,231 @@
+""" Throughput planner: how many samples a run of each stage takes within a time, tip and deck slot budget.
+
+    python capacity.py
+    python capacity.py --until 17:00 --racks 2
+    python capacity.py DNArepFin.py --minutes 180 --slots 9
+
+Every configuration of the stage protocols in SWEEPS, each number of samples with each combination of options, is recorded
+with protocol_trace.py in parallel processes. A configuration the protocol refuses, or that runs out of tips or deck room,
+is left out. The rest are compared by samples, estimated run time, tips and deck slots, and the Pareto front of each stage
+is printed: the configurations that no other configuration beats on all four.
+
+With a budget (--until or --minutes, --racks, --slots) the planner recommends the configuration that gets the most samples
+through the stage in the time, counting back-to-back runs that each start with a full box of each tip size.
+The run time is estimated from the commands with the rough timings below, so use it to compare configurations and to plan
+a day, not to the minute. Operator pauses are counted as PAUSE_TIME each.
+"""
+import argparse
+import datetime
+import itertools
+import multiprocessing
+import os
+import re
+import sys
+
+import compile_plan
+import protocol_helpers
+import protocol_trace
+
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# Per protocol: the parameter that sets the number of samples, its value for n samples, the numbers of samples to try,
+# and the options to combine. Adapter ligation counts pools (flow cells) as its samples.
+SWEEPS = {
+    "DNArepFin.py": ("sample_concs", lambda n: [296]*n, range(1, 25), {
+        "unattended": [False, True],
+        "use_thermocycler": [False, True],
+        "single_tip_wash": [True, False],
+        "include_standard_curve": [False, True],
+    }),
+    "BarcodeLigationFin.py": ("sample_concs", lambda n: [50]*n, range(1, 25), {
+        "single_tip_wash": [True, False],
+        "include_standard_curve": [False, True],
+    }),
+    "AdapterligationFin.py": ("pools", lambda n: [f"Flongle {i}" for i in range(1, n + 1)], range(1, 7), {}),
+}
+
+# Rough OT2 timings (s) besides protocol_helpers.TIP_TIME and TRIP_TIME, which the transfers are planned with.
+TIP_MOVE_TIME = 3 # blow out, touch tip, air gap or move
+PAUSE_TIME = 120 # An operator pause, to read the message and act on it
+MODULE_TIMES = {
+    "set_temperature": 600, # Temperature module from room temperature to 4C
+    "wait_for_temperature": 300, # Heater shaker to 37-65C
+    "set_lid_temperature": 300,
+    "set_block_temperature": 60, # Thermocycler ramp, plus the hold time
+    "open_lid": 20,
+    "close_lid": 20,
+    "set_and_wait_for_shake_speed": 5,
+    "engage": 3,
+    "disengage": 3,
+    "close_labware_latch": 3,
+    "open_labware_latch": 3,
+}
+THERMOCYCLER_SLOTS = 4 # Slots 7, 8, 10 and 11
+
+
+def estimate_seconds(trace):
+    """ Estimated run time of a Trace in seconds. The steps inside a helpers.during_delay() block overlap its delay. """
+    seconds = 0.0
+    timers = []
+    for entry in trace.commands:
+        if entry["command"] == "timer":
+            timers.append(seconds)
+        elif entry["command"] == "delay":
+            if entry.get("timed"):
+                seconds = max(seconds, timers.pop() + entry["seconds"])
+            else:
+                seconds += entry["seconds"]
+        else:
+            seconds += command_seconds(entry)
+    return seconds
+
+
+def command_seconds(entry):
+    """ Estimated time of a trace command other than a delay, in seconds. """
+    command = entry["command"]
+    if command == "pause":
+        return PAUSE_TIME
+    if command in ["pick_up_tip", "drop_tip", "return_tip"]:
+        return protocol_helpers.TIP_TIME/2
+    if command in ["aspirate", "dispense", "mix"]:
+        flow_rate = entry["pipette"].flow_rate.aspirate*entry.get("rate", 1.0)
+        return protocol_helpers.TRIP_TIME/2 + entry["volume"]*2*entry.get("repetitions", 0.5)/flow_rate
+    if command in ["blow_out", "touch_tip", "air_gap", "move_to"]:
+        return TIP_MOVE_TIME
+    if "module" in entry:
+        params = entry["params"]
+        return MODULE_TIMES.get(command, 0) + params.get("hold_time_minutes", 0)*60 + params.get("hold_time_seconds", 0)
+    return 0
+
+
+def deck_slots(trace, minimal=False):
+    """ Number of deck slots a Trace's protocol loads, or with 'minimal' only those compile_plan.py --minimal loads. """
+    keep = compile_plan.used(trace) if minimal else {id(item) for item in trace.modules + trace.labware}
+    slots = 0
+    for item in trace.modules + trace.labware:
+        if id(item) not in keep or item is trace.trash or not isinstance(item.parent, str):
+            continue
+        slots += THERMOCYCLER_SLOTS if "thermocycler" in getattr(item, "name", "").lower() else 1
+    return slots
+
+
+def evaluate(config):
+    """ Records one configuration, (protocol, samples, options), and returns its figures, or the reason it doesn't run. """
+    protocol, samples, options = config
+    parameter, value, _, _ = SWEEPS[protocol]
+    trace = protocol_trace.record(os.path.join(FOLDER, protocol), **{parameter: value(samples)}, **options)
+    result = {"protocol": protocol, "samples": samples, "options": options}
+    if trace.error is not None:
+        result["error"] = str(trace.error)
+        return result
+    # Tips that are returned to their rack and picked up again count once.
+    tip_wells = {}
+    for entry in trace.commands:
+        if entry["command"] == "pick_up_tip":
+            tip_wells.setdefault(entry["pipette"].name, set()).add(entry["well"])
+    tips = {name: len(wells) for name, wells in tip_wells.items()}
+    result.update(minutes=round(estimate_seconds(trace)/60, 1), tips=tips, slots=deck_slots(trace),
+                  minimal_slots=deck_slots(trace, minimal=True))
+    return result
+
+
+def configurations(protocols):
+    """ All (protocol, samples, options) of the SWEEPS of 'protocols'. """
+    for protocol in protocols:
+        _, _, counts, options = SWEEPS[protocol]
+        for samples in counts:
+            for values in itertools.product(*options.values()):
+                yield protocol, samples, dict(zip(options, values))
+
+
+def pareto_front(results):
+    """ The results that no other result matches or beats on samples, minutes, tips and slots, and beats on one of them. """
+    def figures(result):
+        return (-result["samples"], result["minutes"], sum(result["tips"].values()), result["slots"])
+
+    front = []
+    for result in results:
+        mine = figures(result)
+        dominated = any(all(a <= b for a, b in zip(figures(other), mine)) and figures(other) != mine for other in results)
+        if not dominated:
+            front.append(result)
+    return sorted(front, key=lambda result: (result["samples"], result["minutes"]))
+
+
+def runs_within(result, minutes, racks):
+    """ Back-to-back runs of a configuration that fit in 'minutes', each with a full box of each tip size from 'racks' boxes. """
+    return min(int(minutes // result["minutes"]), racks)
+
+
+def recommend(results, minutes, racks, slots):
+    """ The configuration that gets the most samples through in the budget, and its number of runs. Fewer minutes break ties. """
+    options = [(runs_within(result, minutes, racks), result) for result in results if result["slots"] <= slots]
+    options = [(runs, result) for runs, result in options if runs > 0]
+    if not options:
+        return None, 0
+    runs, result = max(options, key=lambda option: (option[0]*option[1]["samples"], -option[0]*option[1]["minutes"]))
+    return result, runs
+
+
+def describe(result):
+    options = ", ".join(f"{key}={value}" for key, value in result["options"].items())
+    tips = ", ".join(f"{tips} {name.split('_')[0].upper()}" for name, tips in sorted(result["tips"].items()))
+    return (f"{result['samples']:3} samples  {result['minutes']:6.1f} min  tips {tips:16}  {result['slots']} slots "
+            f"({result['minimal_slots']} minimal)  {options}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plans the samples per run of the stage protocols under time, tip and slot budgets.")
+    parser.add_argument("protocols", nargs="*", metavar="protocol", help=f"Stage protocols (default: {', '.join(SWEEPS)})")
+    parser.add_argument("--until", metavar="HH:MM", help="Time budget until this time today, from now")
+    parser.add_argument("--minutes", type=float, help="Time budget in minutes")
+    parser.add_argument("--racks", type=int, default=1, help="Tip boxes of each size for the budget (default 1)")
+    parser.add_argument("--slots", type=int, default=11, help="Deck slots for the budget (default 11)")
+    parser.add_argument("--processes", type=int, help="Parallel processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    minutes = args.minutes
+    if args.until:
+        now = datetime.datetime.now()
+        until = datetime.datetime.combine(now.date(), datetime.time.fromisoformat(args.until))
+        minutes = (until - now).total_seconds()/60
+        if minutes <= 0:
+            sys.exit(f"{args.until} has passed.")
+
+    protocols = [os.path.basename(protocol) for protocol in args.protocols] or list(SWEEPS)
+    unknown = [protocol for protocol in protocols if protocol not in SWEEPS]
+    if unknown:
+        sys.exit(f"No sweep for {', '.join(unknown)}, add it to SWEEPS.")
+    configs = list(configurations(protocols))
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.map(evaluate, configs)
+
+    for protocol in protocols:
+        ran = [result for result in results if result["protocol"] == protocol and "error" not in result]
+        refused = [result for result in results if result["protocol"] == protocol and "error" in result]
+        print(f"{protocol}: {len(ran)} of {len(ran) + len(refused)} configurations run, up to {max((result['samples'] for result in ran), default=0)} samples.")
+        # One line per kind of refusal, with numbers left out, from the fewest samples it happens at.
+        reasons = {}
+        for result in sorted(refused, key=lambda result: result["samples"]):
+            reasons.setdefault(re.sub(r"[\d.]+", "N", result["error"]), result)
+        for result in reasons.values():
+            print(f"  From {result['samples']} samples: {result['error']}")
+        print("  Pareto front of samples, minutes, tips and slots:")
+        for result in pareto_front(ran):
+            print(f"  {describe(result)}")
+
+        if minutes is not None:
+            result, runs = recommend(ran, minutes, args.racks, args.slots)
+            budget = f"{round(minutes)} min, {args.racks} box{'es' if args.racks > 1 else ''} of each tip size, {args.slots} slots"
+            if result is None:
+                print(f"  Nothing fits in {budget}.")
+            else:
+                print(f"  Recommended for {budget}: {runs} run{'s' if runs > 1 else ''} of {runs*result['samples']} samples in total, "
+                      f"{round(runs*result['minutes'])} min:")
+                print(f"  {describe(result)}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+""" Compiles a protocol into a compact run plan, which plan_runner.py executes on the robot.
+
+    python compile_plan.py DNArepFin.py
+    python compile_plan.py BarcodeLigationFin.py --set sample_concs=[67.8,36.6,50] -o barcode_plan.json
+
+The protocol is recorded with protocol_trace.py, and its commands are written as plan steps in which repeated
+motion patterns are collapsed: a run of blocks that only differ in their wells, heights, volumes and comments, like
+the same steps for every sample or every ethanol wash, is written once as {"repeat": n, "values": {...}, "commands": [...]}
+with the values of each repetition listed per variable. Mixes stay single steps, and tips are picked up in rack order
+unless a step names one.
+
+The plan is a snapshot taken on the laptop: the parameters, the concentrations the protocol reads and the checkpoint state
+are those when it is compiled, and the robot runs it from the start. Only the labware offsets are left out: plan_runner.py
+applies the labware_offsets.json of the day it runs, like the protocols do. It is meant for checking, keeping and rerunning exactly
+the commands of a run, and has not been measured to make the robot's analysis or run any faster. Upload the plan file next to
+plan_runner.py.
+
+With --minimal the plan only loads the labware and modules the recorded run touches, e.g. for flexstation_stdcurve_prep.py
+not the magnet, temperature module and reservoir, and the commands of the modules it leaves out. The slots that frees are printed.
+"""
+import argparse
+import ast
+import itertools
+import json
+import os
+import sys
+
+import preflight
+import protocol_helpers
+import protocol_trace
+
+
+MAX_BLOCK = 60 # Longest block of steps that is looked for repeats, longer loops are collapsed by their inner blocks
+DIGITS = 2 # Decimals kept of volumes and heights
+VARYING = ["well", "at", "volume", "text"] # Step fields that may change between the repetitions of a block
+
+
+def compile_trace(trace, settings=None, minimal=False):
+    """ Returns the run plan of a Trace, as a dict that can be written as JSON.
+    With 'minimal' only the labware and modules the run touches are loaded, see used().
+    """
+    ids = _ids(trace)
+    keep = used(trace) if minimal else {id(item) for item in trace.modules + trace.labware}
+    plan = {
+        "protocol": os.path.basename(trace.path),
+        "settings": settings or {},
+        "metadata": trace.metadata,
+        "modules": [{"id": ids[id(module)], "name": module.name, "slot": module.slot} for module in trace.modules if id(module) in keep],
+        "labware": [],
+        "pipettes": [],
+        "commands": [],
+    }
+    for labware in trace.labware:
+        if labware is trace.trash or id(labware) not in keep:
+            continue
+        item = {"id": ids[id(labware)], "load_name": labware.load_name}
+        if isinstance(labware.parent, str):
+            item["slot"] = labware.slot
+        else:
+            item["on"] = ids[id(labware.parent)]
+        if labware.is_adapter:
+            item["adapter"] = True
+        if labware.label:
+            item["label"] = labware.label
+        plan["labware"].append(item)
+    for pipette in trace.pipettes:
+        plan["pipettes"].append({"id": ids[id(pipette)], "name": pipette.name, "mount": pipette.mount,
+                                 "tip_racks": [ids[id(rack)] for rack in pipette.tip_racks if id(rack) in keep]})
+    if minimal:
+        plan["left_out"] = [ids[id(item)] for item in trace.modules + trace.labware if id(item) not in keep and item is not trace.trash]
+
+    plan["commands"] = collapse(steps(trace, ids, minimal))
+    return plan
+
+
+def steps(trace, ids=None, minimal=False):
+    """ The plan steps of a Trace's commands, one per command of planned(), before they are collapsed. """
+    ids = ids or _ids(trace)
+    used_tips = set()
+    return [_step(entry, ids, used_tips) for entry in planned(trace, minimal)]
+
+
+def planned(trace, minimal=False):
+    """ The commands of a Trace that go in its plan. The labware offsets are left out: plan_runner.py applies the offsets
+    file of the day it runs, with the date check of protocol_helpers.apply_offsets(), not those of the day of compiling.
+    With 'minimal' the commands of the modules and labware that used() leaves out are left out as well.
+    """
+    keep = used(trace) if minimal else None
+    offset_lines = _call_lines(trace.path, "apply_offsets")
+    return [entry for entry in trace.commands
+            if entry["command"] != "set_offset" and not (entry["command"] == "comment" and entry["line"] in offset_lines)
+            and (keep is None or all(id(entry[key]) in keep for key in ["module", "labware"] if key in entry))]
+
+
+def _call_lines(path, function):
+    # The lines of a file's calls of a function, e.g. the helpers.apply_offsets() call, whose comments are recorded with them.
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    lines = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and getattr(node.func, "attr", getattr(node.func, "id", None)) == function:
+            lines.update(range(node.lineno, node.end_lineno + 1))
+    return lines
+
+
+def used(trace):
+    """ The id()s of the labware and modules a Trace's pipetting and liquids touch, with the adapters and modules they sit on.
+    Tip racks count when a tip is picked up from them. A module that only gets commands, like a heater shaker latch
+    that closes over an empty plate, is not counted.
+    """
+    keep = set()
+    for entry in trace.commands:
+        if entry.get("well") is None:
+            continue
+        item = entry["well"].parent
+        while not isinstance(item, str):
+            keep.add(id(item))
+            item = item.parent
+    return keep
+
+
+def _ids(trace):
+    # Variable names from run() where there are any, unique per loaded object.
+    ids = {id(trace.trash): "trash"}
+    taken = {"trash"}
+    for kind, items in [("module", trace.modules), ("labware", trace.labware), ("pipette", trace.pipettes)]:
+        for i, item in enumerate(items):
+            if id(item) in ids:
+                continue
+            name = trace.names.get(id(item), f"{kind}{i}")
+            while name in taken:
+                name += "_"
+            ids[id(item)] = name
+            taken.add(name)
+    return ids
+
+
+def _step(entry, ids, used_tips):
+    command = entry["command"]
+    step = {"do": command}
+    for key in ["pipette", "module", "labware"]:
+        if key in entry:
+            step[key] = ids[id(entry[key])]
+    well = entry.get("well")
+
+    if command == "pick_up_tip":
+        pipette = entry["pipette"]
+        # The robot picks the next tip of the pipette's racks itself, so only other tips are named.
+        next_tip = next((tip for rack in pipette.tip_racks for tip in rack.wells() if tip not in used_tips), None)
+        used_tips.add(well)
+        if well is not next_tip:
+            step["well"] = _well_id(well, ids)
+        return step
+    if well is not None:
+        step["well"] = _well_id(well, ids)
+        if command not in ["load_liquid", "touch_tip"]:
+            reference, offset = entry["at"]
+            step["at"] = [reference, round(offset, DIGITS)]
+
+    for key in ["volume", "repetitions", "liquid", "radius", "v_offset", "speed", "seconds", "timed", "text", "params"]:
+        if entry.get(key) is not None:
+            value = entry[key]
+            step[key] = round(value, DIGITS) if isinstance(value, float) else value
+    if entry.get("rate", 1.0) != 1.0:
+        step["rate"] = entry["rate"]
+    return step
+
+
+def _well_id(well, ids):
+    return f"{ids[id(well.parent)]}/{well.well_name}"
+
+
+def collapse(steps, names=None):
+    """ Collapses runs of blocks of steps that only differ in their VARYING fields into repeat steps, inner blocks included.
+    For every block start the block length that leaves out the most steps is taken.
+    'names' numbers the variables, which are unique in a plan so that repeats can be nested.
+    """
+    names = names or itertools.count(1)
+    shapes = [_shape(step) for step in steps]
+    collapsed = []
+    i = 0
+    while i < len(steps):
+        saved, length, count = 0, 1, 1
+        for block in range(1, min(MAX_BLOCK, (len(steps) - i)//2) + 1):
+            repeats = 1
+            while shapes[i + repeats*block:i + (repeats + 1)*block] == shapes[i:i + block]:
+                repeats += 1
+            if block*(repeats - 1) > saved:
+                saved, length, count = block*(repeats - 1), block, repeats
+        if count == 1:
+            collapsed.append(steps[i])
+            i += 1
+            continue
+        collapsed.append(_repeat(steps[i:i + length*count], length, count, names))
+        i += length*count
+    return collapsed
+
+
+def _shape(step):
+    # A step without the values of the fields that may change between repetitions.
+    return json.dumps({key: key if key in VARYING else value for key, value in step.items()}, sort_keys=True)
+
+
+def _repeat(steps, length, count, names):
+    # Values that are the same in every repetition stay in the steps, the others become variables,
+    # one per distinct list of values, so e.g. an aspiration and a mix in the same well share one.
+    variables = {}
+    block = []
+    for position in range(length):
+        step = dict(steps[position])
+        for key in VARYING:
+            if key in step:
+                values = [steps[position + j*length][key] for j in range(count)]
+                if any(value != values[0] for value in values):
+                    step[key] = _variable(values, variables, names)
+        block.append(step)
+    return {"repeat": count, "values": dict(variables.values()), "commands": collapse(block, names)}
+
+
+def _variable(values, variables, names):
+    key = json.dumps(values)
+    if key not in variables:
+        variables[key] = (f"${next(names)}", values)
+    return variables[key][0]
+
+
+def count_steps(steps):
+    """ Number of steps written in a plan, counting the steps inside repeats once. """
+    return sum(1 + count_steps(step["commands"]) if "repeat" in step else 1 for step in steps)
+
+
+def count_commands(steps):
+    """ Number of atomic commands the robot runs for a plan, with each mix cycle as an aspiration and a dispense. """
+    return sum(2*step["repetitions"] if step["do"] == "mix" else 1 for step in protocol_helpers.expand_plan(steps))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compiles a protocol into a compact run plan for plan_runner.py.")
+    parser.add_argument("protocol", help="Protocol file, e.g. DNArepFin.py")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="Replace a top-level parameter of the protocol, e.g. sample_concs=[296,296,296]")
+    parser.add_argument("-o", "--output", help="Plan file (default: the protocol's name with _plan.json)")
+    parser.add_argument("--minimal", action="store_true", help="Only load the labware and modules the run touches")
+    args = parser.parse_args()
+
+    settings = {}
+    for setting in args.set:
+        key, _, value = setting.partition("=")
+        settings[key.strip()] = preflight.parse_value(value.strip())
+
+    trace = protocol_trace.record(args.protocol, **settings)
+    if trace.error is not None:
+        sys.exit(f"{os.path.basename(args.protocol)}:{trace.error_line}  The protocol stops with {type(trace.error).__name__}: {trace.error}")
+    plan = compile_trace(trace, settings, args.minimal)
+    single_steps = steps(trace, minimal=args.minimal)
+    if list(protocol_helpers.expand_plan(plan["commands"])) != single_steps:
+        sys.exit("The collapsed plan doesn't expand to the recorded commands, please report this.")
+
+    output = args.output or os.path.splitext(args.protocol)[0] + "_plan.json"
+    with open(output, "w") as f:
+        json.dump(plan, f, separators=(",", ":"))
+
+    print(f"{output}: {count_steps(plan['commands'])} plan steps for {len(single_steps)} protocol commands "
+          f"({count_commands(plan['commands'])} atomic), {os.path.getsize(output)/1000:.0f} kB.")
+    if args.minimal:
+        taken = {item["slot"] for item in plan["modules"] + plan["labware"] if "slot" in item}
+        if any("thermocycler" in module["name"].lower() for module in plan["modules"]):
+            taken.update(["8", "10", "11"]) # Besides its own slot 7
+        free = [slot for slot in map(str, range(1, 12)) if slot not in taken]
+        print(f"Minimal deck: leaves out {', '.join(plan['left_out']) or 'nothing'}; free slots {', '.join(free) or 'none'}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,105 @@
-from opentrons import protocol_api, types
-
-
-metadata = {
-    "apiLevel": "2.16",
-    "protocolName": "Flexstation Standard curve",
-    "description": """Makes a serial dilution on a plate for calibration of Flexstation, and adds DNA samples for test reading.""",
-    "author": "Didrik Anttila"
-    }
-
-"""
-Prerequisites
-
-Eppendorf tuberack: 
-A1 = DNA sample, min ~1µL (optional)
-A2 = 100ng/µL calibration fluid, min 30µL : Invitrogen Qubit dsDNA BR Standard #2 100ng/µL
-A3 = 0ng/µL calibration fluid, min 30µL : Invitrogen Qubit dsDNA BR Standard #1 0ng/µL
-A4 = Qubit solution, min ~1350µL (1.35mL) : Invitrogen 1X dsDNA BR Working Solution
-"""
-
-
-def run(protocol: protocol_api.ProtocolContext):
-    # Labware
-    big_tips = protocol.load_labware("opentrons_96_tiprack_300ul", 8) 
-    small_tips = protocol.load_labware("opentrons_96_tiprack_20ul", 4)
-    reservoir = protocol.load_labware("nest_1_reservoir_290ml", 5) 
-    plate = protocol.load_labware("nest_96_wellplate_200ul_flat", 2) 
-    ep_tuberack = protocol.load_labware("opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap", 10)
-    falcon_tuberack = protocol.load_labware("opentrons_10_tuberack_falcon_4x50ml_6x15ml_conical", 6)
-    
-    # Hardware modules
-    hs_mod = protocol.load_module(
-        module_name="heaterShakerModuleV1", 
-        location="1")
-    hs_adapter = hs_mod.load_adapter(
-        "opentrons_96_pcr_adapter") 
-    hs_plate = hs_adapter.load_labware(
-        "nest_96_wellplate_100ul_pcr_full_skirt") 
-
-    mag_mod = protocol.load_module(
-        module_name = "magnetic module gen2", 
-        location="9")
-    mag_plate = mag_mod.load_labware(
-        "nest_96_wellplate_100ul_pcr_full_skirt") 
-    
-    temp_mod = protocol.load_module(
-        module_name = "temperature module gen2",
-        location = "3")
-    temp_labware = temp_mod.load_labware("opentrons_24_aluminumblock_nest_1.5ml_snapcap")
-
-    # Pipette
-    # The p300 pipette is generally best suited for volumes in the range 30-300µL. 
-    # The P20 pipette is best suited for volumes in the range 1-20µL.
-    left_pipette = protocol.load_instrument("p300_single_gen2", "left", tip_racks=[big_tips]) 
-    right_pipette = protocol.load_instrument("p20_single_gen2", "right", tip_racks=[small_tips])
-
-
-    # Procedure
-    hs_mod.close_labware_latch()
-
-    left_pipette.pick_up_tip()
-    left_pipette.transfer(190, ep_tuberack["A4"], [plate["A3"], plate["B3"], plate["C3"], plate["D3"], plate["E3"], plate["F3"]], new_tip="never", touch_tip=True)
-    left_pipette.drop_tip()
-
-
-    # Broad range calibration fluid 100ng/µL
-    right_pipette.pick_up_tip()
-    right_pipette.transfer(10, ep_tuberack["A2"], plate["A3"], new_tip="never", touch_tip=True)
-    right_pipette.transfer(8, ep_tuberack["A2"], plate["B3"], new_tip="never", touch_tip=True)
-    right_pipette.transfer(6, ep_tuberack["A2"], plate["C3"], new_tip="never", touch_tip=True)
-    right_pipette.transfer(4, ep_tuberack["A2"], plate["D3"], new_tip="never", touch_tip=True)
-    right_pipette.transfer(2, ep_tuberack["A2"], plate["E3"], new_tip="never", touch_tip=True)
-    right_pipette.drop_tip()
-    
-
-    # Broad range calibration fluid 0ng/µL # Touch tip was a bit fast, and did not dislodge the droplet which was higher up.
-    right_pipette.transfer(2, ep_tuberack["A3"], plate["B3"], mix_after=(10, 20), touch_tip=True)
-    right_pipette.transfer(4, ep_tuberack["A3"], plate["C3"], mix_after=(10, 20), touch_tip=True)
-    right_pipette.transfer(6, ep_tuberack["A3"], plate["D3"], mix_after=(10, 20), touch_tip=True)
-    right_pipette.transfer(8, ep_tuberack["A3"], plate["E3"], mix_after=(10, 20), touch_tip=True)
-    right_pipette.transfer(10, ep_tuberack["A3"], plate["F3"], mix_after=(10, 20), touch_tip=True)
-
-    # DNA sample
-    # right_pipette.transfer(1, ep_tuberack["A1"], plate["H3"], mix_after=(10, 20))
-
-
+from opentrons import protocol_api, types
+import sys
+import time
+sys.path.append("/var/lib/jupyter/notebooks") # protocol_helpers.py has to be uploaded here, see README
+import protocol_helpers as helpers
+
+
+metadata = {
+    "apiLevel": "2.18", # Labware.set_offset(), for protocol_helpers.apply_offsets()
+    "protocolName": "Flexstation Standard curve",
+    "description": """Makes a serial dilution on a plate for calibration of Flexstation, and adds DNA samples for test reading.""",
+    "author": "Didrik Anttila"
+    }
+
+"""
+Prerequisites
+
+Eppendorf tuberack: 
+A1 = DNA sample, min ~1µL (optional)
+A2 = 100ng/µL calibration fluid, min 32µL per replicate + 10µL : Invitrogen Qubit dsDNA BR Standard #2 100ng/µL
+A3 = 0ng/µL calibration fluid, min 32µL per replicate + 10µL : Invitrogen Qubit dsDNA BR Standard #1 0ng/µL
+
+Falcon tube rack
+A1 = Qubit solution, min ~1150µL per replicate + 1mL : Invitrogen 1X dsDNA BR Working Solution
+"""
+
+# Number of replicate standard series, one plate column each, starting at first_column.
+num_replicates = 1
+first_column = 3
+if num_replicates not in range(1, 13) or first_column + num_replicates - 1 > 12:
+    raise Exception("Replicates don't fit on the plate, at most 12 columns starting from first_column.")
+
+# Positions of the tubes, see "Prerequisites" above.
+layout = helpers.plan_layout("flexstation", num_replicates)
+
+# Starting volume (µL) of each reagent: (labware, well, µL), the minimums above. They are shown in the liquid setup of the Opentrons app,
+# and preflight.py checks that no tube runs dry. Each replicate takes two P20 trips of each standard, whose 1µL disposal
+# volumes are blown out in the trash, since the tip has been in the Qubit solution.
+reagents = layout.reagents({
+    "Standard #2": 32*num_replicates + 10,
+    "Standard #1": 32*num_replicates + 10,
+    "Qubit": 1150*num_replicates + 1000,
+})
+
+
+def run(protocol: protocol_api.ProtocolContext):
+    # Labware
+    big_tips = protocol.load_labware("opentrons_96_tiprack_300ul", 8) 
+    small_tips = protocol.load_labware("opentrons_96_tiprack_20ul", 4)
+    reservoir = protocol.load_labware("nest_1_reservoir_290ml", 5) 
+    plate = protocol.load_labware("nest_96_wellplate_200ul_flat", 2) 
+    ep_tuberack = protocol.load_labware("opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap", 10)
+    falcon_tuberack = protocol.load_labware("opentrons_10_tuberack_falcon_4x50ml_6x15ml_conical", 6)
+    
+    # Hardware modules
+    hs_mod = protocol.load_module(
+        module_name="heaterShakerModuleV1", 
+        location="1")
+    hs_adapter = hs_mod.load_adapter(
+        "opentrons_96_pcr_adapter") 
+    hs_plate = hs_adapter.load_labware(
+        "nest_96_wellplate_100ul_pcr_full_skirt") 
+
+    mag_mod = protocol.load_module(
+        module_name = "magnetic module gen2", 
+        location="9")
+    mag_plate = mag_mod.load_labware(
+        "nest_96_wellplate_100ul_pcr_full_skirt") 
+    
+    temp_mod = protocol.load_module(
+        module_name = "temperature module gen2",
+        location = "3")
+    temp_labware = temp_mod.load_labware("opentrons_24_aluminumblock_nest_1.5ml_snapcap")
+
+    # Pipette
+    # The p300 pipette is generally best suited for volumes in the range 30-300µL. 
+    # The P20 pipette is best suited for volumes in the range 1-20µL.
+    left_pipette = protocol.load_instrument("p300_single_gen2", "left", tip_racks=[big_tips]) 
+    right_pipette = protocol.load_instrument("p20_single_gen2", "right", tip_racks=[small_tips])
+
+
+    # The Qubit falcon tube is aspirated from just below its tracked liquid surface.
+    tracker = helpers.LiquidTracker()
+    labware = {"ep_tuberack": ep_tuberack, "falcon_tuberack": falcon_tuberack}
+    helpers.apply_offsets(protocol, [big_tips, small_tips, reservoir, plate, ep_tuberack, falcon_tuberack, hs_adapter, hs_plate, mag_plate, temp_labware])
+    helpers.load_reagents(protocol, reagents, labware, tracker)
+    wells = layout.wells(labware)
+
+    # Procedure
+    hs_mod.close_labware_latch()
+    start = time.monotonic()
+
+    series = [helpers.standard_wells(plate, column) for column in range(first_column, first_column + num_replicates)]
+    helpers.fill_qubit_wells(protocol, left_pipette, wells["Qubit"], [], [well for column in series for well in column], tracker=tracker)
+
+    # Broad range calibration fluid 0ng/µL and 100ng/µL
+    helpers.add_standard_curve(protocol, right_pipette, wells["Standard #2"], wells["Standard #1"], *series)
+
+    helpers.report_usage(protocol, [left_pipette, right_pipette], start, num_replicates, "replicate")
+
+    # DNA sample
+    # right_pipette.transfer(1, ep_tuberack["A1"], plate["H3"], mix_after=(10, 20))
+
+
     protocol.pause("Bring plate to Flexstation, also bring qubit solution and DNA sample for Qubit control test.")
\ No newline at end of file
@@ -0,0 +1,185 @@
+""" Turns a Flexstation plate read into the sample concentrations for the next protocol.
+
+    python handoff.py DNArep_read.txt
+    python handoff.py DNArep_read.txt --sample FSC454=A1 --sample FSC455=A2 --robot 169.254.10.20
+
+Reads the plate export of SoftMax Pro (File > Export, plate format, .txt), converts the reading of each sample well
+to ng/µL with a standard curve, and writes sample_conc.json keyed by sample ID, with the curve it used.
+BarcodeLigationFin.py reads that file from the robot's Jupyter notebook folder when its concentrations are left at 0.
+With --robot the file is uploaded there right away, like on_gui does.
+
+When the plate holds a standard series (include_standard_curve in the protocols, or flexstation_stdcurve_prep.py), the
+curve is fitted to it: every column whose wells A-F read from highest to lowest like protocol_helpers.STANDARD_SERIES,
+and fit it with an r² of at least MIN_R2, or the columns given with --standards. Otherwise, or with --cached, the curve
+cached in std_curve.json is used, which is the README's fit from three replicates until another one is saved with
+--curve SLOPE INTERCEPT.
+"""
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+
+import protocol_helpers
+
+
+CURVE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "std_curve.json")
+DEFAULT_CURVE = {"slope": 0.1151, "intercept": 1.1604, "note": "README fit, three replicates"} # ng/µL = slope*reading + intercept
+SSH_KEY = "ot2_ssh_key"
+ROWS = "ABCDEFGH"
+MIN_R2 = 0.98 # Least r² of a column of standards, below it the column isn't taken for a standard series
+
+
+def read_export(path):
+    """ Readings of a SoftMax Pro plate format export by well name, e.g. {"A1": 512.3}. Empty and non-numeric wells are left out. """
+    with open(path, "rb") as f:
+        data = f.read()
+    # SoftMax Pro exports UTF-16 with a byte order mark, files saved again in a text editor may be UTF-8.
+    text = data.decode("utf-16") if data[:2] in [b"\xff\xfe", b"\xfe\xff"] else data.decode("utf-8-sig")
+
+    lines = text.splitlines()
+    start = next((i for i, line in enumerate(lines) if line.startswith("Plate:")), None)
+    if start is None:
+        raise ValueError(f"{path} has no 'Plate:' block, export the plate in plate format.")
+    if "PlateFormat" not in lines[start]:
+        raise ValueError(f"{path} is exported in column format, export the plate in plate format.")
+
+    # A header row with the column numbers follows, then one row per plate row: temperature (first row only), an empty cell, the readings.
+    readings = {}
+    for row, line in zip(ROWS, lines[start + 2:]):
+        if line.startswith("~End") or not line.strip():
+            break
+        cells = line.split("\t")[2:]
+        for column, cell in enumerate(cells, start=1):
+            try:
+                readings[f"{row}{column}"] = float(cell.replace(",", "."))
+            except ValueError:
+                continue
+    return readings
+
+
+def load_curve(path=CURVE_FILE):
+    if not os.path.exists(path):
+        return dict(DEFAULT_CURVE)
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_curve(slope, intercept, path=CURVE_FILE):
+    curve = {"slope": slope, "intercept": intercept, "note": f"Saved {datetime.date.today()}"}
+    with open(path, "w") as f:
+        json.dump(curve, f, indent=2)
+    return curve
+
+
+def _fit(points):
+    # Least squares fit of ng/µL to the readings of (reading, ng/µL) points, as (slope, intercept, r²).
+    n = len(points)
+    mean_x = sum(x for x, y in points)/n
+    mean_y = sum(y for x, y in points)/n
+    sxx = sum((x - mean_x)**2 for x, y in points)
+    sxy = sum((x - mean_x)*(y - mean_y) for x, y in points)
+    syy = sum((y - mean_y)**2 for x, y in points)
+    if sxx == 0:
+        return 0.0, mean_y, 0.0
+    slope = sxy/sxx
+    return slope, mean_y - slope*mean_x, sxy**2/(sxx*syy)
+
+
+def _standards(readings, column):
+    # (reading, ng/µL) of the standard wells of a column, or None when any of them has no reading.
+    points = [(readings.get(f"{row}{column}"), volumes[2]) for row, volumes in zip(ROWS, protocol_helpers.STANDARD_SERIES)]
+    return None if any(reading is None for reading, conc in points) else points
+
+
+def standard_columns(readings):
+    """ The plate columns that hold a standard series: wells A-F read from highest to lowest, and fit with an r² of at least MIN_R2. """
+    columns = []
+    for column in range(1, 13):
+        points = _standards(readings, column)
+        if points is None or any(low[0] >= high[0] for high, low in zip(points, points[1:])):
+            continue
+        if _fit(points)[2] >= MIN_R2:
+            columns.append(column)
+    return columns
+
+
+def fit_curve(readings, columns, export=""):
+    """ The standard curve fitted to the standard series in 'columns' of a plate, with a note of where it comes from. """
+    points = []
+    for column in columns:
+        column_points = _standards(readings, column)
+        if column_points is None:
+            raise ValueError(f"Column {column} has no reading in some of the standard wells A-F.")
+        points += column_points
+    slope, intercept, r2 = _fit(points)
+    where = f" of {export}" if export else ""
+    return {"slope": round(slope, 6), "intercept": round(intercept, 4), "r2": round(r2, 4), "source": "plate",
+            "note": f"Fit to the standards in column{'s' if len(columns) > 1 else ''} {', '.join(map(str, columns))}{where}"}
+
+
+def plate_curve(readings, cached, columns=None, export=""):
+    """ The curve to convert a plate with: fitted to its standard series, in 'columns' or the ones standard_columns() finds,
+    or the 'cached' curve when it has none.
+    """
+    columns = columns or standard_columns(readings)
+    if not columns:
+        return dict(cached, source="cached")
+    return fit_curve(readings, columns, export)
+
+
+def concentrations(readings, samples, curve):
+    """ {sample ID: {"well", "reading", "conc"}} for 'samples' given as {sample ID: well name}. """
+    result = {}
+    for sample, well in samples.items():
+        if well not in readings:
+            raise ValueError(f"No reading for sample {sample} in well {well}.")
+        conc = curve["slope"]*readings[well] + curve["intercept"]
+        result[sample] = {"well": well, "reading": readings[well], "conc": round(conc, 2)}
+    return result
+
+
+def upload(path, robot_ip):
+    # Same scp call as on_gui, with the robot's ssh key in the working folder.
+    return subprocess.call(["scp", "-i", SSH_KEY, path, f"root@{robot_ip}:{protocol_helpers.ROBOT_DIR}"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts a Flexstation plate export to sample concentrations for the next protocol.")
+    parser.add_argument("export", nargs="?", help="SoftMax Pro plate export (.txt)")
+    parser.add_argument("--sample", action="append", default=[], metavar="ID=WELL", help="Sample ID and its well, repeated per sample (default: 1=A1 2=A2, the quantification wells of DNArepFin.py)")
+    parser.add_argument("--curve", nargs=2, type=float, metavar=("SLOPE", "INTERCEPT"), help="Save a new standard curve (ng/µL = SLOPE*reading + INTERCEPT) in std_curve.json")
+    parser.add_argument("--standards", type=int, action="append", default=[], metavar="COLUMN", help="Plate column of a standard series to fit the curve to, repeated per column (default: found from the readings)")
+    parser.add_argument("--cached", action="store_true", help="Use the curve in std_curve.json even when the plate has a standard series")
+    parser.add_argument("-o", "--output", default=protocol_helpers.CONC_FILE, help=f"Output file (default {protocol_helpers.CONC_FILE})")
+    parser.add_argument("--robot", metavar="IP", help="Upload the output to the robot's Jupyter notebook folder")
+    args = parser.parse_args()
+
+    curve = save_curve(*args.curve) if args.curve else load_curve()
+    if args.export is None:
+        print(f"Standard curve: ng/µL = {curve['slope']}*reading + {curve['intercept']} ({curve.get('note', '')})")
+        return
+
+    samples = dict(sample.split("=", 1) for sample in args.sample) or {"1": "A1", "2": "A2"}
+    try:
+        readings = read_export(args.export)
+        curve = dict(curve, source="cached") if args.cached else plate_curve(readings, curve, args.standards, os.path.basename(args.export))
+        result = concentrations(readings, samples, curve)
+    except ValueError as error:
+        sys.exit(str(error))
+    r2 = f", r² {curve['r2']}" if "r2" in curve else ""
+    print(f"{'Cached s' if curve['source'] == 'cached' else 'S'}tandard curve: ng/µL = {curve['slope']}*reading + {curve['intercept']} ({curve.get('note', '')}{r2})")
+    for sample, values in result.items():
+        print(f"{sample:>10}  {values['well']:>3}  reading {values['reading']:g}  {values['conc']:g} ng/µL")
+
+    with open(args.output, "w") as f:
+        json.dump({"export": os.path.basename(args.export), "curve": curve, "time": datetime.datetime.now().isoformat(timespec="seconds"),
+                   "samples": result}, f, indent=2)
+    print(f"Wrote {args.output}.")
+    if args.robot:
+        sys.exit(upload(args.output, args.robot))
+
+
+if __name__ == "__main__":
+    main()
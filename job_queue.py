@@ -0,0 +1,220 @@
+""" Job queue for the robots of the lab: jobs are submitted with their samples, and each is uploaded to a robot when it is free.
+
+    python job_queue.py --robot 169.254.10.20 --robot 169.254.10.21
+    python job_queue.py --submit DNArepFin.py --sample FSC454=296 --sample FSC455=150 --user Anna
+    python job_queue.py --submit AdapterligationFin.py --sample "Flongle 1" --sample "Flongle 2"
+    python job_queue.py --dispatch
+    python job_queue.py --done 3
+
+on_gui does the same from its Job queue section. A job is a protocol with its sample IDs and concentrations (pools for
+adapter ligation). It is replayed with protocol_trace.py when it is submitted, so a job the protocol refuses is turned
+down right away, and its run time is estimated as in capacity.py.
+
+The queued jobs are scheduled shortest first, each on the robot that is free first, which gives the least total time
+from submission to finished run over all jobs. A robot is busy with the last job sent to it until the job's estimated
+end, or until it is marked done. Dispatching uploads the jobs whose start has come: the protocol with the job's samples
+written into it (bundles/<protocol>_job<id>.py) and protocol_helpers.py, with the same scp call as on_gui. The operator
+then opens the job's protocol from the bundles folder in the Opentrons app and starts the run. A failed upload is kept
+on the job, which stays queued and is tried again at the next dispatch.
+
+The queue is kept in job_queue.json next to this script, so it belongs to one laptop: jobs submitted on another laptop
+aren't in it, and two laptops dispatching to the same robots would each send their own jobs. Dispatch from one laptop,
+or point QUEUE_FILE (and --queue) at a folder that every laptop shares.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+
+import capacity
+import handoff
+import protocol_trace
+
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+QUEUE_FILE = os.path.join(FOLDER, "job_queue.json") # Per laptop, unless set to a shared folder
+BUNDLE_DIR = os.path.join(FOLDER, "bundles")
+# Per protocol: the parameter that takes the sample IDs, and the one that takes their concentrations (None if it has none).
+JOB_PARAMETERS = {
+    "DNArepFin.py": ("sample_ids", "sample_concs"),
+    "BarcodeLigationFin.py": ("sample_ids", "sample_concs"),
+    "AdapterligationFin.py": ("pools", None),
+}
+BUNDLE_FILES = ["protocol_helpers.py"] # Uploaded with every job, the protocols import them on the robot
+
+
+def load(path=QUEUE_FILE):
+    if not os.path.exists(path):
+        return {"robots": [], "jobs": [], "next_id": 1}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(queue, path=QUEUE_FILE):
+    with open(path, "w") as f:
+        json.dump(queue, f, indent=2)
+
+
+def overrides(job):
+    """ The protocol parameters of a job. """
+    samples, concs = JOB_PARAMETERS[job["protocol"]]
+    values = {samples: job["samples"]}
+    if concs is not None and job["concs"]:
+        values[concs] = job["concs"]
+    return values
+
+
+def submit(queue, protocol, samples, concs=None, user="", now=None):
+    """ Adds a job to the queue and returns it. Raises ValueError if the protocol refuses the samples. """
+    protocol = os.path.basename(protocol)
+    if protocol not in JOB_PARAMETERS:
+        raise ValueError(f"No job parameters for {protocol}, add it to JOB_PARAMETERS.")
+    if concs and JOB_PARAMETERS[protocol][1] is None:
+        raise ValueError(f"{protocol} takes no concentrations.")
+    if concs and len(concs) != len(samples):
+        raise ValueError(f"{len(samples)} samples, but {len(concs)} concentrations.")
+    now = now or datetime.datetime.now()
+    job = {"id": queue["next_id"], "protocol": protocol, "samples": samples, "concs": concs or [], "user": user,
+           "submitted": now.isoformat(timespec="seconds"), "status": "queued"}
+    trace = protocol_trace.record(os.path.join(FOLDER, protocol), **overrides(job))
+    if trace.error is not None:
+        raise ValueError(f"{protocol} refuses the job: {trace.error}")
+    job["minutes"] = round(capacity.estimate_seconds(trace)/60, 1)
+    queue["jobs"].append(job)
+    queue["next_id"] += 1
+    return job
+
+
+def _time(text):
+    return datetime.datetime.fromisoformat(text)
+
+
+def free_at(queue, now):
+    """ When each robot is free: the estimated end of the last job sent to it that isn't done, or now. """
+    free = {robot: now for robot in queue["robots"]}
+    for job in queue["jobs"]:
+        if job["status"] == "sent" and job["robot"] in free:
+            free[job["robot"]] = max(free[job["robot"]], _time(job["started"]) + datetime.timedelta(minutes=job["minutes"]))
+    return free
+
+
+def schedule(queue, now=None):
+    """ The queued jobs as (job, robot, start, end), shortest job first on the robot that is free first. """
+    now = now or datetime.datetime.now()
+    free = free_at(queue, now)
+    plan = []
+    if not free:
+        return plan
+    for job in sorted((job for job in queue["jobs"] if job["status"] == "queued"), key=lambda job: (job["minutes"], job["id"])):
+        robot = min(free, key=lambda robot: (free[robot], queue["robots"].index(robot)))
+        start = free[robot]
+        free[robot] = start + datetime.timedelta(minutes=job["minutes"])
+        plan.append((job, robot, start, free[robot]))
+    return plan
+
+
+def bundle(job, folder=BUNDLE_DIR):
+    """ Writes the files of a job to upload, and returns their paths. """
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{os.path.splitext(job['protocol'])[0]}_job{job['id']}.py")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(protocol_trace.configured_source(os.path.join(FOLDER, job["protocol"]), **overrides(job)))
+    return [path] + [os.path.join(FOLDER, name) for name in BUNDLE_FILES]
+
+
+def push(job, robot):
+    """ Uploads the bundle of a job to a robot. Returns the scp exit code of the first file that fails, or 0. """
+    for path in bundle(job):
+        code = handoff.upload(path, robot)
+        if code:
+            return code
+    return 0
+
+
+def dispatch(queue, now=None, upload=push):
+    """ Uploads the jobs whose start has come and marks them sent. Returns (job, robot, exit code) of each upload.
+    The exit code of a failed upload is kept in the job's "upload_error" until an upload succeeds.
+    """
+    now = now or datetime.datetime.now()
+    results = []
+    for job, robot, start, _ in schedule(queue, now):
+        if start > now:
+            continue
+        code = upload(job, robot)
+        if code == 0:
+            job.pop("upload_error", None)
+            job.update(status="sent", robot=robot, started=now.isoformat(timespec="seconds"))
+        else:
+            job["upload_error"] = code
+        results.append((job, robot, code))
+    return results
+
+
+def finish(queue, job_id, now=None):
+    """ Marks a job done, which frees its robot. """
+    job = next((job for job in queue["jobs"] if job["id"] == job_id), None)
+    if job is None:
+        raise ValueError(f"No job {job_id}.")
+    job.update(status="done", finished=(now or datetime.datetime.now()).isoformat(timespec="seconds"))
+    return job
+
+
+def describe(job, robot=None, start=None):
+    """ One line about a job, with its planned robot and start if it is queued. """
+    count = len(job["samples"])
+    line = f"#{job['id']} {job['protocol']} {count} sample{'s' if count > 1 else ''}, {round(job['minutes'])} min"
+    if job["user"]:
+        line += f", {job['user']}"
+    if job["status"] == "queued" and job.get("upload_error"):
+        line += f", last upload failed with exit code {job['upload_error']}"
+    if job["status"] == "queued" and robot is not None:
+        return f"{line}: {robot} at {start:%H:%M}"
+    if job["status"] == "sent":
+        return f"{line}: sent to {job['robot']} at {_time(job['started']):%H:%M}"
+    return f"{line}: {job['status']}"
+
+
+def lines(queue, now=None):
+    """ The sent jobs, then the queued jobs in the order they start. """
+    return ([describe(job) for job in queue["jobs"] if job["status"] == "sent"]
+            + [describe(job, robot, start) for job, robot, start, _ in schedule(queue, now)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queues protocol runs and uploads each to a robot when it is free.")
+    parser.add_argument("--robot", action="append", default=[], metavar="IP", help="Robot IP, repeated per robot (replaces the saved robots)")
+    parser.add_argument("--submit", metavar="PROTOCOL", help=f"Submit a job of a protocol ({', '.join(JOB_PARAMETERS)})")
+    parser.add_argument("--sample", action="append", default=[], metavar="ID=CONC", help="Sample ID and its ng/µL, repeated per sample (pool names for adapter ligation)")
+    parser.add_argument("--user", default="", help="Who submits the job")
+    parser.add_argument("--dispatch", action="store_true", help="Upload the jobs whose start has come")
+    parser.add_argument("--done", type=int, metavar="ID", help="Mark a job done")
+    parser.add_argument("--queue", default=QUEUE_FILE, help="Queue file (default job_queue.json next to this script)")
+    args = parser.parse_args()
+
+    queue = load(args.queue)
+    if args.robot:
+        queue["robots"] = args.robot
+    try:
+        if args.submit:
+            samples = [sample.split("=", 1)[0] for sample in args.sample]
+            concs = [float(sample.split("=", 1)[1]) for sample in args.sample if "=" in sample]
+            job = submit(queue, args.submit, samples, concs, args.user)
+            print(f"Submitted #{job['id']}, estimated {job['minutes']} min.")
+        if args.done is not None:
+            finish(queue, args.done)
+    except ValueError as error:
+        sys.exit(str(error))
+    if args.dispatch:
+        for job, robot, code in dispatch(queue):
+            print(f"#{job['id']} uploaded to {robot}." if code == 0 else f"#{job['id']}: upload to {robot} failed with exit code {code}.")
+    save(queue, args.queue)
+
+    if not queue["robots"]:
+        print("No robots, add them with --robot.")
+    for line in lines(queue):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+""" Prints the deck layout of a protocol: where each tube and well goes, and the starting volume of each reagent.
+
+    python layout.py DNArepFin.py
+    python layout.py DNArepFin.py --set sample_concs=[296,296,150,150,80,80,60,60]
+    python layout.py --stage endprep --samples 24
+
+The positions are planned by protocol_helpers.plan_layout() for the protocol's number of samples and settings, which
+can be changed with '--set' like in preflight.py. With '--stage' only the positions of a stage are printed, without
+reading a protocol, so without the reagent volumes. Cold reagents that don't fit in the temperature module are marked
+'not cooled', and tubes that don't fit in the other racks go in extra Eppendorf tube racks in the spare slots.
+"""
+import argparse
+import os
+import sys
+
+import preflight
+import protocol_helpers
+import protocol_trace
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prints where to put the tubes and reagents of a protocol.")
+    parser.add_argument("protocol", nargs="?", help="Protocol file, e.g. DNArepFin.py")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="Replace a top-level parameter of the protocol, e.g. sample_concs=[296,296,296]")
+    parser.add_argument("--stage", choices=sorted(protocol_helpers.LAYOUT_STAGES), help="Print the layout of a stage instead of a protocol's")
+    parser.add_argument("--samples", type=int, default=2, help="Number of samples of --stage (default 2)")
+    args = parser.parse_args()
+
+    if args.stage:
+        try:
+            print(protocol_helpers.plan_layout(args.stage, args.samples).loading_map())
+        except Exception as error:
+            sys.exit(str(error))
+        return
+    if args.protocol is None:
+        parser.error("give a protocol file or --stage")
+
+    overrides = {}
+    for setting in args.set:
+        key, _, value = setting.partition("=")
+        overrides[key.strip()] = preflight.parse_value(value.strip())
+
+    try:
+        protocol = protocol_trace.load_module(args.protocol, **overrides)
+    except Exception as error:
+        sys.exit(f"{os.path.basename(args.protocol)}: {type(error).__name__}: {error}")
+    if "layout" not in protocol:
+        sys.exit(f"{os.path.basename(args.protocol)} has no deck layout.")
+    print(protocol["layout"].loading_map(protocol.get("reagents")))
+
+
+if __name__ == "__main__":
+    main()
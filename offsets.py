@@ -0,0 +1,78 @@
+""" Saves the offsets of the day's labware position check, so that every protocol of the day applies them.
+
+    python offsets.py 169.254.10.20
+    python offsets.py 169.254.10.20 --upload
+
+Do the labware position check in the Opentrons app for the first protocol of the day and start its run, then run this.
+It reads the offsets of the most recent run on the robot that has any, through the robot's HTTP API, and writes them to
+labware_offsets.json by labware and deck slot. With --upload the file goes to the robot's Jupyter notebook folder right away,
+like on_gui does. The protocols apply it with protocol_helpers.apply_offsets() when they load their labware,
+and refuse offsets from another day.
+"""
+import argparse
+import datetime
+import json
+import sys
+import urllib.request
+
+import handoff
+import protocol_helpers
+
+
+PORT = 31950 # Robot HTTP API
+
+
+def latest_offsets(robot_ip):
+    """ The run ID and the labware offsets of the most recent run on the robot that has offsets. """
+    request = urllib.request.Request(f"http://{robot_ip}:{PORT}/runs", headers={"Opentrons-Version": "*"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        runs = json.load(response)["data"]
+    runs = [run for run in runs if run.get("labwareOffsets")]
+    if not runs:
+        raise ValueError(f"No run on {robot_ip} has labware offsets. Do the labware position check and start the run first.")
+    run = max(runs, key=lambda run: run["createdAt"])
+    return run["id"], run["labwareOffsets"]
+
+
+def offsets_file(run_id, offsets):
+    """ The content of protocol_helpers.OFFSETS_FILE for a run's offsets. A labware checked more than once keeps its last offset.
+    The date is the UTC date of the last check, which apply_offsets() compares with the UTC date on the robot, so both sides
+    use the same clock whatever the time zones of the laptop and the robot.
+    """
+    saved = {}
+    for offset in sorted(offsets, key=lambda offset: offset["createdAt"]):
+        key = protocol_helpers.offset_key(offset["definitionUri"], offset["location"]["slotName"])
+        saved[key] = {axis: round(offset["vector"][axis], 2) for axis in "xyz"}
+    date = _utc_date(max(offset["createdAt"] for offset in offsets))
+    return {"date": date, "run": run_id, "offsets": saved}
+
+
+def _utc_date(stamp):
+    """ The UTC date of an ISO time stamp of the robot, e.g. "2024-05-02T19:12:30.123456+00:00". """
+    return datetime.datetime.fromisoformat(stamp.replace("Z", "+00:00")).astimezone(datetime.timezone.utc).date().isoformat()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Saves the robot's latest labware position check offsets for all protocols of the day.")
+    parser.add_argument("robot", metavar="IP", help="Robot IP, as in on_gui")
+    parser.add_argument("-o", "--output", default=protocol_helpers.OFFSETS_FILE, help=f"Output file (default {protocol_helpers.OFFSETS_FILE})")
+    parser.add_argument("--upload", action="store_true", help="Upload the output to the robot's Jupyter notebook folder")
+    args = parser.parse_args()
+
+    try:
+        run_id, offsets = latest_offsets(args.robot)
+    except (OSError, ValueError) as error:
+        sys.exit(str(error))
+    content = offsets_file(run_id, offsets)
+    for key, vector in content["offsets"].items():
+        print(f"{key:75}  x {vector['x']:g}  y {vector['y']:g}  z {vector['z']:g}")
+
+    with open(args.output, "w") as f:
+        json.dump(content, f, indent=2)
+    print(f"Wrote {args.output} with the offsets of {content['date']} from run {run_id}.")
+    if args.upload:
+        sys.exit(handoff.upload(args.output, args.robot))
+
+
+if __name__ == "__main__":
+    main()
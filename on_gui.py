@@ -1,76 +1,185 @@
-# https://likegeeks.com/python-gui-examples-tkinter-tutorial/ 2024-03-11
-# https://stackoverflow.com/a/665598 2024-03-11
- 
-from tkinter import filedialog
-from tkinter import *
-from os import popen
-import subprocess
-
-root = Tk()
-
-root.title("OpenPore GUI")
-root.geometry('400x400')
-
-ip_lbl = Label(root, text="Robot wired IP:")
-ip_lbl.grid(column=0, row=0)
-
-ip_txt = Entry(root, width=15)
-ip_txt.grid(column=1, row=0)
-
-
-# Gets terminal printout of current ip connections, and looks for a dynamic ip with a specific physical address.
-networks = os.popen('arp -a').readlines()
-physical_address = "b8-27-eb-18-10-29"
-for row in networks:
-    if physical_address and "dynamic" in row:
-        ip_txt.insert(INSERT, row[0:17].strip())
-        break
-
-if ip_txt.get() == "":    
-    ip_txt.insert(INSERT, '169.254.')
-
-filepath_lbl = Label(root, text="Path of file: ")
-filepath_lbl.grid(column=0, row=2)
-
-filepath_text = Entry(root, width=15)
-filepath_text.grid(column=1, row=2)
-
-
-def filepathClick():
-    filepath = filedialog.askopenfilename(filetypes=(("Text files", "*.txt"), ("All files","*.*")))
-    filepath_text.insert(INSERT, filepath)
-    return
-
-filepath_btn = Button(root, text='Choose file', command=filepathClick)
-filepath_btn.grid(column=2, row=2)
-
-
-def uploadClick():
-    robot_ip = ip_txt.get()
-    filepath = filepath_text.get()
-
-
-
-    subprocess.call(f'C:\\Windows\\system32\\WindowsPowerShell\\v1.0\\powershell.exe scp -i ot2_ssh_key {filepath} root@{robot_ip}:/var/lib/jupyter/notebooks', shell=True)
-
-
-
-upload_lbl = Label(root, text="Upload file to robot")
-upload_btn = Button(root, text='Upload', command=uploadClick)
-
-upload_lbl.grid(column=0,row=4)
-upload_btn.grid(column=1,row=4)
-
-
-
-
-
-
-
-
-
-
-
-
-
+# https://likegeeks.com/python-gui-examples-tkinter-tutorial/ 2024-03-11
+# https://stackoverflow.com/a/665598 2024-03-11
+ 
+from tkinter import filedialog
+from tkinter import messagebox
+from tkinter import *
+import os
+from os import popen
+import subprocess
+
+import job_queue
+
+root = Tk()
+
+root.title("OpenPore GUI")
+root.geometry('600x520')
+
+ip_lbl = Label(root, text="Robot wired IP:")
+ip_lbl.grid(column=0, row=0)
+
+ip_txt = Entry(root, width=15)
+ip_txt.grid(column=1, row=0)
+
+
+# Gets terminal printout of current ip connections, and looks for a dynamic ip with a specific physical address.
+networks = os.popen('arp -a').readlines()
+physical_address = "b8-27-eb-18-10-29"
+for row in networks:
+    if physical_address and "dynamic" in row:
+        ip_txt.insert(INSERT, row[0:17].strip())
+        break
+
+if ip_txt.get() == "":    
+    ip_txt.insert(INSERT, '169.254.')
+
+filepath_lbl = Label(root, text="Path of file: ")
+filepath_lbl.grid(column=0, row=2)
+
+filepath_text = Entry(root, width=15)
+filepath_text.grid(column=1, row=2)
+
+
+def filepathClick():
+    filepath = filedialog.askopenfilename(filetypes=(("Text files", "*.txt"), ("All files","*.*")))
+    filepath_text.insert(INSERT, filepath)
+    return
+
+filepath_btn = Button(root, text='Choose file', command=filepathClick)
+filepath_btn.grid(column=2, row=2)
+
+
+def uploadClick():
+    robot_ip = ip_txt.get()
+    filepath = filepath_text.get()
+
+
+
+    subprocess.call(f'C:\\Windows\\system32\\WindowsPowerShell\\v1.0\\powershell.exe scp -i ot2_ssh_key {filepath} root@{robot_ip}:/var/lib/jupyter/notebooks', shell=True)
+
+
+
+upload_lbl = Label(root, text="Upload file to robot")
+upload_btn = Button(root, text='Upload', command=uploadClick)
+
+upload_lbl.grid(column=0,row=4)
+upload_btn.grid(column=1,row=4)
+
+
+# Job queue: jobs are submitted with their samples, and uploaded to the first free robot when their turn comes, see job_queue.py.
+queue = job_queue.load()
+
+queue_lbl = Label(root, text="Job queue")
+queue_lbl.grid(column=0, row=6, pady=(20, 0))
+
+robots_lbl = Label(root, text="Robot IPs:")
+robots_lbl.grid(column=0, row=7)
+
+robots_txt = Entry(root, width=30)
+robots_txt.grid(column=1, row=7)
+robots_txt.insert(INSERT, " ".join(queue["robots"]) or ip_txt.get())
+
+protocol_lbl = Label(root, text="Protocol:")
+protocol_lbl.grid(column=0, row=8)
+
+protocol_var = StringVar(root, list(job_queue.JOB_PARAMETERS)[0])
+protocol_menu = OptionMenu(root, protocol_var, *job_queue.JOB_PARAMETERS)
+protocol_menu.grid(column=1, row=8, columnspan=2)
+
+samples_lbl = Label(root, text="Samples (ID=ng/uL):")
+samples_lbl.grid(column=0, row=9)
+
+samples_txt = Entry(root, width=30)
+samples_txt.grid(column=1, row=9, columnspan=2)
+
+user_lbl = Label(root, text="Your name:")
+user_lbl.grid(column=0, row=10)
+
+user_txt = Entry(root, width=15)
+user_txt.grid(column=1, row=10)
+
+jobs_list = Listbox(root, width=90, height=10)
+jobs_list.grid(column=0, row=12, columnspan=3)
+
+
+def refreshJobs():
+    jobs_list.delete(0, END)
+    for line in job_queue.lines(queue):
+        jobs_list.insert(END, line)
+
+
+def dispatchJobs():
+    # Uploads the jobs whose robot is free, and checks again every minute.
+    # A failed upload is only shown when it fails differently from the last try, not every minute.
+    errors = {job["id"]: job.get("upload_error") for job in queue["jobs"]}
+    for job, robot, code in job_queue.dispatch(queue):
+        if code == 0:
+            messagebox.showinfo("Job queue", f"Job #{job['id']} is on {robot}: open bundles/{os.path.splitext(job['protocol'])[0]}_job{job['id']}.py in the Opentrons app.")
+        elif errors.get(job["id"]) != code:
+            messagebox.showerror("Job queue", f"Uploading job #{job['id']} to {robot} failed with exit code {code}. It is tried again every minute.")
+    job_queue.save(queue)
+    refreshJobs()
+    root.after(60000, dispatchJobs)
+
+
+def startClick():
+    # Nothing is uploaded until the robot list is confirmed, then the queue is dispatched every minute.
+    robots = robots_txt.get().split()
+    if not robots or not messagebox.askyesno("Job queue", f"Upload the queued jobs to {', '.join(robots)} when they are free?"):
+        return
+    queue["robots"] = robots
+    robots_txt.config(state=DISABLED)
+    start_btn.config(state=DISABLED, text="Dispatching")
+    dispatchJobs()
+
+
+def submitClick():
+    # Samples are given as "ID=ng/uL" separated by spaces or commas, or just the pool names for adapter ligation.
+    entries = samples_txt.get().replace(",", " ").split()
+    samples = [entry.split("=", 1)[0] for entry in entries]
+    concs = [float(entry.split("=", 1)[1]) for entry in entries if "=" in entry]
+    try:
+        job_queue.submit(queue, protocol_var.get(), samples, concs, user_txt.get())
+    except ValueError as error:
+        messagebox.showerror("Job queue", str(error))
+        return
+    job_queue.save(queue)
+    samples_txt.delete(0, END)
+    refreshJobs()
+
+
+def doneClick():
+    # Marks the selected job done, which frees its robot for the next job.
+    selected = jobs_list.curselection()
+    if not selected:
+        return
+    job_id = int(jobs_list.get(selected[0]).split()[0].lstrip("#"))
+    job_queue.finish(queue, job_id)
+    job_queue.save(queue)
+    refreshJobs()
+
+
+submit_btn = Button(root, text='Submit job', command=submitClick)
+submit_btn.grid(column=2, row=10)
+
+done_btn = Button(root, text='Mark selected job done', command=doneClick)
+done_btn.grid(column=1, row=13)
+
+start_btn = Button(root, text='Start dispatching', command=startClick)
+start_btn.grid(column=2, row=7)
+
+refreshJobs()
+
+
+
+
+
+
+
+
+
+
+
+
+
 root.mainloop()
\ No newline at end of file
@@ -0,0 +1,409 @@
+""" Runs two batches in one deck session: the steps of the next batch fill the waits of the current one.
+
+    python pipeline.py BarcodeLigationFin.py DNArepFin.py
+    python pipeline.py BarcodeLigationFin.py DNArepFin.py --set-a sample_concs=[67.8,36.6] --set-b sample_concs=[296,296,150] -o pipeline_plan.json
+
+The first protocol is batch A, e.g. the barcode ligation of batch k, and the second is batch B, e.g. the end-prep of batch k+1.
+A is recorded with its usual layout, and B with a layout planned around A's tubes and wells, so the two batches use separate
+well regions and only share the stock tubes in protocol_helpers.SHARED_REAGENTS. The two command traces are cut at their delays
+and merged into one run plan for plan_runner.py:
+
+- A runs as it would alone. A step of B is only put in while A waits, if it is estimated to finish before A's wait ends.
+- B never changes the state of a module that A uses (magnet height, temperatures, shaking, latch), unless the change is
+  no change, and only pipettes into labware on a module that is in the state B left it in. B's incubation on the heater
+  shaker, for example, waits until A is done. After A is done, B's module settings are restored if A changed them.
+- Every wait ends with a delay for the time that is left of it on the robot's clock, so no wait gets shorter than in the
+  protocol, whatever the steps put in take.
+- A shared tube is filled once, with the larger of the two batches' volumes, or more when the batches take more from it
+  together. Its aspiration heights are worked out again over the merged steps, so each batch aspirates below the surface
+  the other batch has left. Batches that together need more than the tube holds are refused.
+
+Both protocols have to load the same labware in the same slots. The plan is a snapshot, like those of compile_plan.py.
+The deck layouts of both batches are printed with the plan, B's as planned around A's tubes and wells.
+"""
+import argparse
+import json
+import os
+import sys
+
+import capacity
+import compile_plan
+import preflight
+import protocol_helpers
+import protocol_trace
+import reagent_plan
+
+
+# Module commands that set a part of a module's state: (part, parameter with the value, or None when the command turns it off).
+MODULE_STATES = {
+    "engage": ("magnet", "height_from_base"),
+    "disengage": ("magnet", None),
+    "set_temperature": ("temperature", "celsius"),
+    "deactivate": ("temperature", None),
+    "set_target_temperature": ("temperature", "celsius"),
+    "deactivate_heater": ("temperature", None),
+    "set_and_wait_for_shake_speed": ("shaking", "rpm"),
+    "deactivate_shaker": ("shaking", None),
+    "close_labware_latch": ("latch", "closed"),
+    "open_labware_latch": ("latch", None),
+    "set_block_temperature": ("block", "temperature"),
+    "deactivate_block": ("block", None),
+    "set_lid_temperature": ("lid", "temperature"),
+    "deactivate_lid": ("lid", None),
+    "close_lid": ("lid_closed", "closed"),
+    "open_lid": ("lid_closed", None),
+}
+
+
+class Batch:
+    """ The plan steps of one batch, cut into segments at its delays, with their estimated times. """
+
+    def __init__(self, label, trace, names=None):
+        self.label = label
+        self.segments = [] # (steps, estimated seconds of each step, the delay step that ends the segment or None)
+        self.position = 0
+        self.wait = None # Delay step the batch waits on, and when it ends
+        self.ready_at = 0.0
+        self.timer_times = {}
+        self.view = {} # State of each module part as this batch left it: (module id, part): (value, step)
+        self.shared = {} # The shared tubes: well id: the trace's well
+        self.tracked = set() # id() of the steps that aspirate or mix at the tracked surface of a shared tube
+        self.repicks = {} # id() of the steps that pick up a tip the batch returned: the step that picked it up first
+        trace_steps = [_renamed(step, names or {}) for step in compile_plan.steps(trace)]
+        self.modules = {step["module"] for step in trace_steps if "module" in step}
+
+        # The batch alone, to tell which of its steps in the shared tubes follow the liquid surface.
+        alone = protocol_helpers.LiquidTracker()
+        entries = compile_plan.planned(trace)
+        for step, entry in zip(trace_steps, entries):
+            if step["do"] == "load_liquid" and step["liquid"] in protocol_helpers.SHARED_REAGENTS:
+                self.shared[step["well"]] = entry["well"]
+                alone.set(entry["well"], entry["volume"])
+
+        steps, seconds, timers, count = [], [], [], 0
+        first_picks, returned = {}, set() # The step that picked up each tip first, and the tips in the rack again
+        for step, entry in zip(trace_steps, entries):
+            if step["do"] == "load_liquid":
+                continue
+            if step.get("well") in self.shared and step["do"] in ["aspirate", "mix", "dispense"]:
+                if step["do"] == "dispense":
+                    alone.add(entry["well"], entry["volume"])
+                else:
+                    location = alone.location(entry["well"], entry["volume"])
+                    if [location.reference, round(location.offset, compile_plan.DIGITS)] == step["at"]:
+                        self.tracked.add(id(step))
+                    if step["do"] == "aspirate":
+                        alone.source(entry["well"], entry["volume"])
+            if step["do"] == "pick_up_tip":
+                # Both batches take tips from the same racks, so the robot picks the next one itself, and a returned tip
+                # is picked up again from where the merged run took it, see _name_repicks().
+                step.pop("well", None)
+                if entry["well"] in returned:
+                    returned.remove(entry["well"])
+                    self.repicks[id(step)] = first_picks[entry["well"]]
+                else:
+                    first_picks[entry["well"]] = step
+            if step["do"] == "return_tip":
+                returned.add(entry["tip"])
+            if step["do"] == "comment" or step["do"] == "pause":
+                step = dict(step, text=f"[{label}] {step.get('text') or ''}")
+            if step["do"] == "timer":
+                count += 1
+                timers.append(f"{label}.{count}")
+                steps.append({"do": "timer", "id": timers[-1]})
+                seconds.append(0)
+                continue
+            if step["do"] == "delay":
+                if step.get("timed"):
+                    timer = timers.pop()
+                else:
+                    count += 1
+                    timer = f"{label}.{count}"
+                    steps.append({"do": "timer", "id": timer})
+                    seconds.append(0)
+                self.segments.append((steps, seconds, dict(step, timed=timer)))
+                steps, seconds = [], []
+                continue
+            steps.append(step)
+            seconds.append(capacity.command_seconds(entry))
+        self.segments.append((steps, seconds, None))
+
+    def seconds(self, state):
+        """ Estimated time of the next segment, with the module commands that don't change 'state' as no time. """
+        steps, seconds, _ = self.segments[self.position]
+        return sum(time for step, time in zip(steps, seconds) if _changes(step, state) is not False)
+
+    def done(self):
+        return self.position == len(self.segments) and self.wait is None
+
+
+def merge(trace_a, trace_b):
+    """ The run plan of batch A and batch B in one session, as for plan_runner.py, and the estimated minutes alone and merged. """
+    plan_a = compile_plan.compile_trace(trace_a)
+    plan_b = compile_plan.compile_trace(trace_b)
+    names = _shared_names(plan_a, plan_b)
+    plan = dict(plan_a, protocol=f"{plan_a['protocol']} + {plan_b['protocol']}")
+    for key in ["modules", "labware", "pipettes"]:
+        ids = {item["id"] for item in plan_a[key]}
+        plan[key] = plan_a[key] + [_renamed(item, names) for item in plan_b[key] if names[item["id"]] not in ids]
+    slots = [item["slot"] for item in plan["modules"] + plan["labware"] if "slot" in item]
+    if len(slots) != len(set(slots)):
+        raise ValueError("Batch A and batch B load different labware in the same slot, they have to share the deck.")
+    mounts = [pipette["mount"] for pipette in plan["pipettes"]]
+    if len(mounts) != len(set(mounts)):
+        raise ValueError("Batch A and batch B load different pipettes on the same mount.")
+
+    # The robot picks the tips of both batches from the same racks, in rack order. Returned tips are used again.
+    for pipette in plan["pipettes"]:
+        tips = sum(len({entry["well"] for entry in trace.commands if entry["command"] == "pick_up_tip" and entry["pipette"].mount == pipette["mount"]})
+                   for trace in [trace_a, trace_b])
+        if tips > 96*len(pipette["tip_racks"]):
+            raise ValueError(f"The batches need {tips} tips for {pipette['id']}, more than its {len(pipette['tip_racks'])} tip racks hold.")
+
+    # Reagents: a shared tube is filled once, see _fill_shared().
+    liquids = {}
+    for step in compile_plan.steps(trace_a) + [_renamed(step, names) for step in compile_plan.steps(trace_b)]:
+        if step["do"] != "load_liquid":
+            continue
+        if step["well"] in liquids and liquids[step["well"]]["liquid"] != step["liquid"]:
+            raise ValueError(f"{step['well']} holds {liquids[step['well']]['liquid']} in batch A and {step['liquid']} in batch B.")
+        if step["well"] in liquids:
+            liquids[step["well"]]["volume"] = max(liquids[step["well"]]["volume"], step["volume"])
+        else:
+            liquids[step["well"]] = dict(step)
+
+    module_of = {}
+    for item in plan["labware"]:
+        parent = item.get("on")
+        while parent is not None and parent not in {module["id"] for module in plan["modules"]}:
+            parent = next(labware.get("on") for labware in plan["labware"] if labware["id"] == parent)
+        module_of[item["id"]] = parent
+
+    a, b = Batch("A", trace_a), Batch("B", trace_b, names)
+    state = {}
+    steps = list(liquids.values())
+    clock = 0.0
+
+    def allowed(segment):
+        # Whether a segment of B keeps the modules as A needs them, and finds them as B left them.
+        current, view = dict(state), dict(b.view)
+        for step in segment:
+            if "module" in step and step["do"] in MODULE_STATES:
+                if step["module"] in a.modules and _changes(step, current):
+                    return False
+                part, value = _state(step)
+                current[(step["module"], part)] = view[(step["module"], part)] = (value, step)
+            module = module_of.get(step.get("well", "").split("/")[0])
+            if module is not None:
+                if any(current.get(key, (None,))[0] != view.get(key, (None,))[0] for key in set(current) | set(view) if key[0] == module):
+                    return False
+        return True
+
+    def end_wait(batch):
+        # The batch's delay, which the robot times from its timer, so it only waits what is left of it.
+        nonlocal clock
+        clock = max(clock, batch.ready_at)
+        steps.append(batch.wait)
+        batch.wait = None
+
+    def run(batch):
+        nonlocal clock
+        if batch.wait is not None:
+            end_wait(batch)
+        segment, seconds, delay = batch.segments[batch.position]
+        batch.position += 1
+        for step, time in zip(segment, seconds):
+            if step["do"] == "timer":
+                batch.timer_times[step["id"]] = clock
+            if _changes(step, state) is False:
+                time = 0
+            if "module" in step and step["do"] in MODULE_STATES:
+                part, value = _state(step)
+                state[(step["module"], part)] = batch.view[(step["module"], part)] = (value, step)
+            steps.append(step)
+            clock += time
+        if delay is not None:
+            batch.wait = delay
+            batch.ready_at = batch.timer_times[delay["timed"]] + delay["seconds"]
+
+    def restore(batch):
+        # After batch A, B's module settings come back where A changed them.
+        for key, (value, step) in batch.view.items():
+            if state.get(key, (None,))[0] != value:
+                steps.append(step)
+                state[key] = (value, step)
+
+    restored = False
+    while not (a.done() and b.done()):
+        if a.done() and not restored:
+            restore(b)
+            restored = True
+        if a.position < len(a.segments) and (a.wait is None or a.ready_at <= clock):
+            run(a)
+            continue
+        if b.position < len(b.segments) and (b.wait is None or b.ready_at <= clock):
+            if a.done() or a.wait is None or (clock + b.seconds(state) <= a.ready_at and allowed(b.segments[b.position][0])):
+                run(b)
+                continue
+        # Nothing can start now, so the robot waits out the wait that ends first.
+        end_wait(min([batch for batch in [a, b] if batch.wait is not None], key=lambda batch: batch.ready_at))
+
+    _fill_shared(steps, liquids, dict(b.shared, **a.shared), a.tracked | b.tracked)
+    _name_repicks(steps, plan["pipettes"], {**a.repicks, **b.repicks})
+    plan["settings"] = {}
+    plan["commands"] = compile_plan.collapse(steps)
+    alone = (capacity.estimate_seconds(trace_a) + capacity.estimate_seconds(trace_b))/60
+    return plan, round(alone, 1), round(clock/60, 1)
+
+
+def _fill_shared(steps, liquids, wells, tracked):
+    # Sets the fill of each shared tube in 'liquids' to what the merged 'steps' take from it, at least, and the heights of
+    # its 'tracked' steps to the surface the steps before them leave, as protocol_helpers.LiquidTracker would.
+    for name, well in wells.items():
+        net = taken = 0.0
+        for step in steps:
+            if step.get("well") == name and step["do"] in ["aspirate", "dispense"]:
+                net += step["volume"] if step["do"] == "aspirate" else -step["volume"]
+                taken = max(taken, net)
+        dead = reagent_plan.dead_volume(well)
+        if taken + dead > well.max_volume:
+            raise ValueError(f"The batches take {round(taken)}µL of {liquids[name]['liquid']} from {name}, more than the "
+                             f"{well.max_volume}µL tube holds with its {dead}µL dead volume. Use fewer samples in one of the batches.")
+        liquids[name]["volume"] = max(liquids[name]["volume"], round(taken + dead, compile_plan.DIGITS))
+
+    tracker = protocol_helpers.LiquidTracker()
+    for name, well in wells.items():
+        tracker.set(well, liquids[name]["volume"])
+    for step in steps:
+        if step.get("well") not in wells or step["do"] not in ["aspirate", "mix", "dispense"]:
+            continue
+        well = wells[step["well"]]
+        if step["do"] == "dispense":
+            tracker.add(well, step["volume"])
+            continue
+        if id(step) in tracked:
+            location = tracker.location(well, step["volume"])
+            step["at"] = [location.reference, round(location.offset, compile_plan.DIGITS)]
+        if step["do"] == "aspirate":
+            tracker.source(well, step["volume"])
+
+
+def _name_repicks(steps, pipettes, repicks):
+    # Names the tip of each step in 'repicks', which picks up a tip its batch returned, after the tip the step that first
+    # picked it up gets in the merged 'steps'. The robot's tip tracking takes the next tip of the racks that wasn't picked up
+    # yet, and the two batches' picks take turns, so a tip is seldom where it was in the batch's own run.
+    racks = {pipette["id"]: pipette["tip_racks"] for pipette in pipettes}
+    used, tips = set(), {}
+    for step in steps:
+        if step["do"] != "pick_up_tip":
+            continue
+        if id(step) in repicks:
+            step["well"] = tips[id(repicks[id(step)])]
+            continue
+        tip = step.get("well") or next((f"{rack}/{row}{column}" for rack in racks[step["pipette"]] for column in range(1, 13)
+                                        for row in "ABCDEFGH" if f"{rack}/{row}{column}" not in used), None)
+        if tip is None:
+            raise ValueError(f"{step['pipette']} runs out of tips in the merged run.")
+        used.add(tip)
+        tips[id(step)] = tip
+
+
+def _shared_names(plan_a, plan_b):
+    # Batch B's ids of the modules, labware and pipettes: A's id for the same load in the same place, otherwise B's own, made unique.
+    names = {}
+    loads = {}
+    for plan in [plan_a, plan_b]:
+        for kind in ["modules", "labware", "pipettes"]:
+            for item in plan[kind]:
+                load = (kind, item.get("name", item.get("load_name")), item.get("slot", item.get("mount")),
+                        names.get(item.get("on"), item.get("on")))
+                if plan is plan_a:
+                    loads[load] = item["id"]
+                    continue
+                name = loads.get(load, item["id"])
+                if load not in loads:
+                    taken = set(loads.values()) | set(names.values())
+                    while name in taken:
+                        name += "_"
+                names[item["id"]] = name
+    return names
+
+
+def _renamed(item, names):
+    # A step or plan item of batch B with A's ids.
+    item = dict(item)
+    for key in ["id", "pipette", "module", "labware", "on"]:
+        if key in item:
+            item[key] = names.get(item[key], item[key])
+    if "well" in item:
+        labware, _, well = item["well"].partition("/")
+        item["well"] = f"{names.get(labware, labware)}/{well}"
+    if "tip_racks" in item:
+        item["tip_racks"] = [names.get(rack, rack) for rack in item["tip_racks"]]
+    return item
+
+
+def _changes(step, state):
+    # Whether a module command changes 'state', or None for other steps.
+    if "module" not in step or step["do"] not in MODULE_STATES:
+        return None
+    part, value = _state(step)
+    return state.get((step["module"], part), (None,))[0] != value
+
+
+def _state(step):
+    part, parameter = MODULE_STATES[step["do"]]
+    if parameter is None:
+        return part, None
+    params = step.get("params", {})
+    return part, params.get(parameter, params.get("arg0", True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merges two batches into one run plan, with batch B's steps in batch A's waits.")
+    parser.add_argument("protocol_a", help="Protocol of batch A, run as usual, e.g. BarcodeLigationFin.py")
+    parser.add_argument("protocol_b", help="Protocol of batch B, fitted in A's waits, e.g. DNArepFin.py")
+    parser.add_argument("--set-a", action="append", default=[], metavar="NAME=VALUE", help="Replace a top-level parameter of protocol A")
+    parser.add_argument("--set-b", action="append", default=[], metavar="NAME=VALUE", help="Replace a top-level parameter of protocol B")
+    parser.add_argument("-o", "--output", default="pipeline_plan.json", help="Plan file (default pipeline_plan.json)")
+    args = parser.parse_args()
+
+    settings = []
+    for options in [args.set_a, args.set_b]:
+        settings.append({})
+        for setting in options:
+            key, _, value = setting.partition("=")
+            settings[-1][key.strip()] = preflight.parse_value(value.strip())
+
+    # B's layout is planned around A's positions.
+    module_a = protocol_trace.load_module(args.protocol_a, **settings[0])
+    trace_a = protocol_trace.record(args.protocol_a, **settings[0])
+    protocol_helpers.reserve_positions(module_a["layout"].positions)
+    try:
+        module_b = protocol_trace.load_module(args.protocol_b, **settings[1])
+        trace_b = protocol_trace.record(args.protocol_b, **settings[1])
+    finally:
+        protocol_helpers.reserve_positions({})
+    for trace in [trace_a, trace_b]:
+        if trace.error is not None:
+            sys.exit(f"{os.path.basename(trace.path)}:{trace.error_line}  The protocol stops with {type(trace.error).__name__}: {trace.error}")
+
+    try:
+        plan, alone, merged = merge(trace_a, trace_b)
+    except ValueError as error:
+        sys.exit(str(error))
+    plan["settings"] = {"A": settings[0], "B": settings[1]}
+    with open(args.output, "w") as f:
+        json.dump(plan, f, separators=(",", ":"))
+    print(f"{args.output}: {plan['protocol']}, {compile_plan.count_steps(plan['commands'])} plan steps.")
+    print(f"Estimated {merged} min in one session, against {alone} min for the two runs one after the other.")
+    shared = [step for step in plan["commands"] if step.get("do") == "load_liquid" and step["liquid"] in protocol_helpers.SHARED_REAGENTS]
+    print("Shared tubes, filled once: " + ", ".join(f"{step['liquid']} {step['volume']:g}µL in {step['well']}" for step in shared) + ".")
+    # B's tubes and wells are where its layout was planned around A's, not where B would put them alone.
+    for label, module in [("A", module_a), ("B", module_b)]:
+        print()
+        print(f"Batch {label}: " + module["layout"].loading_map(module.get("reagents")))
+
+
+if __name__ == "__main__":
+    main()
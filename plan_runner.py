@@ -0,0 +1,124 @@
+from opentrons import protocol_api, types
+import json
+import os
+import sys
+import time
+sys.path.append("/var/lib/jupyter/notebooks") # protocol_helpers.py has to be uploaded here, see README
+import protocol_helpers as helpers
+
+
+metadata = {
+    "apiLevel": "2.18", # Plans of protocols that set labware offsets
+    "protocolName": "Run plan",
+    "description": """Runs a run plan compiled from one of the protocols with compile_plan.py.""",
+    "author": "Didrik Anttila"
+    }
+
+"""
+Prerequisites
+
+The plan file, made with e.g. "python compile_plan.py DNArepFin.py", uploaded to /var/lib/jupyter/notebooks.
+Deck and reagents as in the prerequisites of the compiled protocol.
+"""
+
+# Plan file in the robot's Jupyter notebook folder.
+plan_file = "DNArepFin_plan.json"
+
+
+def run(protocol: protocol_api.ProtocolContext):
+    with open(os.path.join(helpers.ROBOT_DIR, plan_file)) as f:
+        plan = json.load(f)
+    protocol.comment(f"* Running the plan of {plan['protocol']}, settings: {plan['settings'] or 'as in the file'}.")
+
+    # Deck
+    loaded = {"trash": protocol.fixed_trash}
+    for module in plan["modules"]:
+        loaded[module["id"]] = protocol.load_module(module["name"], module["slot"])
+    for labware in plan["labware"]:
+        if "slot" in labware:
+            loaded[labware["id"]] = protocol.load_labware(labware["load_name"], labware["slot"], label=labware.get("label"))
+        elif labware.get("adapter"):
+            loaded[labware["id"]] = loaded[labware["on"]].load_adapter(labware["load_name"])
+        else:
+            loaded[labware["id"]] = loaded[labware["on"]].load_labware(labware["load_name"], label=labware.get("label"))
+    for pipette in plan["pipettes"]:
+        loaded[pipette["id"]] = protocol.load_instrument(pipette["name"], pipette["mount"], tip_racks=[loaded[rack] for rack in pipette["tip_racks"]])
+    # The offsets of today's labware position check, not those of the day the plan was compiled, which plans leave out.
+    helpers.apply_offsets(protocol, [loaded[labware["id"]] for labware in plan["labware"]])
+
+    def well(step):
+        labware, name = step["well"].split("/")
+        return loaded[labware][name]
+
+    def location(step):
+        reference, offset = step["at"]
+        return getattr(well(step), reference)().move(types.Point(z=offset))
+
+    # Procedure
+    liquids = {}
+    timers = [] # Start times of the steps that are done while waiting
+    named_timers = {} # The same by timer id, for the overlapping waits of pipeline.py plans
+    for step in helpers.expand_plan(plan["commands"]):
+        command = step["do"]
+        pipette = loaded.get(step.get("pipette"))
+
+        if "module" in step:
+            params = dict(step["params"])
+            args = [params.pop(f"arg{i}") for i in range(len(params)) if f"arg{i}" in params]
+            getattr(loaded[step["module"]], command)(*args, **params)
+        elif command == "load_liquid":
+            if step["liquid"] not in liquids:
+                color = helpers.LIQUID_COLORS[len(liquids) % len(helpers.LIQUID_COLORS)]
+                liquids[step["liquid"]] = protocol.define_liquid(name=step["liquid"], description=step["liquid"], display_color=color)
+            well(step).load_liquid(liquid=liquids[step["liquid"]], volume=step["volume"])
+
+        elif command == "pick_up_tip":
+            if "well" in step:
+                pipette.pick_up_tip(well(step))
+            else:
+                pipette.pick_up_tip()
+        elif command == "drop_tip":
+            pipette.drop_tip()
+        elif command == "return_tip":
+            pipette.return_tip()
+        elif command == "aspirate":
+            pipette.aspirate(step["volume"], location(step), rate=step.get("rate", 1.0))
+        elif command == "dispense":
+            # Volumes are rounded to 0.01µL in the plan, so split dispenses can add up to a little more than the tip holds.
+            volume = step["volume"] if step["volume"] - pipette.current_volume > 0.05 else min(step["volume"], pipette.current_volume)
+            pipette.dispense(volume, location(step), rate=step.get("rate", 1.0))
+        elif command == "mix":
+            pipette.mix(step["repetitions"], step["volume"], location(step), rate=step.get("rate", 1.0))
+        elif command == "blow_out":
+            pipette.blow_out(location(step))
+        elif command == "touch_tip":
+            pipette.touch_tip(well(step), radius=step["radius"], v_offset=step["v_offset"], speed=step["speed"])
+        elif command == "air_gap":
+            pipette.air_gap(step["volume"])
+        elif command == "move_to":
+            pipette.move_to(location(step))
+        elif command == "default_speed":
+            pipette.default_speed = step["speed"]
+        elif command == "home":
+            (pipette or protocol).home()
+
+        elif command == "comment":
+            protocol.comment(step["text"])
+        elif command == "pause":
+            protocol.pause(step.get("text"))
+        elif command == "timer":
+            if "id" in step:
+                named_timers[step["id"]] = time.monotonic()
+            else:
+                timers.append(time.monotonic())
+        elif command == "delay":
+            # Waits that the protocol spent on other steps (helpers.during_delay) only delay for the time that is left.
+            seconds = step["seconds"]
+            if step.get("timed"):
+                start = named_timers.pop(step["timed"]) if isinstance(step["timed"], str) else timers.pop()
+                if not protocol.is_simulating():
+                    seconds -= time.monotonic() - start
+            if seconds > 0:
+                protocol.delay(seconds=round(seconds, 1), msg=step.get("text"))
+        else:
+            raise Exception(f"Unknown plan step '{command}', compile the plan again with this version of plan_runner.py.")
@@ -0,0 +1,184 @@
+""" Keeps every Flexstation plate read in one indexed file, to compare the yields of many runs without opening the exports again.
+
+    python plate_history.py DNArep_read.txt Barcode_read.txt
+    python plate_history.py DNArep_read.txt --sample FSC454=A1 --sample FSC455=A2 --date 2024-05-13
+    python plate_history.py --yields --stage endprep --last 50
+    python plate_history.py --history FSC454
+
+Each SoftMax Pro plate export (plate format .txt, see handoff.py) is read once and saved in plate_history.sqlite: all 96
+readings of the plate packed in one row, with the date, the stage and the standard curve, and one indexed row per sample well
+with its concentration. An export that is already in the store is skipped, so a whole folder of exports can be added again.
+
+The stage is taken from the file name (e.g. "DNArep" is end-prep) unless given with --stage, and the date is the file's date
+unless given with --date. The sample wells are given like in handoff.py, by default 1=A1 2=A2. The yield of a sample is its
+concentration times the eluate volume of its stage in ELUATE_VOLUMES. The concentrations use the same curve as handoff.py:
+fitted to the plate's own standard series when it has one, else the cached curve, and each plate records which it was.
+"""
+import argparse
+import array
+import datetime
+import hashlib
+import math
+import os
+import sqlite3
+import sys
+import time
+
+import handoff
+
+
+STORE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plate_history.sqlite")
+WELLS = [f"{row}{column}" for row in handoff.ROWS for column in range(1, 13)] # Order of the readings of a plate
+# Words in the export file name that tell the stage, checked in this order.
+STAGE_NAMES = {
+    "endprep": ["dnarep", "endprep", "end-prep"],
+    "barcode": ["barcode"],
+    "adapter": ["adapter"],
+    "standard": ["std", "standard", "curve"],
+}
+ELUATE_VOLUMES = {"endprep": 15, "barcode": 35, "adapter": 10} # µL of each eluate, as the protocols make them
+DEFAULT_SAMPLES = {"1": "A1", "2": "A2"} # As in handoff.py. A standard curve read has no samples by default.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plates (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL,
+    digest TEXT NOT NULL UNIQUE,
+    date TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    slope REAL NOT NULL,
+    intercept REAL NOT NULL,
+    curve TEXT NOT NULL DEFAULT 'cached', -- "plate" when fitted to the plate's own standard series
+    readings BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    plate INTEGER NOT NULL REFERENCES plates(id),
+    sample TEXT NOT NULL,
+    well TEXT NOT NULL,
+    reading REAL NOT NULL,
+    conc REAL NOT NULL,
+    yield REAL
+);
+CREATE INDEX IF NOT EXISTS plates_by_date ON plates(date);
+CREATE INDEX IF NOT EXISTS plates_by_stage ON plates(stage, date);
+CREATE INDEX IF NOT EXISTS samples_by_sample ON samples(sample);
+CREATE INDEX IF NOT EXISTS samples_by_plate ON samples(plate);
+"""
+
+
+def connect(path=STORE_FILE):
+    store = sqlite3.connect(path)
+    store.executescript(SCHEMA)
+    # Stores made before plates had a curve column, whose plates all used the cached curve.
+    if "curve" not in [column[1] for column in store.execute("PRAGMA table_info(plates)")]:
+        store.execute("ALTER TABLE plates ADD COLUMN curve TEXT NOT NULL DEFAULT 'cached'")
+    return store
+
+
+def pack(readings):
+    """ The readings of a plate by well name as 96 doubles in WELLS order, NaN for wells without a reading. """
+    return array.array("d", [readings.get(well, math.nan) for well in WELLS]).tobytes()
+
+
+def unpack(blob):
+    """ The readings of a plate by well name from pack(). """
+    values = array.array("d")
+    values.frombytes(blob)
+    return {well: value for well, value in zip(WELLS, values) if not math.isnan(value)}
+
+
+def stage_of(path):
+    name = os.path.basename(path).lower()
+    for stage, words in STAGE_NAMES.items():
+        if any(word in name for word in words):
+            return stage
+    return None
+
+
+def ingest(store, path, samples, curve, stage=None, date=None):
+    """ Adds a plate export to the store, with 'samples' as {sample ID: well name}, or the DEFAULT_SAMPLES when None.
+    The plate is converted with its own standard series when it has one, else with 'curve' (see handoff.plate_curve).
+    Returns the number of samples added, or None when the export is already in it.
+    """
+    with open(path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    if store.execute("SELECT 1 FROM plates WHERE digest = ?", (digest,)).fetchone():
+        return None
+    stage = stage or stage_of(path)
+    if stage is None:
+        raise ValueError(f"No stage in the name of {path}, give it with --stage.")
+    date = date or datetime.date.fromtimestamp(os.path.getmtime(path)).isoformat()
+    if samples is None:
+        samples = {} if stage == "standard" else DEFAULT_SAMPLES
+    readings = handoff.read_export(path)
+    curve = handoff.plate_curve(readings, curve, export=os.path.basename(path))
+    concs = handoff.concentrations(readings, samples, curve)
+
+    with store:
+        plate = store.execute("INSERT INTO plates (file, digest, date, stage, slope, intercept, curve, readings) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              (os.path.basename(path), digest, date, stage, curve["slope"], curve["intercept"], curve["source"],
+                               pack(readings))).lastrowid
+        volume = ELUATE_VOLUMES.get(stage)
+        store.executemany("INSERT INTO samples (plate, sample, well, reading, conc, yield) VALUES (?, ?, ?, ?, ?, ?)",
+                          [(plate, sample, values["well"], values["reading"], values["conc"], round(values["conc"]*volume, 1) if volume else None)
+                           for sample, values in concs.items()])
+    return len(concs)
+
+
+def yields(store, stage=None, last=50):
+    """ (date, stage, file, samples, mean ng/µL, total ng) of the last plates, newest first, of one stage or all. """
+    query = """SELECT plates.date, plates.stage, plates.file, COUNT(*), AVG(samples.conc), SUM(samples.yield)
+               FROM (SELECT * FROM plates {} ORDER BY date DESC, id DESC LIMIT ?) AS plates
+               JOIN samples ON samples.plate = plates.id GROUP BY plates.id ORDER BY plates.date DESC, plates.id DESC"""
+    if stage is None:
+        return store.execute(query.format(""), (last,)).fetchall()
+    return store.execute(query.format("WHERE stage = ?"), (stage, last)).fetchall()
+
+
+def history(store, sample):
+    """ (date, stage, file, well, ng/µL, ng) of every read of a sample, oldest first. """
+    return store.execute("""SELECT plates.date, plates.stage, plates.file, samples.well, samples.conc, samples.yield
+                            FROM samples JOIN plates ON plates.id = samples.plate WHERE samples.sample = ?
+                            ORDER BY plates.date, plates.id""", (sample,)).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stores Flexstation plate exports once, and shows the yields of past runs.")
+    parser.add_argument("exports", nargs="*", help="SoftMax Pro plate exports (.txt) to add")
+    parser.add_argument("--sample", action="append", default=[], metavar="ID=WELL", help="Sample ID and its well, as in handoff.py (default: 1=A1 2=A2, none for a standard curve)")
+    parser.add_argument("--stage", choices=list(STAGE_NAMES), help="Stage of the exports (default: from the file names)")
+    parser.add_argument("--date", help="Date of the reads, YYYY-MM-DD (default: the file dates)")
+    parser.add_argument("--yields", action="store_true", help="Show the yield of each plate, newest first")
+    parser.add_argument("--last", type=int, default=50, help="Plates to show with --yields (default 50)")
+    parser.add_argument("--history", metavar="ID", help="Show every read of a sample")
+    parser.add_argument("--store", default=STORE_FILE, help="Store file (default plate_history.sqlite next to this script)")
+    args = parser.parse_args()
+
+    store = connect(args.store)
+    samples = dict(sample.split("=", 1) for sample in args.sample) or None
+    curve = handoff.load_curve()
+    for path in args.exports:
+        try:
+            added = ingest(store, path, samples, curve, args.stage, args.date)
+        except (OSError, ValueError) as error:
+            sys.exit(f"{path}: {error}")
+        print(f"{path}: already stored." if added is None else f"{path}: added {added} samples.")
+
+    if args.yields:
+        start = time.perf_counter()
+        rows = yields(store, args.stage, args.last)
+        for date, stage, file, count, conc, total in rows:
+            total = f"{total:8.1f} ng" if total is not None else " "*11
+            print(f"{date}  {stage:9}{count:3} samples  {conc:7.2f} ng/µL  {total}  {file}")
+        print(f"{len(rows)} plates in {round((time.perf_counter() - start)*1000, 1)} ms.")
+    if args.history:
+        start = time.perf_counter()
+        rows = history(store, args.history)
+        for date, stage, file, well, conc, total in rows:
+            total = f"{total:8.1f} ng" if total is not None else ""
+            print(f"{date}  {stage:9}{well:4}{conc:7.2f} ng/µL  {total}  {file}")
+        print(f"{len(rows)} reads of {args.history} in {round((time.perf_counter() - start)*1000, 1)} ms.")
+
+
+if __name__ == "__main__":
+    main()
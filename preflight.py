@@ -0,0 +1,224 @@
+""" Pre-flight validator: checks a protocol's command trace before it is run on the robot.
+
+    python preflight.py DNArepFin.py
+    python preflight.py BarcodeLigationFin.py --set sample_concs=[67.8,36.6,50]
+
+The protocol is replayed with protocol_trace.py (in milliseconds) and its trace is checked for
+- volumes outside the range of the pipette that moves them,
+- sources that run dry, counting from the reagent volumes the protocol declares,
+- wells filled beyond their capacity,
+- waste in the tip box lid (loaded as 'nest_1_reservoir_290ml') beyond what it holds,
+- aspirations and mixes above the liquid surface, with the height model of protocol_helpers.LiquidTracker,
+- tips that a resumed run picks up from positions an earlier run already emptied: the protocol is also run as on the robot,
+  cancelled twice after a finished step and resumed from its checkpoint each time (see check_resume()).
+Errors would fail or spoil the run, warnings are worth a look. The exit code is 1 if there are errors.
+"""
+import argparse
+import ast
+from collections import defaultdict
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+
+import protocol_helpers
+import protocol_trace
+
+
+# µL a tip box lid, used as the 'nest_1_reservoir_290ml' waste, holds without spilling.
+WASTE_CAPACITY = 25000
+WASTE_LABWARE = "nest_1_reservoir_290ml"
+HEIGHTS = protocol_helpers.LiquidTracker()
+
+
+def check(trace, waste_capacity=WASTE_CAPACITY):
+    """ Returns the errors and warnings of a trace, each a list of (line, message). """
+    errors, warnings = [], []
+    if trace.error is not None:
+        errors.append((trace.error_line, f"The protocol stops with {type(trace.error).__name__}: {trace.error}"))
+
+    volumes = defaultdict(float) # µL liquid in each well
+    known = set() # Wells whose content is known: declared reagents and wells the protocol filled first.
+    unknown = set() # Wells the protocol takes from without declaring them, which are assumed to hold enough.
+    reagents = {} # Wells with a declared starting volume, and their reagent name
+    tip_liquid = defaultdict(float) # µL liquid (not air) in each pipette's tip
+    waste = 0.0
+
+    def name(well):
+        return f"{trace.name(well)} ({reagents[well]})" if well in reagents else trace.name(well)
+
+    def check_height(entry, what):
+        # Only wells with a known volume and a round cross section have a modelled surface.
+        if well in known and well.diameter and "z" in entry:
+            surface = HEIGHTS.height(well, volumes[well])
+            if entry["z"] > max(surface, protocol_helpers.MIN_HEIGHT) + 0.5:
+                warnings.append((entry["line"], f"{trace.name(entry['pipette'])} {what} {round(entry['z'], 1):g}mm above the bottom of {name(well)}, above its liquid surface at {round(surface, 1):g}mm."))
+
+    def check_range(entry, what):
+        pipette, volume = entry["pipette"], entry["volume"]
+        if 0 < volume < pipette.min_volume - 1e-6:
+            errors.append((entry["line"], f"{trace.name(pipette)} {what} {_ul(volume)}, below its {_ul(pipette.min_volume)} minimum."))
+
+    for entry in trace.commands:
+        command = entry["command"]
+        well = entry.get("well")
+
+        if command == "load_liquid":
+            volumes[well] = entry["volume"]
+            reagents[well] = entry["liquid"]
+            known.add(well)
+
+        elif command == "aspirate":
+            check_range(entry, "aspirates")
+            check_height(entry, "aspirates")
+            volume = entry["volume"]
+            if well not in known:
+                unknown.add(well)
+                tip_liquid[entry["pipette"]] += volume
+            else:
+                if volume > volumes[well] + 0.01 and well.parent.load_name != WASTE_LABWARE:
+                    message = f"{trace.name(entry['pipette'])} aspirates {_ul(volume)} from {name(well)}, which holds {_ul(volumes[well])}."
+                    (errors if well in reagents else warnings).append((entry["line"], message))
+                taken = min(volume, volumes[well])
+                volumes[well] -= taken
+                tip_liquid[entry["pipette"]] += taken
+
+        elif command in ["dispense", "blow_out"]:
+            if command == "dispense":
+                check_range(entry, "dispenses")
+            pipette = entry["pipette"]
+            liquid = min(entry["volume"], tip_liquid[pipette]) if command == "dispense" else tip_liquid[pipette]
+            tip_liquid[pipette] -= liquid
+            if well is None or liquid <= 0 or well in unknown:
+                continue
+            volumes[well] += liquid
+            known.add(well)
+            if well.parent.load_name == WASTE_LABWARE:
+                waste += liquid
+                if waste > waste_capacity and waste - liquid <= waste_capacity:
+                    errors.append((entry["line"], f"The waste in {trace.name(well.parent)} passes the {_ul(waste_capacity)} the tip box lid holds."))
+            elif volumes[well] > _capacity(well) and volumes[well] - liquid <= _capacity(well):
+                errors.append((entry["line"], f"{name(well)} overflows with {_ul(volumes[well])}."))
+            elif well.max_volume and volumes[well] > well.max_volume and volumes[well] - liquid <= well.max_volume:
+                warnings.append((entry["line"], f"{name(well)} is filled to {_ul(volumes[well])}, above its rated {_ul(well.max_volume)}."))
+
+        elif command == "mix":
+            check_range(entry, "mixes")
+            check_height(entry, "mixes")
+            if well in known and entry["volume"] > volumes[well] + 0.01:
+                warnings.append((entry["line"], f"{trace.name(entry['pipette'])} mixes {_ul(entry['volume'])} in {name(well)}, which holds {_ul(volumes[well])}, so it pulls in air."))
+
+        elif command in ["drop_tip", "return_tip"]:
+            tip_liquid[entry["pipette"]] = 0
+
+    return _merge(errors), _merge(warnings)
+
+
+def check_resume(path, overrides=None, cancels=2):
+    """ Returns the errors, as (line, message), of a run that is cancelled 'cancels' times, each right after one of its steps
+    finishes, and resumed from its checkpoint: tips picked up from positions that an earlier run took, and a resumed run
+    that stops. The runs are made as on the robot in temporary folders. Protocols without a Checkpoint aren't checked.
+    """
+    overrides = overrides or {}
+    name = os.path.splitext(os.path.basename(path))[0] + "_checkpoint.json"
+
+    def finished(folder):
+        # The steps in the checkpoint file so far.
+        try:
+            with open(os.path.join(folder, name)) as f:
+                return len(json.load(f)["steps"])
+        except (OSError, ValueError):
+            return 0
+
+    # A whole run first, for the number of steps it finishes.
+    with tempfile.TemporaryDirectory() as folder:
+        steps = 0
+        def count(trace):
+            nonlocal steps
+            steps = max(steps, finished(folder))
+            return False
+        protocol_trace.record_on_robot(path, folder, count, **overrides)
+    if steps <= cancels:
+        return []
+
+    errors = []
+    gone = set() # Tips the earlier runs took and didn't return, by (slot, well name)
+    with tempfile.TemporaryDirectory() as folder:
+        for run in range(cancels + 1):
+            target = steps*(run + 1)//(cancels + 1) if run < cancels else None
+            cancel = None if target is None else lambda trace: finished(folder) >= target
+            trace = protocol_trace.record_on_robot(path, folder, cancel, **overrides)
+            after = f"After {run} cancelled run{'s' if run > 1 else ''}"
+            if run > 0 and trace.error is not None and not isinstance(trace.error, protocol_trace.Cancelled):
+                errors.append((trace.error_line, f"{after}, the resumed run stops with {type(trace.error).__name__}: {trace.error}"))
+            taken = set()
+            for entry in trace.commands:
+                if entry["command"] == "pick_up_tip":
+                    tip = (entry["well"].parent.slot, entry["well"].well_name)
+                    if tip in gone:
+                        errors.append((entry["line"], f"{after}, {trace.name(entry['pipette'])} picks up the tip in {trace.name(entry['well'])}, which an earlier run took."))
+                    taken.add(tip)
+                elif entry["command"] == "return_tip":
+                    taken.discard((entry["tip"].parent.slot, entry["tip"].well_name))
+            gone |= taken
+    return _merge(errors)
+
+
+def _capacity(well):
+    # Geometric volume of a well, which is usually larger than the rated max volume of the labware definition.
+    if well.diameter:
+        return math.pi*(well.diameter/2)**2*well.depth
+    if well.length:
+        return well.length*well.width*well.depth
+    return float("inf")
+
+
+def _ul(volume):
+    return f"{round(volume, 2):g}µL"
+
+
+def _merge(problems):
+    # Sorted by line, with repeats of the same problem on the same line counted instead of listed.
+    counts = defaultdict(int)
+    for problem in problems:
+        counts[problem] += 1
+    return [(line, message + (f" (x{count})" if count > 1 else "")) for (line, message), count in sorted(counts.items(), key=lambda item: (item[0][0] or 0, item[0][1]))]
+
+
+def parse_value(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks a protocol for pipette ranges, source depletion, overfilled wells and waste capacity.")
+    parser.add_argument("protocol", help="Protocol file, e.g. DNArepFin.py")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="Replace a top-level parameter of the protocol, e.g. sample_concs=[296,296,296]")
+    parser.add_argument("--waste-capacity", type=float, default=WASTE_CAPACITY, help=f"µL the waste holds (default {WASTE_CAPACITY})")
+    args = parser.parse_args()
+
+    overrides = {}
+    for setting in args.set:
+        key, _, value = setting.partition("=")
+        overrides[key.strip()] = parse_value(value.strip())
+
+    start = time.perf_counter()
+    trace = protocol_trace.record(args.protocol, **overrides)
+    errors, warnings = check(trace, args.waste_capacity)
+    errors = _merge(errors + check_resume(args.protocol, overrides))
+    milliseconds = (time.perf_counter() - start)*1000
+
+    filename = os.path.basename(args.protocol)
+    for kind, problems in [("error", errors), ("warning", warnings)]:
+        for line, message in problems:
+            print(f"{kind:8}{filename}:{line}  {message}")
+    print(f"{filename}: {len(errors)} errors, {len(warnings)} warnings, {len(trace.commands)} commands checked in {milliseconds:.0f} ms.")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,964 @@
+""" Shared steps for the SQK-NBD114.24 library preparation protocols.
+
+The protocols import this file, so it has to be uploaded to the robot's Jupyter notebook folder
+(for example with on_gui) before a protocol that uses it is run.
+"""
+from contextlib import contextmanager
+import datetime
+import hashlib
+import json
+import math
+import os
+import time
+
+
+# Folder on the OT2 that on_gui uploads files to.
+ROBOT_DIR = "/var/lib/jupyter/notebooks"
+CONC_FILE = "sample_conc.json" # Sample concentrations from the last plate read, written by handoff.py
+OFFSETS_FILE = "labware_offsets.json" # Labware position check offsets of the day, written by offsets.py
+DECK_STATE_FILE = "deck_state.json" # Tubes a stage run leaves on the deck for the next stage, written at the end of each run
+
+QUBIT_VOL = 199 # µL Invitrogen 1X dsDNA BR Working Solution per quantification well
+QUANT_VOL = 1 # µL sample per quantification well
+
+# Qubit dsDNA BR standard series, highest concentration first, as made by flexstation_stdcurve_prep.py.
+# Each well gets 190µL Qubit solution and 10µL standard:
+# (µL Standard #2 100ng/µL, µL Standard #1 0ng/µL, ng/µL)
+STANDARD_QUBIT_VOL = 190
+STANDARD_SERIES = [(10, 0, 100), (8, 2, 80), (6, 4, 60), (4, 6, 40), (2, 8, 20), (0, 10, 0)]
+
+# 80% ethanol is made from 96% ethanol and water.
+ETHANOL_STOCK = 96.0 # %
+ETHANOL_TARGET = 80.0 # %
+ETHANOL_WASH_VOL = 200 # µL per well and wash
+ETHANOL_WASHES = 2 # Washes per well
+ETHANOL_DEAD_VOL = 300 # µL left in the falcon tube that the pipette can't reach
+
+# Liquid height model of the tracked tubes and wells (see LiquidTracker): mm height of the conical bottom of each labware's wells,
+# with a cylinder of the well diameter above it. Falcon tubes are listed by max volume, and labware not listed is flat bottomed.
+CONE_HEIGHTS = {
+    "opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap": 17.0,
+    "opentrons_24_aluminumblock_nest_1.5ml_snapcap": 17.0,
+    "nest_96_wellplate_100ul_pcr_full_skirt": 9.0,
+}
+FALCON_CONE_HEIGHTS = {15000: 22.0, 50000: 15.0}
+SUBMERGE_DEPTH = 2 # mm below the liquid surface that the tip aspirates, counted from where the surface is after aspirating
+# The falcon stock tubes are filled by eye to their declared volume ("nearly full"), not measured, so the tip goes deeper
+# in them: 10mm is about 6mL below the declared volume in a 50mL tube, and 1.7mL in a 15mL tube.
+FALCON_SUBMERGE_DEPTH = 10
+MIN_HEIGHT = 1 # mm above the bottom, the pipettes' default aspiration height
+
+# Volume range (µL) each pipette model moves accurately. The P300 is also allowed below 30µL, but only if the P20 can't do it.
+ACCURATE_RANGES = {"p20_single_gen2": (1, 20), "p300_single_gen2": (30, 300)}
+# Rough OT2 timings (s) for comparing transfer plans: picking up and dropping a tip, and moving between source and destination.
+TIP_TIME = 12
+TRIP_TIME = 5
+
+# Colours of the reagents in the liquid setup of the Opentrons app, in the order they are declared.
+LIQUID_COLORS = ["#b925ff", "#ffd600", "#9dffd8", "#ff9900", "#50d5ff", "#ff80f5", "#7eff42", "#ff4f4f", "#8a8a8a", "#2e6bff"]
+
+# Labware that plan_layout() places tubes and wells in, by the names the protocols load them as: (description, slot, rows, columns)
+LAYOUT_LABWARE = {
+    "temp_labware": ("temperature module", 3, 4, 6),
+    "ep_tuberack": ("Eppendorf tube rack", 10, 4, 6),
+    "falcon_tuberack": ("falcon tube rack", 6, 3, 4),
+    "hs_plate": ("heater shaker plate", 1, 8, 12),
+    "mag_plate": ("magnet plate", 9, 8, 12),
+    "plate": ("Flexstation plate", 2, 8, 12),
+    "tc_plate": ("thermocycler plate", 7, 8, 12),
+}
+FALCON_WELLS = ["A1", "A2", "B1", "B2", "C1", "C2", "A3", "A4", "B3", "B4"] # 15mL tubes first, then 50mL
+TUBE_LABWARE = ["temp_labware", "ep_tuberack", "falcon_tuberack"]
+# Free deck slots that get an extra Eppendorf tube rack when the tubes of a run don't fit in the others.
+SPARE_SLOTS = [7, 11]
+SPARE_RACK = "opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap"
+# Stock reagents that the batches of one deck session (see pipeline.py) take from the same tube.
+SHARED_REAGENTS = ["Qubit", "H2O", "96% Eth"]
+BEAD_WELL_SAMPLES = 4 # Samples (or pools) that take their AXP beads from the same heater shaker well
+BEAD_SETTLE_TIME = 60 # s that AXP beads stay suspended enough to draw from after a mix
+BEAD_MIXES = 3 # Mix cycles that resuspend a bead well
+
+
+@contextmanager
+def during_delay(protocol, minutes=0, seconds=0):
+    """ Runs the steps inside the with-block while waiting, and then only delays for the time that is left.
+    When simulating nothing takes time, so the full delay is kept.
+    """
+    start = time.monotonic()
+    if hasattr(protocol, "start_timer"):
+        protocol.start_timer() # Marks where the steps start in protocol_trace.py recordings
+    yield
+    remaining = minutes*60 + seconds
+    if not protocol.is_simulating():
+        remaining -= time.monotonic() - start
+    if remaining > 0:
+        protocol.delay(seconds=round(remaining, 1))
+
+
+def load_reagents(protocol, reagents, labware, tracker=None):
+    """ Declares the starting volume of each reagent in its tube.
+
+    'reagents' maps reagent names to (labware name, well name, µL), and 'labware' maps the labware names to the loaded labware.
+    The Opentrons app shows the declared reagents in its liquid setup, and preflight.py checks the protocol against the volumes.
+    A LiquidTracker starts from the same volumes. Reagents with a volume of 0 are not used in the run and are left out.
+    Returns the wells by reagent name.
+    """
+    wells = {}
+    for i, (name, (labware_name, well_name, volume)) in enumerate(reagents.items()):
+        well = labware[labware_name][well_name]
+        if volume > 0:
+            liquid = protocol.define_liquid(name, description=name, display_color=LIQUID_COLORS[i % len(LIQUID_COLORS)])
+            well.load_liquid(liquid, volume)
+            if tracker is not None:
+                tracker.set(well, volume)
+        wells[name] = well
+    return wells
+
+
+class LiquidTracker:
+    """ Volume model of the tubes and wells of a run, used to aspirate just below the liquid surface instead of at fixed heights.
+
+    Volumes start from the reagents declared with load_reagents(), and are updated by every source() and add().
+    The surface height is calculated from the labware geometry, see CONE_HEIGHTS.
+    Wells whose volume isn't known are aspirated from at the pipette's default height.
+    """
+
+    def __init__(self):
+        self.volumes = {} # µL by well display name, so they can be stored in a checkpoint
+
+    def set(self, well, volume):
+        self.volumes[well.display_name] = volume
+
+    def volume(self, well):
+        return self.volumes.get(well.display_name)
+
+    def add(self, well, volume):
+        """ Records 'volume' µL dispensed into a well, and returns the well. """
+        self.volumes[well.display_name] = (self.volume(well) or 0) + volume
+        return well
+
+    def height(self, well, volume):
+        """ Height (mm) of the surface of 'volume' µL above the bottom of a well. """
+        radius = well.diameter/2
+        if "falcon" in well.parent.load_name:
+            cone = FALCON_CONE_HEIGHTS[well.max_volume]
+        else:
+            cone = CONE_HEIGHTS.get(well.parent.load_name, 0)
+        cone_vol = math.pi*radius**2*cone/3
+        if volume < cone_vol:
+            return cone*(volume/cone_vol)**(1/3)
+        return cone + (volume - cone_vol)/(math.pi*radius**2)
+
+    def location(self, well, volume):
+        """ Where to aspirate 'volume' µL from a well, without recording it. Mixing also uses this location. """
+        if self.volume(well) is None or well.diameter is None:
+            return well
+        depth = FALCON_SUBMERGE_DEPTH if "falcon" in well.parent.load_name else SUBMERGE_DEPTH
+        return well.bottom(max(MIN_HEIGHT, self.height(well, max(0, self.volume(well) - volume)) - depth))
+
+    def source(self, well, volume):
+        """ Where to aspirate 'volume' µL from a well. Records the aspiration. """
+        location = self.location(well, volume)
+        if self.volume(well) is not None:
+            self.volumes[well.display_name] = max(0, self.volume(well) - volume)
+        return location
+
+
+def _source(tracker, well, volume):
+    # Aspiration location of a well, tracked if there is a tracker.
+    return well if tracker is None else tracker.source(well, volume)
+
+
+def plan_transfer(pipettes, volume, air_gap=0):
+    """ The quickest way to move 'volume' µL with the pipettes, as a list of (pipette, µL).
+
+    A pipette can take the volume if its equal trips are all within the pipette's accurate range.
+    The options are compared by estimated time: one tip, the trips, and aspirating and dispensing at the pipette's flow rates.
+    Splitting a volume between a P300 and a P20 never beats equal trips of one pipette (it costs a second tip for the same trips),
+    but the plan is a list so other pipette pairs can be added. If no pipette is accurate, the smallest one moves the volume
+    anyway (preflight.py reports it).
+    """
+    def trip_time(pipette, vol):
+        return TRIP_TIME + vol/pipette.flow_rate.aspirate + vol/pipette.flow_rate.dispense
+
+    def time_with(pipette, vol):
+        trips = math.ceil(vol/(pipette.max_volume - air_gap))
+        low, high = ACCURATE_RANGES.get(pipette.name, (pipette.min_volume, pipette.max_volume))
+        if not low <= vol/trips <= high:
+            return None
+        return TIP_TIME + trips*trip_time(pipette, vol/trips)
+
+    plans = [(time_with(pipette, volume), pipette) for pipette in pipettes if time_with(pipette, volume) is not None]
+    if not plans:
+        return [(min(pipettes, key=lambda pipette: pipette.max_volume), volume)]
+    return [(min(plans, key=lambda plan: plan[0])[1], volume)]
+
+
+def transfer(pipettes, volume, source, dest, **kwargs):
+    """ Transfers 'volume' µL with the pipette that plan_transfer() picks.
+
+    Takes the keyword arguments of the Opentrons transfer(). Mixes are capped at the chosen pipette's max volume.
+    With new_tip="never", the pipette that already has a tip is used. Returns the plan.
+    """
+    if volume <= 0:
+        return []
+    if kwargs.get("new_tip") == "never":
+        plan = [(next(pipette for pipette in pipettes if pipette.has_tip), volume)]
+    else:
+        plan = plan_transfer(pipettes, volume, kwargs.get("air_gap", 0))
+    for pipette, vol in plan:
+        options = dict(kwargs)
+        for mix in ["mix_before", "mix_after"]:
+            if options.get(mix):
+                options[mix] = (options[mix][0], min(options[mix][1], pipette.max_volume))
+        pipette.transfer(vol, source, dest, **options)
+    return plan
+
+
+def timed_mix(protocol, pipette, minutes, volume, location, rate=1.0):
+    """ Mixes 'volume' µL at 'location' for about 'minutes', e.g. in lieu of a hula mixer.
+
+    The number of cycles comes from the pipette's flow rates at 'rate', so it stays right when the volume, rate or flow rates change.
+    It is a single mix() call. The pipette must already have a tip. Returns the number of cycles.
+    """
+    cycle = volume/(pipette.flow_rate.aspirate*rate) + volume/(pipette.flow_rate.dispense*rate)
+    repetitions = max(1, round(minutes*60/cycle))
+    protocol.comment(f"* Mixing {volume}uL for {minutes:g} minutes: {repetitions} cycles of {round(cycle, 1)} seconds.")
+    pipette.mix(repetitions, volume, location, rate=rate)
+    return repetitions
+
+
+def ethanol_volume(wells, washes=ETHANOL_WASHES, wash_vol=ETHANOL_WASH_VOL, dead_vol=ETHANOL_DEAD_VOL):
+    """ 80% ethanol (µL) needed to wash a number of wells, including the dead volume of the tube. """
+    return wells*washes*wash_vol + dead_vol
+
+
+def prepare_ethanol(protocol, pipette, water, ethanol, destination, volume, tracker=None):
+    """ Mixes 'volume' µL 80% ethanol from water and 96% ethanol in the destination tube with a single tip.
+
+    Both liquids are dispensed from the top of the destination tube, so the tip stays clean until the final mix.
+    Each liquid is moved in as few trips as the pipette allows.
+    With a LiquidTracker, the source tubes are aspirated from below their surface and the ethanol tube is tracked from then on.
+    """
+    ethanol_vol = round(volume*ETHANOL_TARGET/ETHANOL_STOCK, 1)
+    water_vol = round(volume - ethanol_vol, 1)
+    protocol.comment(f"* Preparing {volume}uL 80% ethanol: {water_vol}uL water and {ethanol_vol}uL 96% ethanol.")
+
+    pipette.pick_up_tip()
+    for vol, source in [(water_vol, water), (ethanol_vol, ethanol)]:
+        trips = math.ceil(vol/pipette.max_volume)
+        for i in range(trips):
+            pipette.aspirate(vol/trips, _source(tracker, source, vol/trips))
+            pipette.dispense(vol/trips, destination.top(z=-5))
+            pipette.blow_out()
+            if tracker is not None:
+                tracker.add(destination, vol/trips)
+    mix_vol = min(pipette.max_volume, volume/2)
+    pipette.mix(5, mix_vol, destination if tracker is None else tracker.location(destination, mix_vol))
+    pipette.blow_out()
+    pipette.drop_tip()
+
+
+def ethanol_wash(protocol, pipette, ethanol, wells, waste, single_tip=True, dispense_rate=1.0, removal_rate=0.3, tracker=None):
+    """ Washes the bead pellets in 'wells' with 80% ethanol and dumps the supernatant in 'waste'.
+
+    With single_tip, one tip dispenses the ethanol of all washes from the top of all wells, taking as many wells per trip as fit
+    in the tip, and each well has one tip for the removal of its supernatant. The tips are returned to their rack between the
+    washes and picked up again, so the washes take one tip plus one per well instead of two per well.
+    Otherwise every well gets a fresh tip for each wash.
+    """
+    if single_tip:
+        dispense_tip = _tip_well(pipette)
+        removal_tips = {}
+    for i in range(ETHANOL_WASHES):
+        last = i == ETHANOL_WASHES - 1
+        if single_tip:
+            pipette.pick_up_tip(dispense_tip)
+            _dispense_from_top(pipette, ETHANOL_WASH_VOL, ethanol, wells, rate=dispense_rate, tracker=tracker)
+            if last:
+                pipette.drop_tip()
+            else:
+                pipette.return_tip()
+            protocol.delay(seconds=10)
+            for well in wells:
+                if well not in removal_tips:
+                    removal_tips[well] = _tip_well(pipette)
+                pipette.pick_up_tip(removal_tips[well])
+                _remove_wash(pipette, well, waste, removal_rate, keep_tip=not last)
+        else:
+            for well in wells:
+                pipette.pick_up_tip()
+                pipette.aspirate(ETHANOL_WASH_VOL, _source(tracker, ethanol, ETHANOL_WASH_VOL))
+                pipette.dispense(ETHANOL_WASH_VOL, well, rate=dispense_rate)
+                protocol.delay(seconds=10)
+                _remove_wash(pipette, well, waste, removal_rate)
+
+
+def _remove_wash(pipette, well, waste, rate, keep_tip=False):
+    # Takes slightly more than was added, and keeps it in the tip with an air gap on the way to the waste.
+    # With keep_tip the tip goes back to its rack, for the next wash of the same well.
+    pipette.aspirate(ETHANOL_WASH_VOL+10, well, rate=rate)
+    pipette.air_gap(volume=30)
+    pipette.dispense(ETHANOL_WASH_VOL+40, waste)
+    pipette.blow_out()
+    if keep_tip:
+        pipette.return_tip()
+    else:
+        pipette.drop_tip()
+
+
+def _tip_well(pipette):
+    # The tip the pipette would pick up next, to pick it up again by its location later.
+    tip = _next_tip(pipette)
+    if tip is None:
+        raise Exception(f"{pipette} is out of tips.")
+    return pipette.tip_racks[tip[0]][tip[1]]
+
+
+def _dispense_from_top(pipette, volume, source, wells, rate=1.0, tracker=None):
+    # Multi-dispenses from above the liquid, so the tip never touches what is already in the wells.
+    # Takes as many wells per trip as fit in the tip. The pipette must already have a tip.
+    wells_per_trip = max(1, int(pipette.max_volume // volume))
+    for start in range(0, len(wells), wells_per_trip):
+        trip = wells[start:start+wells_per_trip]
+        pipette.aspirate(volume*len(trip), _source(tracker, source, volume*len(trip)))
+        for well in trip:
+            pipette.dispense(volume, well.top(z=-2), rate=rate)
+        pipette.blow_out()
+
+
+def bead_aliquots(volumes, dead_vol):
+    """ µL of AXP beads for each bead well, from the bead volumes of the samples in order: the volumes of its
+    BEAD_WELL_SAMPLES samples, plus 'dead_vol' so the last draw still comes from suspended beads.
+    """
+    return [sum(volumes[i:i+BEAD_WELL_SAMPLES]) + dead_vol for i in range(0, len(volumes), BEAD_WELL_SAMPLES)]
+
+
+def add_beads(protocol, mixer, pipette, bead_wells, samples, volume, mix_volume, sample_vol=None, tracker=None, rate=0.5):
+    """ Adds 'volume' µL of beads to each sample from its bead well (BEAD_WELL_SAMPLES samples per well), with one tip.
+
+    The beads are dispensed 2mm above where the surface of each sample will be once its beads are in, from the 'sample_vol' µL
+    already in it (or from the top of the well if it isn't given), so the shared tip stays clear of the samples and doesn't
+    carry DNA between them. Each trip takes as many samples as fit in the tip.
+    A bead well is only resuspended (by 'mixer', with a tip of its own) when its last mix is more than BEAD_SETTLE_TIME ago.
+    The time is estimated from the pipette moves, like in plan_transfer(), so the same mixes happen when simulating.
+    'mixer' can be 'pipette'. Returns the number of mixes.
+    """
+    wells_per_trip = max(1, int(pipette.max_volume // volume))
+    mixed = {} # Estimated time of the last mix of each bead well
+    clock = 0.0
+    mixes = 0
+    mixer.pick_up_tip()
+    if pipette is not mixer:
+        pipette.pick_up_tip()
+    for i, bead_well in enumerate(bead_wells):
+        group = samples[i*BEAD_WELL_SAMPLES:(i+1)*BEAD_WELL_SAMPLES]
+        for start in range(0, len(group), wells_per_trip):
+            trip = group[start:start+wells_per_trip]
+            if clock - mixed.get(i, -BEAD_SETTLE_TIME) >= BEAD_SETTLE_TIME:
+                mixer.mix(BEAD_MIXES, mix_volume, bead_well)
+                mixer.blow_out(bead_well.top(z=-2))
+                clock += TRIP_TIME + BEAD_MIXES*(mix_volume/mixer.flow_rate.aspirate + mix_volume/mixer.flow_rate.dispense)
+                mixed[i] = clock
+                mixes += 1
+            pipette.aspirate(volume*len(trip), bead_well, rate=rate)
+            pipette.default_speed = 100
+            pipette.touch_tip(bead_well, radius=0.85, v_offset=-2, speed=3)
+            pipette.touch_tip(bead_well, radius=0.85, v_offset=-2, speed=3)
+            for sample in trip:
+                if sample_vol is None or tracker is None:
+                    location = sample.top(z=-2)
+                else:
+                    location = sample.bottom(tracker.height(sample, sample_vol + volume) + 2)
+                pipette.dispense(volume, location, rate=rate)
+            pipette.blow_out()
+            pipette.default_speed = 400
+            clock += TRIP_TIME*(1 + len(trip)) + volume*len(trip)/(pipette.flow_rate.aspirate*rate)
+    protocol.comment(f"* Added {volume}uL beads to {len(samples)} samples, resuspending {mixes} times.")
+    if pipette is not mixer:
+        pipette.drop_tip()
+    mixer.drop_tip()
+    return mixes
+
+
+def fill_qubit_wells(protocol, pipette, qubit, wells, standard_wells=(), tracker=None):
+    """ Adds Qubit BR solution to all quantification wells, samples and standards, with a single tip.
+    Meant to be run inside a pelleting delay or incubation, before the eluates are ready.
+    """
+    protocol.comment(f"* Adding Broad Range Qubit solution to {len(wells) + len(standard_wells)} corning plate wells.")
+    pipette.pick_up_tip()
+    _dispense_from_top(pipette, QUBIT_VOL, qubit, wells, tracker=tracker)
+    _dispense_from_top(pipette, STANDARD_QUBIT_VOL, qubit, standard_wells, tracker=tracker)
+    pipette.drop_tip()
+
+
+def standard_wells(plate, column):
+    """ The wells A-F of a plate column, which hold the standard series from highest to lowest concentration. """
+    return plate.columns_by_name()[str(column)][:len(STANDARD_SERIES)]
+
+
+def add_standard_curve(protocol, pipette, standard_high, standard_zero, *series):
+    """ Makes the 100-0ng/µL standard series in one or more Qubit filled well lists (see standard_wells).
+
+    The 0ng/µL standard goes in first, then the 100ng/µL standard, each multi-dispensed to every series with a single tip,
+    touched off on each well like transfer(touch_tip=True). The tip has been in the Qubit solution of the wells, so the
+    disposal volume of each trip is blown out in the trash, not back into the standard tube.
+    Each series is then mixed with one tip from the lowest to the highest concentration.
+    """
+    for wells in series:
+        protocol.comment(f"* Making Qubit standard series in wells {wells[0].well_name}-{wells[-1].well_name}.")
+
+    disposal_vol = pipette.min_volume
+    for source, index in [(standard_zero, 1), (standard_high, 0)]:
+        additions = [(well, volumes[index]) for wells in series for well, volumes in zip(wells, STANDARD_SERIES) if volumes[index] > 0]
+        pipette.pick_up_tip()
+        while additions:
+            trip = [additions.pop(0)]
+            while additions and sum(vol for well, vol in trip) + additions[0][1] + disposal_vol <= pipette.max_volume:
+                trip.append(additions.pop(0))
+            pipette.aspirate(sum(vol for well, vol in trip) + disposal_vol, source)
+            for well, vol in trip:
+                pipette.dispense(vol, well)
+                pipette.touch_tip(well)
+            pipette.blow_out(protocol.fixed_trash["A1"].top())
+        pipette.drop_tip()
+
+    for wells in series:
+        pipette.pick_up_tip()
+        for well in reversed(wells[:len(STANDARD_SERIES)]):
+            pipette.mix(10, pipette.max_volume, well)
+            pipette.blow_out(well.top())
+        pipette.drop_tip()
+
+
+def tips_used(pipettes):
+    """ Number of tips taken from the tip racks of the pipettes so far. """
+    return sum(1 for pipette in pipettes for rack in pipette.tip_racks for well in rack.wells() if not well.has_tip)
+
+
+def report_usage(protocol, pipettes, start, count, unit):
+    """ Comments the tips and time used since 'start' (time.monotonic()) per 'count' units, e.g. samples or replicates.
+    Time is only known on the robot, not when simulating.
+    """
+    tips = tips_used(pipettes)
+    protocol.comment(f"* Used {tips} tips for {count} {unit}s, {round(tips/count, 1)} per {unit}.")
+    if not protocol.is_simulating():
+        minutes = (time.monotonic() - start)/60
+        protocol.comment(f"* Took {round(minutes, 1)} minutes, {round(minutes/count, 1)} minutes per {unit}.")
+
+
+def add_quant_aliquot(pipette, eluate, well):
+    """ Puts 1µL of an eluate into its Qubit filled well and mixes it in with the same tip.
+    The pipette must already have a tip, and is left with it.
+    """
+    pipette.aspirate(QUANT_VOL, eluate)
+    pipette.dispense(QUANT_VOL, well)
+    pipette.mix(10, pipette.max_volume, well)
+    pipette.blow_out(well.top())
+
+
+def read_concentrations(protocol, sample_ids):
+    """ ng/µL of each sample ID in the sample_conc.json handoff.py wrote, from the robot's Jupyter notebook folder,
+    or from the working folder when the protocol is checked on the laptop.
+    """
+    folder = ROBOT_DIR if os.path.isdir(ROBOT_DIR) else os.getcwd()
+    path = os.path.join(folder, CONC_FILE)
+    if not os.path.exists(path):
+        raise Exception(f"{CONC_FILE} not found in {folder}. Run handoff.py on the plate read, or enter the concentrations in the protocol.")
+    with open(path) as f:
+        handoff = json.load(f)
+    missing = [sample for sample in sample_ids if sample not in handoff["samples"]]
+    if missing:
+        raise Exception(f"{CONC_FILE} has no sample {', '.join(missing)}, only {', '.join(handoff['samples'])}.")
+    concs = [handoff["samples"][sample]["conc"] for sample in sample_ids]
+    protocol.comment(f"* Read {', '.join(f'{sample}: {conc}ng/µL' for sample, conc in zip(sample_ids, concs))} from {CONC_FILE} ({handoff['export']}, {handoff['time']}).")
+    return concs
+
+
+def read_deck_state(stage):
+    """ The tubes the stage before 'stage' left on the deck, as saved in DECK_STATE_FILE by Layout.save_state(): a list of
+    {"labware", "well", "name", "contents", "volume", "sample"}, in sample order. Read from the robot's Jupyter notebook folder,
+    or from the working folder when the protocol is checked on the laptop.
+    None without a file, or when the file is from another stage or an earlier day, as the tubes have probably been moved since.
+    """
+    folder = ROBOT_DIR if os.path.isdir(ROBOT_DIR) else os.getcwd()
+    path = os.path.join(folder, DECK_STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    if state["stage"] != STAGE_INPUTS[stage][0] or state["time"][:10] != datetime.date.today().isoformat():
+        return None
+    return state["tubes"]
+
+
+def apply_offsets(protocol, labware):
+    """ Sets the offsets of the day's labware position check, which offsets.py saved in OFFSETS_FILE, on the loaded 'labware' (a list).
+    Labware that wasn't checked keeps the offsets of the Opentrons app. Offsets from an earlier day (in UTC) stop the protocol,
+    since the README asks for a new check every day. Without the file nothing is changed.
+    Labware.set_offset() needs apiLevel 2.18.
+    """
+    folder = ROBOT_DIR if os.path.isdir(ROBOT_DIR) else os.getcwd()
+    path = os.path.join(folder, OFFSETS_FILE)
+    if not os.path.exists(path):
+        protocol.comment(f"* No {OFFSETS_FILE}, using the labware offsets of the Opentrons app.")
+        return
+    with open(path) as f:
+        saved = json.load(f)
+    # offsets.py dates the check in UTC, so the day is compared on the same clock.
+    if saved["date"] != datetime.datetime.now(datetime.timezone.utc).date().isoformat():
+        raise Exception(f"{OFFSETS_FILE} is from {saved['date']} (UTC). Do today's labware position check and run offsets.py again, or remove the file.")
+
+    applied = 0
+    for item in labware:
+        key = offset_key(item.uri, _deck_slot(item))
+        if key in saved["offsets"]:
+            item.set_offset(**saved["offsets"][key])
+            applied += 1
+    protocol.comment(f"* Applied the labware offsets of {saved['date']} ({saved['run']}) to {applied} of {len(labware)} labware.")
+
+
+def offset_key(uri, slot):
+    """ Key of a labware's offset in OFFSETS_FILE: its definition URI and deck slot, also when it sits on a module or adapter. """
+    return f"{uri} in slot {slot}"
+
+
+def _deck_slot(item):
+    # Labware on an adapter has the adapter as parent, which has the module as parent, which has the slot name.
+    parent = item.parent
+    while not isinstance(parent, str):
+        parent = parent.parent
+    return parent
+
+
+def _item(name, labware, start, count=None, member="{} {}", filled=None):
+    # A tube or well of a layout, or with a count a group of them named e.g. "DNA 1", "DNA 2" (see member).
+    # 'labware' is where it goes, or a tuple of where it goes and where it goes when that is full.
+    # 'start' is the first well to try, or a list of the exact wells of a group.
+    # 'filled' is what it holds when the run starts, "reagent" or "sample", for loading_map() without volumes.
+    labware = labware if isinstance(labware, tuple) else (labware,)
+    if isinstance(start, list):
+        count = len(start)
+    return {"name": name, "labware": labware, "start": start, "count": count, "member": member, "filled": filled}
+
+
+def _column_wells(column):
+    return [f"{row}{column}" for row in "ABCDEF"]
+
+
+def _falcons(ethanol=True):
+    # The falcon tubes all protocols use, and the ethanol of the bead washes.
+    items = [_item("Qubit", "falcon_tuberack", "A1", filled="reagent"), _item("H2O", "falcon_tuberack", "A3", filled="reagent")]
+    if ethanol:
+        items += [_item("80% Eth", "falcon_tuberack", "B3"), _item("96% Eth", "falcon_tuberack", "B4", filled="reagent")]
+    return items
+
+
+def _endprep_layout(n, standard_curve=False, standard_column=3, dilute_DCS=True, unattended=False, thermocycler=False):
+    cold = ("temp_labware", "ep_tuberack")
+    tubes, axp, standards = "ep_tuberack", "A1", ["B1", "B2"]
+    if thermocycler:
+        # The thermocycler covers the Eppendorf tube rack's slot, so its tubes go in the free temperature module wells,
+        # and the 300µL tips take the waste reservoir's slot, so the waste goes in a falcon tube.
+        cold = ("temp_labware",)
+        tubes, axp, standards = "temp_labware", "D6", ["D4", "D5"]
+    items = [
+        _item("AXP", tubes, axp, filled="reagent"),
+        _item("DCS", cold, "A3", filled="reagent"),
+        _item("RM", cold, "B1", filled="reagent"),
+        _item("UII", cold, "B2", filled="reagent"),
+        _item("RB", cold, "C1", filled="reagent"),
+        _item("Ub", cold, "C2", filled="reagent"),
+    ]
+    if dilute_DCS:
+        items.append(_item("EB", cold, "C3", filled="reagent"))
+    if standard_curve:
+        items += [_item("Standard series", "plate", _column_wells(standard_column)),
+                  _item("Standard #2", tubes, standards[0], filled="reagent"), _item("Standard #1", tubes, standards[1], filled="reagent")]
+    if thermocycler:
+        items.append(_item("Waste", "falcon_tuberack", "A4"))
+    items += _falcons() + [
+        _item("Beads", "hs_plate", "H1", math.ceil(n/BEAD_WELL_SAMPLES)),
+        _item("Reaction", "tc_plate" if thermocycler else "hs_plate", "A1", n),
+        _item("Mag", "mag_plate", "A1", n),
+        _item("Quant", "plate", "A1", n),
+        _item("DNA", cold, "A1", n, filled="sample"),
+        _item("Eluate", cold, "D1", n),
+    ]
+    if thermocycler:
+        # The heater shaker wells the reactions are moved to from the thermocycler, for the beads.
+        items.append(_item("Binding", "hs_plate", "A1", n))
+    elif not unattended:
+        items.append(_item("Binding", "ep_tuberack", "A2", n))
+    return items
+
+
+def _barcode_layout(n, standard_curve=False, standard_column=4):
+    cold = ("temp_labware", "ep_tuberack")
+    items = [
+        _item("AXP", "ep_tuberack", "A1", filled="reagent"),
+        _item("Library", "ep_tuberack", "A2"),
+        _item("BLT", cold, "C1", filled="reagent"),
+        _item("EDTA", cold, "C2", filled="reagent"),
+    ]
+    if standard_curve:
+        items += [_item("Standard series", "plate", _column_wells(standard_column)),
+                  _item("Standard #2", "ep_tuberack", "B1", filled="reagent"), _item("Standard #1", "ep_tuberack", "B2", filled="reagent")]
+    items += _falcons() + [
+        _item("Quant", "plate", "C1"),
+        _item("Beads", "hs_plate", "H2"),
+        _item("Elution", "hs_plate", "E10"),
+        _item("Pool", "mag_plate", "E1"),
+        _item("Eluate", "mag_plate", "E7"),
+        _item("Ligation", "mag_plate", "C1", n),
+        _item("EpS", cold, "A1", n, member="{}{}", filled="sample"),
+        _item("BC", cold, "B1", n, member="{}-{:02d}", filled="reagent"),
+    ]
+    return items
+
+
+def _adapter_layout(n, pools=1):
+    # The barcoded samples are pooled, so the layout depends on the number of pools, one library each, not on the samples.
+    cold = ("temp_labware", "ep_tuberack")
+    return [
+        _item("AXP", "ep_tuberack", "A1", filled="reagent"),
+        _item("NA", cold, "A2", filled="reagent"),
+        _item("LFB", cold, "B1", filled="reagent"),
+        _item("EB", cold, "B2", filled="reagent"),
+        _item("QL", cold, "C1", filled="reagent"),
+        _item("QB", cold, "C2", filled="reagent"),
+    ] + _falcons(ethanol=False) + [
+        _item("Beads", "hs_plate", "H3", math.ceil(pools/BEAD_WELL_SAMPLES)),
+        _item("Elution", "hs_plate", "E1", pools),
+        _item("Ligation", "mag_plate", "G1", pools),
+        _item("Eluate", "mag_plate", "H1", pools),
+        _item("Quant", "plate", "E1", pools),
+        _item("PBs", cold, "A1", pools, filled="sample"),
+        _item("Library", "ep_tuberack", "A2", pools),
+    ]
+
+
+def _flexstation_layout(n):
+    return [_item("Standard #2", "ep_tuberack", "A2", filled="reagent"), _item("Standard #1", "ep_tuberack", "A3", filled="reagent"), _item("Qubit", "falcon_tuberack", "A1", filled="reagent")]
+
+
+LAYOUT_STAGES = {
+    "endprep": _endprep_layout,
+    "barcode": _barcode_layout,
+    "adapter": _adapter_layout,
+    "flexstation": _flexstation_layout,
+}
+
+
+# The stage whose output tubes each stage starts from, and the layout group they are in, see read_deck_state().
+STAGE_INPUTS = {
+    "barcode": ("endprep", "EpS"),
+    "adapter": ("barcode", "PBs"),
+}
+
+
+# Positions another batch of the same deck session holds, which plan_layout() plans around, see reserve_positions().
+_reserved_positions = {}
+
+
+def reserve_positions(positions):
+    """ Makes plan_layout() plan around 'positions', {name: (labware name, well name)} like Layout.positions, which another
+    batch of the same deck session holds. The SHARED_REAGENTS tubes are shared instead. Call with {} to plan a lone run again.
+    """
+    _reserved_positions.clear()
+    _reserved_positions.update(positions)
+
+
+def plan_layout(stage, num_samples, deck_state=None, **options):
+    """ Assigns the tubes and wells of a protocol stage ("endprep", "barcode", "adapter" or "flexstation") for a number of samples.
+
+    Fixed wells are placed first, then the single reagent tubes, then the tubes and wells of each sample. Each goes in the
+    first free well of its labware from its start well, row by row and round to A1, and in the next labware of the item when
+    that is full. Tubes that fit nowhere go in extra Eppendorf racks in the SPARE_SLOTS. With 2 samples the positions are
+    those the protocols always used. 'options' are the stage's settings, like standard_curve. With a 'deck_state' from
+    read_deck_state() the input tubes of the stage (STAGE_INPUTS) stay where the stage before left them. Returns a Layout.
+    """
+    layout = Layout(stage, num_samples)
+    if options.get("thermocycler"):
+        layout.spare_slots = [] # The thermocycler covers slots 7, 8, 10 and 11.
+    items = LAYOUT_STAGES[stage](num_samples, **options)
+    if deck_state is not None:
+        group = next(item for item in items if item["name"] == STAGE_INPUTS[stage][1])
+        if len(deck_state) != group["count"]:
+            raise Exception(f"{DECK_STATE_FILE} lists {len(deck_state)} tube{'s' if len(deck_state) != 1 else ''} from today's {STAGE_INPUTS[stage][0]} run, but this run is set up for {group['count']}. "
+                            "Set use_deck_state to False if the tubes were moved.")
+        for i, tube in enumerate(deck_state):
+            layout.inputs[group["member"].format(group["name"], i + 1)] = (tube["labware"], tube["well"])
+    # Stable sort, so each kind keeps the listed order.
+    for item in sorted(items, key=lambda item: 0 if isinstance(item["start"], list) else 1 if item["count"] is None else 2):
+        if item["count"] is None:
+            layout._place(item["name"], item)
+            continue
+        layout.groups[item["name"]] = []
+        for i in range(item["count"]):
+            name = item["member"].format(item["name"], i + 1)
+            layout.groups[item["name"]].append(name)
+            layout._place(name, item, item["start"][i] if isinstance(item["start"], list) else None)
+    return layout
+
+
+class Layout:
+    """ Where the tubes and wells of a run are, as planned by plan_layout().
+
+    The protocols refer to them by name: wells() gives the loaded wells, reagents() the starting volumes for load_reagents(),
+    and loading_map() the positions to load the deck by, which layout.py prints.
+    """
+
+    def __init__(self, stage, num_samples):
+        self.stage = stage
+        self.num_samples = num_samples
+        self.positions = {} # (labware name, well name) by tube or well name
+        self.groups = {} # Names of the tubes or wells of each group, e.g. {"DNA": ["DNA 1", "DNA 2"]}
+        self.cold = set() # Names that are meant for the temperature module
+        self.filled = {} # What the tubes that are filled before the run hold, "reagent" or "sample", by name
+        self.spare_racks = [] # (labware name, slot) of the extra Eppendorf racks
+        self.spare_slots = list(SPARE_SLOTS) # Slots that are free for them
+        self.reserved = dict(_reserved_positions) # Positions of another batch of the deck session
+        self.inputs = {} # Positions of the tubes the stage before left on the deck
+
+    def _place(self, name, item, well_name=None):
+        if item["filled"]:
+            self.filled[name] = item["filled"]
+        if name in SHARED_REAGENTS and name in self.reserved:
+            self.positions[name] = self.reserved[name]
+            return
+        if name in self.inputs:
+            key = self.inputs[name][0]
+            if item["labware"][0] == "temp_labware":
+                self.cold.add(name)
+            if key.startswith("spare_rack_") and key not in dict(self.spare_racks):
+                self.spare_racks.append((key, int(key.split("_")[-1])))
+            self.positions[name] = self.inputs[name]
+            return
+        taken = set(self.positions.values()) | set(self.reserved.values()) | set(self.inputs.values())
+        if well_name is not None:
+            if (item["labware"][0], well_name) in taken:
+                raise Exception(f"Layout {self.stage}: {name} and another item are both in {item['labware'][0]} {well_name}.")
+            self.positions[name] = (item["labware"][0], well_name)
+            return
+        if item["labware"][0] == "temp_labware":
+            self.cold.add(name)
+
+        labware = list(item["labware"])
+        if labware[0] in TUBE_LABWARE:
+            labware += [f"spare_rack_{slot}" for slot in self.spare_slots]
+        for key in labware:
+            wells = self._wells_of(key)
+            if key == item["labware"][0]:
+                start = wells.index(item["start"])
+                wells = wells[start:] + wells[:start]
+            free = next((well for well in wells if (key, well) not in taken), None)
+            if free is None:
+                continue
+            if key.startswith("spare_rack_") and key not in dict(self.spare_racks):
+                self.spare_racks.append((key, int(key.split("_")[-1])))
+            self.positions[name] = (key, free)
+            return
+        raise Exception(f"Layout {self.stage}: no room for {name} with {self.num_samples} samples.")
+
+    def _wells_of(self, key):
+        if key == "falcon_tuberack":
+            return FALCON_WELLS
+        rows, columns = (4, 6) if key.startswith("spare_rack_") else LAYOUT_LABWARE[key][2:]
+        return [f"{row}{column}" for row in "ABCDEFGH"[:rows] for column in range(1, columns + 1)]
+
+    def describe(self, key):
+        """ Readable name of a labware of the layout. """
+        if key.startswith("spare_rack_"):
+            return f"spare tube rack in slot {key.split('_')[-1]}"
+        return LAYOUT_LABWARE[key][0]
+
+    def load_spare_racks(self, protocol, labware):
+        """ Loads the extra Eppendorf racks of the layout into 'labware', the loaded labware by name. Returns 'labware'. """
+        for key, slot in self.spare_racks:
+            labware[key] = protocol.load_labware(SPARE_RACK, slot, label=f"Spare tube rack {slot}")
+        return labware
+
+    def wells(self, labware):
+        """ The wells of the layout by name, with a list of wells for each group, from the loaded labware by name. """
+        wells = {name: labware[key][well_name] for name, (key, well_name) in self.positions.items()}
+        for group, names in self.groups.items():
+            wells[group] = [wells[name] for name in names]
+        return wells
+
+    def reagents(self, volumes):
+        """ The 'reagents' of load_reagents(): (labware name, well name, µL) by reagent name, from µL by name.
+        A group gets the same volume in each tube, or a list of volumes. Reagents with 0µL that the layout leaves out, like
+        the standards of a run without a standard curve, are left out here too.
+        """
+        reagents = {}
+        for name, volume in volumes.items():
+            if name in self.groups:
+                group_volumes = volume if isinstance(volume, list) else [volume]*len(self.groups[name])
+                for member, vol in zip(self.groups[name], group_volumes):
+                    reagents[member] = (*self.positions[member], vol)
+            elif name in self.positions or volume != 0:
+                reagents[name] = (*self.positions[name], volume)
+        return reagents
+
+    def save_state(self, protocol, tubes):
+        """ Writes the tubes the run leaves on the deck for the next stage to DECK_STATE_FILE, see read_deck_state().
+        'tubes' maps layout names to (contents, µL, sample ID). Not written when simulating.
+        """
+        state = {"stage": self.stage, "time": datetime.datetime.now().isoformat(timespec="seconds"), "tubes": []}
+        for name, (contents, volume, sample) in tubes.items():
+            key, well_name = self.positions[name]
+            state["tubes"].append({"labware": key, "well": well_name, "name": name, "contents": contents,
+                                   "volume": round(volume, 2), "sample": sample})
+        protocol.comment(f"* Left on the deck: {', '.join(f'{contents} {sample} ({round(volume, 2):g}µL)' for contents, volume, sample in tubes.values())}, "
+                         f"saved in {DECK_STATE_FILE}.")
+        if protocol.is_simulating():
+            return
+        with open(os.path.join(ROBOT_DIR, DECK_STATE_FILE), "w") as f:
+            json.dump(state, f, indent=2)
+
+    def where(self, name):
+        """ Readable position of a tube or well, or of the tubes or wells of a group, e.g. "Eppendorf tube rack A2, A3". """
+        by_labware = {}
+        for member in self.groups.get(name, [name]):
+            key, well_name = self.positions[member]
+            by_labware.setdefault(key, []).append(well_name)
+        return " and ".join(f"{self.describe(key)} {', '.join(well_names)}" for key, well_names in by_labware.items())
+
+    def loading_map(self, reagents=None):
+        """ The positions of the layout by labware, as text, with the starting volumes of 'reagents' (see reagents()).
+        Without 'reagents' the tubes of the reagents and samples are marked as such, with an unknown volume.
+        """
+        known = reagents is not None
+        reagents = reagents or {}
+        lines = [f"Deck layout for {self.stage}, {self.num_samples} samples"]
+        keys = list(LAYOUT_LABWARE) + [key for key, slot in self.spare_racks]
+        for key in keys:
+            names = sorted((name for name, position in self.positions.items() if position[0] == key),
+                           key=lambda name: self._wells_of(key).index(self.positions[name][1]))
+            if not names:
+                continue
+            title = self.describe(key)
+            if key in LAYOUT_LABWARE:
+                title += f" (slot {LAYOUT_LABWARE[key][1]})"
+            lines.append("")
+            lines.append(title[0].upper() + title[1:])
+            for name in names:
+                notes = []
+                if name in reagents and reagents[name][2] > 0:
+                    notes.append(f"{round(reagents[name][2], 2):g}µL")
+                elif not known and name in self.filled:
+                    notes.append(f"{self.filled[name]}, volume unknown")
+                elif key in TUBE_LABWARE or key.startswith("spare_rack_"):
+                    notes.append("empty 1.5mL tube" if key != "falcon_tuberack" else "empty falcon tube")
+                if name in self.cold and key != "temp_labware":
+                    notes.append("not cooled")
+                lines.append(f"  {self.positions[name][1]:4}{name:20}{', '.join(notes)}")
+        return "\n".join(lines)
+
+
+class Checkpoint:
+    """ Keeps track of the finished steps of a run in a small file in the robot's Jupyter notebook folder.
+
+    A run that failed or was cancelled can be started again, and then skips the steps that finished the last time.
+    The file also holds the next unused tip of each pipette, so a resumed run continues from the same tip positions.
+    With a LiquidTracker, the tracked volumes are kept as well, so the skipped steps' aspirations are not forgotten.
+    It is removed when the protocol finishes, so the next run starts from the beginning.
+    The file also holds the date and a fingerprint of the run 'settings' (samples and options), and a run only resumes from
+    a checkpoint of the same day with the same settings, so a run that was cancelled on purpose doesn't make a later run with
+    other samples skip steps. Unless 'attended' is False, the operator confirms the resumption at a pause.
+    Each step has to set up the module states it relies on itself (magnet height, temperatures), since earlier steps may be skipped.
+    """
+
+    def __init__(self, protocol, name, pipettes, resume=True, tracker=None, settings=None, attended=True):
+        self.protocol = protocol
+        self.pipettes = pipettes
+        self.tracker = tracker
+        self.path = os.path.join(ROBOT_DIR, f"{name}_checkpoint.json")
+        self.fingerprint = hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+        self.finished = []
+
+        state = None
+        if resume and os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            if state.get("date") != datetime.date.today().isoformat():
+                protocol.comment(f"* Not resuming from the checkpoint of {state['time']}, it is not from today.")
+                state = None
+            elif state.get("settings") != self.fingerprint:
+                protocol.comment(f"* Not resuming from the checkpoint of {state['time']}, it was made with other samples or options.")
+                state = None
+        if state is not None:
+            self.finished = state["steps"]
+            for pipette in pipettes:
+                if state["tips"].get(pipette.mount):
+                    rack, well = state["tips"][pipette.mount]
+                    pipette.starting_tip = pipette.tip_racks[rack][well]
+            if tracker is not None:
+                tracker.volumes.update(state.get("volumes", {}))
+            protocol.comment(f"* Resuming the run from {state['time']}. Finished steps: {', '.join(self.finished)}.")
+            if attended:
+                protocol.pause(f"Resuming the run of {state['time']}, skipping {', '.join(self.finished)}. To start from the beginning "
+                               f"instead, cancel the run, delete {os.path.basename(self.path)} or set resume_run = False, and start again.")
+
+    def pending(self, step):
+        """ Whether a step still has to be run. """
+        if step in self.finished:
+            self.protocol.comment(f"* Skipping step '{step}', it finished in an earlier run.")
+            return False
+        return True
+
+    def finish(self, step):
+        """ Records a step as finished, together with the next unused tips. """
+        self.finished.append(step)
+        if self.protocol.is_simulating():
+            return
+        state = {
+            "time": time.strftime("%Y-%m-%d %H:%M"),
+            "date": datetime.date.today().isoformat(),
+            "settings": self.fingerprint,
+            "steps": self.finished,
+            "tips": {pipette.mount: _next_tip(pipette) for pipette in self.pipettes},
+            "volumes": self.tracker.volumes if self.tracker is not None else {},
+        }
+        with open(self.path, "w") as f:
+            json.dump(state, f, indent=2)
+
+    def close(self):
+        """ Removes the checkpoint file at the end of a complete run. """
+        if not self.protocol.is_simulating() and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _next_tip(pipette):
+    # (tip rack index, well name) of the tip the pipette picks up next, or None when all racks are empty.
+    # Like the robot's tip tracking it starts from the pipette's starting_tip, since a resumed run sets it to skip the tips
+    # an earlier run took, which the racks still count as there.
+    start = pipette.starting_tip
+    started = start is None
+    for index, rack in enumerate(pipette.tip_racks):
+        for well in rack.wells():
+            started = started or (rack is start.parent and well.well_name == start.well_name)
+            if started and well.has_tip:
+                return [index, well.well_name]
+    return None
+
+
+def expand_plan(steps):
+    """ The single steps of a run plan made by compile_plan.py, with its repeat steps unrolled. """
+    for step in steps:
+        if "repeat" not in step:
+            yield step
+            continue
+        for j in range(step["repeat"]):
+            values = {name: values[j] for name, values in step["values"].items()}
+            yield from expand_plan(_substitute(step["commands"], values))
+
+
+def _substitute(item, values):
+    # Replaces the "$n" variables of a repeat step, also in the repeat steps nested in it.
+    if isinstance(item, dict):
+        return {key: _substitute(value, values) for key, value in item.items()}
+    if isinstance(item, list):
+        return [_substitute(value, values) for value in item]
+    return values.get(item, item) if isinstance(item, str) else item
@@ -0,0 +1,693 @@
+""" Fast dry run of a protocol, recording every command it would send to the robot.
+
+record() runs a protocol's run() function against stand-ins for the Opentrons ProtocolContext, labware, modules and pipettes.
+Nothing is simulated physically. The stand-ins only keep track of tips, tip contents and pipette positions, and add each
+atomic command to a list, the command trace. The opentrons package is not needed, and a protocol is replayed in milliseconds,
+so the planning tools in this folder (preflight.py and others) can run a protocol for any parameters on the lab laptop.
+
+Only the parts of the Protocol API that the protocols in this folder use are covered.
+"""
+import ast
+from collections import namedtuple
+import math
+import os
+import sys
+from types import SimpleNamespace
+
+
+# load name: (rows, columns, max volume µL, depth mm, diameter mm)
+LABWARE = {
+    "opentrons_96_tiprack_300ul": (8, 12, 300, 59.3, 5.23),
+    "opentrons_96_tiprack_20ul": (8, 12, 20, 39.2, 3.27),
+    "nest_1_reservoir_290ml": (1, 1, 290000, 39.55, None), # 107.77 x 71.2mm rectangular well
+    "corning_96_wellplate_360ul_flat": (8, 12, 360, 10.67, 6.86),
+    "nest_96_wellplate_200ul_flat": (8, 12, 200, 10.8, 6.85),
+    "nest_96_wellplate_100ul_pcr_full_skirt": (8, 12, 100, 14.78, 5.34),
+    "opentrons_24_tuberack_eppendorf_1.5ml_safelock_snapcap": (4, 6, 1500, 37.9, 8.69),
+    "opentrons_24_aluminumblock_nest_1.5ml_snapcap": (4, 6, 1500, 37.8, 8.69),
+    "opentrons_10_tuberack_falcon_4x50ml_6x15ml_conical": (3, 4, None, None, None), # See FALCON_TUBES
+    "opentrons_96_pcr_adapter": (0, 0, None, None, None),
+    "opentrons_1_trash_1100ml_fixed": (1, 1, 1100000, 82, None),
+}
+# The falcon rack holds 15mL tubes in columns 1-2 and 50mL tubes in columns 3-4: (max volume µL, depth mm, diameter mm)
+FALCON_TUBES = {"1": (15000, 117.98, 14.9), "2": (15000, 117.98, 14.9), "3": (50000, 113, 27.81), "4": (50000, 113, 27.81)}
+RECTANGULAR_WELLS = {"nest_1_reservoir_290ml": (107.77, 71.2), "opentrons_1_trash_1100ml_fixed": (172.86, 165.86)}
+
+# Default flow rates (µL/s) are for API level 2.6 and later.
+PIPETTES = {
+    "p20_single_gen2": {"min_volume": 1, "max_volume": 20, "flow_rate": 7.56},
+    "p300_single_gen2": {"min_volume": 20, "max_volume": 300, "flow_rate": 92.86},
+}
+
+Point = namedtuple("Point", ["x", "y", "z"], defaults=[0, 0, 0])
+
+
+class ProtocolError(Exception):
+    """ An error the robot would stop the protocol with as well, like picking up a tip while one is attached. """
+
+
+class Cancelled(Exception):
+    """ A recorded run that was cancelled on purpose, see Trace. """
+
+
+class Trace:
+    """ The commands of one recorded protocol run.
+
+    commands: dicts with at least "command" and "line" (line of the protocol file that issued it).
+        Pipette commands also have "pipette", and "volume", "well" (a Well) and "z" (mm above the well bottom) where they apply,
+        with "at": the (reference, offset) the protocol gave the height as, e.g. ("top", -2).
+        Module commands have "module" and "params".
+        Delays that only wait for the time left after the steps of a helpers.during_delay() block have "timed", and follow
+        a "timer" command where the block starts.
+    labware, modules, pipettes: everything the protocol loaded, in load order.
+    names: variable name in run() of each loaded object, by id().
+    error, error_line: the exception that stopped the protocol early, if any.
+    api_version: the protocol's apiLevel as a tuple, e.g. (2, 18).
+    'cancel' is called with the trace before each command, and the run is cancelled with Cancelled, like from the Opentrons app,
+    when it returns True.
+    """
+
+    def __init__(self, path, cancel=None):
+        self.path = path
+        self.cancel = cancel
+        self.commands = []
+        self.labware = []
+        self.modules = []
+        self.pipettes = []
+        self.names = {}
+        self.metadata = {}
+        self.error = None
+        self.error_line = None
+        self.api_version = (2, 16)
+
+    def add(self, command, **fields):
+        if self.cancel is not None and self.cancel(self):
+            raise Cancelled(f"The run is cancelled after {len(self.commands)} commands.")
+        entry = dict(command=command, line=self._line(), **fields)
+        self.commands.append(entry)
+        return entry
+
+    def _line(self):
+        # Line of the protocol file that is being run, skipping frames of helper modules and of this file.
+        frame = sys._getframe(2)
+        while frame is not None:
+            if frame.f_code.co_filename == self.path:
+                return frame.f_lineno
+            frame = frame.f_back
+        return None
+
+    def name(self, item):
+        """ Readable name of loaded labware, modules and pipettes, and of wells as 'labware well'. """
+        if isinstance(item, Well):
+            return f"{self.name(item.parent)} {item.well_name}"
+        return self.names.get(id(item), str(item))
+
+
+class Location:
+    """ A height in a well, like opentrons.types.Location. 'z' is in mm above the well bottom,
+    'reference' and 'offset' are how the protocol gave it, e.g. well.top(-2) is ("top", -2).
+    """
+
+    def __init__(self, well, z, reference="bottom", offset=None):
+        self.well = well
+        self.z = z
+        self.reference = reference
+        self.offset = z if offset is None else offset
+        self.labware = SimpleNamespace(as_well=lambda: well)
+
+    def move(self, point):
+        return Location(self.well, self.z + point.z, self.reference, self.offset + point.z)
+
+
+class Well:
+    def __init__(self, labware, name, max_volume, depth, diameter):
+        self.parent = labware
+        self.well_name = name
+        self.max_volume = max_volume
+        self.depth = depth
+        self.diameter = diameter
+        self.length, self.width = RECTANGULAR_WELLS.get(labware.load_name, (None, None))
+        self.has_tip = labware.is_tiprack
+
+    def __repr__(self):
+        return f"{self.well_name} of {self.parent}"
+
+    @property
+    def display_name(self):
+        return repr(self)
+
+    def top(self, z=0.0):
+        return Location(self, self.depth + z, "top", z)
+
+    def bottom(self, z=0.0):
+        return Location(self, z, "bottom", z)
+
+    def center(self):
+        return Location(self, self.depth/2, "center", 0)
+
+    def load_liquid(self, liquid, volume):
+        self.parent.trace.add("load_liquid", well=self, liquid=liquid.name, volume=volume)
+
+
+class Labware:
+    def __init__(self, trace, load_name, slot, parent=None, label=None):
+        if load_name not in LABWARE:
+            raise ProtocolError(f"Labware '{load_name}' is not known to protocol_trace.py, add it to LABWARE.")
+        self.trace = trace
+        self.load_name = load_name
+        self.slot = str(slot)
+        self.parent = parent or self.slot
+        self.label = label
+        self.is_tiprack = "tiprack" in load_name
+        self.is_adapter = False
+        self.uri = f"opentrons/{load_name}/1"
+        self.child = None
+
+        rows, columns, max_volume, depth, diameter = LABWARE[load_name]
+        self._wells = {}
+        for column in range(1, columns + 1):
+            for row in "ABCDEFGH"[:rows]:
+                if load_name.startswith("opentrons_10_tuberack_falcon"):
+                    if row == "C" and column > 2:
+                        continue
+                    max_volume, depth, diameter = FALCON_TUBES[str(column)]
+                self._wells[f"{row}{column}"] = Well(self, f"{row}{column}", max_volume, depth, diameter)
+        trace.labware.append(self)
+
+    def __repr__(self):
+        return f"{self.label or self.load_name} on {self.slot}"
+
+    def __getitem__(self, name):
+        return self._wells[name]
+
+    def wells(self):
+        return list(self._wells.values())
+
+    def wells_by_name(self):
+        return dict(self._wells)
+
+    def columns(self):
+        return list(self.columns_by_name().values())
+
+    def columns_by_name(self):
+        columns = {}
+        for name, well in self._wells.items():
+            columns.setdefault(name[1:], []).append(well)
+        return columns
+
+    def rows(self):
+        return list(self.rows_by_name().values())
+
+    def rows_by_name(self):
+        rows = {}
+        for name, well in self._wells.items():
+            rows.setdefault(name[0], []).append(well)
+        return rows
+
+    def load_labware(self, load_name, label=None, namespace=None, version=None):
+        # Labware on an adapter
+        self.child = Labware(self.trace, load_name, self.slot, parent=self, label=label)
+        return self.child
+
+    def set_offset(self, x, y, z):
+        self.trace.add("set_offset", labware=self, params={"x": x, "y": y, "z": z})
+
+
+class Module:
+    """ Records any method call, e.g. engage(height_from_base=3.5), as a module command. """
+
+    def __init__(self, trace, name, slot):
+        self._trace = trace
+        self.name = name
+        self.slot = str(slot)
+        self.parent = self.slot
+        self.labware = None
+        trace.modules.append(self)
+
+    def __repr__(self):
+        return f"{self.name} on {self.slot}"
+
+    def load_labware(self, load_name, label=None, namespace=None, version=None):
+        self.labware = Labware(self._trace, load_name, self.slot, parent=self, label=label)
+        return self.labware
+
+    def load_adapter(self, load_name, namespace=None, version=None):
+        adapter = self.load_labware(load_name)
+        adapter.is_adapter = True
+        return adapter
+
+    def __getattr__(self, attribute):
+        if attribute.startswith("_"):
+            raise AttributeError(attribute)
+
+        def command(*args, **kwargs):
+            params = dict(kwargs)
+            for i, arg in enumerate(args):
+                params[f"arg{i}"] = arg
+            self._trace.add(attribute, module=self, params=params)
+        return command
+
+
+class Pipette:
+    def __init__(self, trace, name, mount, tip_racks):
+        if name not in PIPETTES:
+            raise ProtocolError(f"Pipette '{name}' is not known to protocol_trace.py, add it to PIPETTES.")
+        spec = PIPETTES[name]
+        self.trace = trace
+        self.name = name
+        self.mount = mount
+        self.tip_racks = list(tip_racks or [])
+        self._tip = None # Rack well of the attached tip
+        self.min_volume = spec["min_volume"]
+        self.max_volume = spec["max_volume"]
+        self.flow_rate = SimpleNamespace(aspirate=spec["flow_rate"], dispense=spec["flow_rate"], blow_out=spec["flow_rate"])
+        self.well_bottom_clearance = SimpleNamespace(aspirate=1.0, dispense=1.0)
+        self._default_speed = 400
+        self.starting_tip = None
+        self.has_tip = False
+        self.current_volume = 0
+        self._location = None
+        trace.pipettes.append(self)
+
+    def __repr__(self):
+        return f"{self.name} on {self.mount} mount"
+
+    @property
+    def default_speed(self):
+        return self._default_speed
+
+    @default_speed.setter
+    def default_speed(self, speed):
+        # Recorded, as it changes how the following moves are made.
+        self._default_speed = speed
+        self._add("default_speed", speed=speed)
+
+    def _at(self, location, clearance=1.0):
+        # Location of a command: a Well means its default height, None means where the pipette already is.
+        if location is None:
+            if self._location is None:
+                raise ProtocolError(f"{self} has no location to work at.")
+            location = self._location
+        elif isinstance(location, Well):
+            location = location.bottom(clearance)
+        self._location = location
+        return location
+
+    def _require_tip(self, action):
+        if not self.has_tip:
+            raise ProtocolError(f"{self} can't {action} without a tip.")
+
+    def _add(self, command, location=None, **fields):
+        if location is not None:
+            fields.update(well=location.well, z=location.z, at=(location.reference, location.offset))
+        return self.trace.add(command, pipette=self, **fields)
+
+    def pick_up_tip(self, location=None):
+        if self.has_tip:
+            raise ProtocolError(f"{self} already has a tip.")
+        if location is None:
+            location = self._next_tip()
+        well = location.well if isinstance(location, Location) else location
+        well.has_tip = False
+        self.has_tip = True
+        self.current_volume = 0
+        self._tip = well
+        self._add("pick_up_tip", self._at(well.top()))
+        return self
+
+    def _next_tip(self):
+        started = self.starting_tip is None
+        for rack in self.tip_racks:
+            for well in rack.wells():
+                started = started or well is self.starting_tip
+                if started and well.has_tip:
+                    return well
+        raise ProtocolError(f"{self} is out of tips.")
+
+    def drop_tip(self, location=None, home_after=None):
+        self._require_tip("drop a tip")
+        self.has_tip = False
+        self.current_volume = 0
+        self._add("drop_tip")
+        return self
+
+    def return_tip(self, home_after=None):
+        # The tip goes back to its rack, but like on the robot it isn't picked up by the automatic tip tracking again.
+        self._require_tip("return a tip")
+        self.has_tip = False
+        self.current_volume = 0
+        self._add("return_tip", tip=self._tip)
+        return self
+
+    def aspirate(self, volume=None, location=None, rate=1.0):
+        self._require_tip("aspirate")
+        location = self._at(location, self.well_bottom_clearance.aspirate)
+        if volume is None:
+            volume = self.max_volume - self.current_volume
+        if self.current_volume + volume > self.max_volume + 1e-6:
+            raise ProtocolError(f"{self} can't hold {self.current_volume + volume}µL.")
+        self.current_volume += volume
+        self._add("aspirate", location, volume=volume, rate=rate)
+        return self
+
+    def dispense(self, volume=None, location=None, rate=1.0, push_out=None):
+        self._require_tip("dispense")
+        location = self._at(location, self.well_bottom_clearance.dispense)
+        if volume is None:
+            volume = self.current_volume
+        if volume > self.current_volume + 1e-6 and self.trace.api_version >= (2, 17):
+            raise ProtocolError(f"{self} can't dispense {volume}µL with {self.current_volume}µL in the tip.") # Clipped before apiLevel 2.17
+        volume = min(volume, self.current_volume)
+        self.current_volume -= volume
+        self._add("dispense", location, volume=volume, rate=rate)
+        return self
+
+    def mix(self, repetitions=1, volume=None, location=None, rate=1.0):
+        # Kept as a single command, the 'repetitions' aspirate/dispense cycles are implied.
+        self._require_tip("mix")
+        location = self._at(location, self.well_bottom_clearance.aspirate)
+        if volume is None:
+            volume = self.max_volume
+        if self.current_volume + volume > self.max_volume + 1e-6:
+            raise ProtocolError(f"{self} can't mix {volume}µL with {self.current_volume}µL already in the tip.")
+        self._add("mix", location, volume=volume, repetitions=repetitions, rate=rate)
+        return self
+
+    def blow_out(self, location=None):
+        self._require_tip("blow out")
+        location = self._at(location)
+        self._add("blow_out", location, volume=self.current_volume)
+        self.current_volume = 0
+        return self
+
+    def touch_tip(self, location=None, radius=1.0, v_offset=-1.0, speed=60.0):
+        self._require_tip("touch tip")
+        if location is None:
+            location = self._at(None).well # The well the pipette is in, touched at its top as well
+        if isinstance(location, Well):
+            location = location.top(v_offset)
+        location = self._at(location)
+        self._add("touch_tip", location, radius=radius, v_offset=v_offset, speed=speed)
+        return self
+
+    def air_gap(self, volume=None, height=None):
+        self._require_tip("air gap")
+        if volume is None:
+            volume = self.max_volume - self.current_volume
+        if self.current_volume + volume > self.max_volume + 1e-6:
+            raise ProtocolError(f"{self} can't hold a {volume}µL air gap.")
+        self.current_volume += volume
+        self._add("air_gap", volume=volume)
+        return self
+
+    def move_to(self, location, force_direct=False, minimum_z_height=None, speed=None):
+        self._add("move_to", self._at(location))
+        return self
+
+    def home(self):
+        self._add("home")
+        return self
+
+    def transfer(self, volume, source, dest, **kwargs):
+        sources, dests = _as_list(source), _as_list(dest)
+        if len(sources) == 1 and len(dests) > 1:
+            sources = sources*len(dests)
+        elif len(dests) == 1 and len(sources) > 1:
+            dests = dests*len(sources)
+        volumes = volume if isinstance(volume, (list, tuple)) else [volume]*len(sources)
+        if not len(volumes) == len(sources) == len(dests):
+            raise ProtocolError("transfer() needs as many sources, destinations and volumes.")
+        self._transfer(list(zip(volumes, sources, dests)), **kwargs)
+        return self
+
+    def _transfer(self, moves, new_tip="once", mix_before=None, mix_after=None, touch_tip=False, blow_out=False,
+                  blowout_location=None, air_gap=0, carryover=True, **kwargs):
+        # Opentrons skips zero volume transfers, and splits volumes that don't fit in the tip into equal parts.
+        # Like distribute() and consolidate(), it ignores a 'rate' argument and always uses the default flow rates.
+        moves = [move for move in moves if move[0] > 0]
+        if not moves:
+            return
+        if new_tip == "never":
+            self._require_tip("transfer")
+        elif new_tip == "once":
+            self.pick_up_tip()
+
+        first = True
+        for volume, source, dest in moves:
+            parts = math.ceil(volume/(self.max_volume - air_gap) - 1e-9)
+            for i in range(parts):
+                if new_tip == "always":
+                    if not first:
+                        self.drop_tip()
+                    self.pick_up_tip()
+                first = False
+                if mix_before:
+                    self.mix(mix_before[0], mix_before[1], source)
+                self.aspirate(volume/parts, source)
+                if touch_tip:
+                    self.touch_tip(_well_of(source))
+                if air_gap:
+                    self.air_gap(air_gap)
+                self.dispense(volume/parts + air_gap, dest)
+                if mix_after:
+                    self.mix(mix_after[0], mix_after[1], dest)
+                if blow_out:
+                    self.blow_out(self._blowout_location(blowout_location, source, dest))
+                if touch_tip:
+                    self.touch_tip(_well_of(dest))
+        if new_tip != "never":
+            self.drop_tip()
+
+    def _blowout_location(self, blowout_location, source, dest):
+        if blowout_location == "destination well":
+            return _well_of(dest).top()
+        if blowout_location == "source well":
+            return _well_of(source).top()
+        return self.trace.trash["A1"].top()
+
+    def distribute(self, volume, source, dest, disposal_volume=None, new_tip="once", **kwargs):
+        # One aspiration for as many destinations as fit in the tip, plus a disposal volume that is blown out in the trash.
+        dests = _as_list(dest)
+        volumes = volume if isinstance(volume, (list, tuple)) else [volume]*len(dests)
+        disposal = self.min_volume if disposal_volume is None else disposal_volume
+        moves = [(vol, well) for vol, well in zip(volumes, dests) if vol > 0]
+        if not moves:
+            return self
+        if new_tip == "never":
+            self._require_tip("distribute")
+        else:
+            self.pick_up_tip()
+        while moves:
+            trip = [moves.pop(0)]
+            while moves and sum(vol for vol, well in trip) + moves[0][0] + disposal <= self.max_volume:
+                trip.append(moves.pop(0))
+            self.aspirate(sum(vol for vol, well in trip) + disposal, source)
+            for vol, well in trip:
+                self.dispense(vol, well)
+            self.blow_out(self.trace.trash["A1"].top())
+        if new_tip != "never":
+            self.drop_tip()
+        return self
+
+    def consolidate(self, volume, source, dest, new_tip="once", mix_after=None, blow_out=False, blowout_location=None, **kwargs):
+        # One dispense for as many sources as fit in the tip.
+        sources = _as_list(source)
+        volumes = volume if isinstance(volume, (list, tuple)) else [volume]*len(sources)
+        moves = [(vol, well) for vol, well in zip(volumes, sources) if vol > 0]
+        if not moves:
+            return self
+        if new_tip == "never":
+            self._require_tip("consolidate")
+        else:
+            self.pick_up_tip()
+        while moves:
+            trip = [moves.pop(0)]
+            while moves and sum(vol for vol, well in trip) + moves[0][0] <= self.max_volume:
+                trip.append(moves.pop(0))
+            for vol, well in trip:
+                self.aspirate(vol, well)
+            self.dispense(sum(vol for vol, well in trip), dest)
+            if mix_after:
+                self.mix(mix_after[0], mix_after[1], dest)
+            if blow_out:
+                self.blow_out(self._blowout_location(blowout_location, trip[-1][1], dest))
+        if new_tip != "never":
+            self.drop_tip()
+        return self
+
+
+class ProtocolContext:
+    """ Stand-in for opentrons.protocol_api.ProtocolContext that fills a Trace. """
+
+    def __init__(self, trace, api_version="2.16", simulating=True):
+        self.trace = trace
+        self.simulating = simulating
+        self.api_version = api_version
+        trace.api_version = tuple(int(part) for part in str(api_version).split("."))
+        self.max_speeds = {}
+        self.fixed_trash = Labware(trace, "opentrons_1_trash_1100ml_fixed", 12)
+        trace.trash = self.fixed_trash
+
+    def is_simulating(self):
+        return self.simulating
+
+    def load_labware(self, load_name, location, label=None, namespace=None, version=None):
+        return Labware(self.trace, load_name, location, label=label)
+
+    def load_module(self, module_name, location=None, configuration=None):
+        if location is None and "thermocycler" in module_name.lower():
+            location = 7 # The thermocycler is loaded without a location, it covers slots 7, 8, 10 and 11.
+        return Module(self.trace, module_name, location)
+
+    def load_instrument(self, instrument_name, mount, tip_racks=None, replace=False):
+        return Pipette(self.trace, instrument_name, mount, tip_racks)
+
+    def define_liquid(self, name, description=None, display_color=None):
+        return SimpleNamespace(name=name, description=description, display_color=display_color)
+
+    def comment(self, msg):
+        self.trace.add("comment", text=msg)
+
+    def pause(self, msg=None):
+        self.trace.add("pause", text=msg)
+
+    def delay(self, seconds=0, minutes=0, msg=None):
+        entry = self.trace.add("delay", seconds=seconds + minutes*60, text=msg)
+        if sys._getframe(1).f_code.co_name == "during_delay":
+            entry["timed"] = True
+
+    def start_timer(self):
+        # Called by helpers.during_delay() where its steps start, the real ProtocolContext has no such method.
+        self.trace.add("timer")
+
+    def home(self):
+        self.trace.add("home")
+
+
+def _as_list(item):
+    return list(item) if isinstance(item, (list, tuple)) else [item]
+
+
+def _well_of(location):
+    return location.well if isinstance(location, Location) else location
+
+
+# What "from opentrons import protocol_api, types" gives the protocol while recording.
+OPENTRONS_NAMES = {
+    "protocol_api": SimpleNamespace(ProtocolContext=ProtocolContext),
+    "types": SimpleNamespace(Point=Point, Location=Location),
+}
+
+
+def load_module(path, **overrides):
+    """ Runs the top level of the protocol file at 'path', not its run(), and returns its global variables,
+    with 'overrides' as in record(). Tools like layout.py use it to read what a protocol sets up before it runs.
+    """
+    path, code, namespace = _compile(path, overrides)
+    exec(code, namespace)
+    return namespace
+
+
+def _compile(path, overrides):
+    # The protocol's code with the overrides in place and the opentrons imports replaced by the stand-ins.
+    path = os.path.abspath(path)
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+
+    namespace = {"__name__": "protocol", "__file__": path}
+    body = []
+    unused = set(overrides)
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and (node.module or "").split(".")[0] == "opentrons":
+            for alias in node.names:
+                namespace[alias.asname or alias.name] = OPENTRONS_NAMES[alias.name]
+            continue
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name in overrides:
+                node.value = ast.parse(repr(overrides[name]), mode="eval").body
+                unused.discard(name)
+        body.append(node)
+    if unused:
+        raise ValueError(f"{os.path.basename(path)} has no top-level parameter {', '.join(sorted(unused))}.")
+    tree.body = body
+    ast.fix_missing_locations(tree)
+
+    # The protocols import protocol_helpers from their own folder.
+    folder = os.path.dirname(path)
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+    return path, compile(tree, path, "exec"), namespace
+
+
+def configured_source(path, **overrides):
+    """ The source of the protocol file at 'path' with 'overrides' written into its top-level assignments, as in record(),
+    to upload a configured copy of a protocol to the robot. The rest of the file, comments included, is kept as it is.
+    """
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    lines = source.splitlines(keepends=True)
+    unused = set(overrides)
+    # From the bottom up, so the line numbers of the assignments above stay valid.
+    for node in reversed(ast.parse(source, path).body):
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name in overrides:
+                lines[node.lineno - 1:node.end_lineno] = [f"{name} = {overrides[name]!r}\n"]
+                unused.discard(name)
+    if unused:
+        raise ValueError(f"{os.path.basename(path)} has no top-level parameter {', '.join(sorted(unused))}.")
+    return "".join(lines)
+
+
+def record(path, **overrides):
+    """ Runs the protocol file at 'path' and returns its Trace.
+
+    'overrides' replace the values of the protocol's top-level assignments, e.g. record("DNArepFin.py", unattended=True),
+    before the file is run, so values derived from them are computed as usual.
+    An exception raised by the protocol doesn't propagate, it is stored in the trace instead.
+    """
+    path, code, namespace = _compile(path, overrides)
+    return _run(Trace(path), code, namespace)
+
+
+def record_on_robot(path, folder, cancel=None, **overrides):
+    """ Like record(), but the protocol runs as on the robot: it isn't simulating, and protocol_helpers.ROBOT_DIR is 'folder',
+    so the protocol writes and reads its checkpoint and deck state files there. 'cancel' can cancel the run, see Trace,
+    which leaves Cancelled as the trace's error.
+    """
+    import protocol_helpers
+    path, code, namespace = _compile(path, overrides)
+    robot_dir = protocol_helpers.ROBOT_DIR
+    protocol_helpers.ROBOT_DIR = folder
+    try:
+        return _run(Trace(path, cancel), code, namespace, simulating=False)
+    finally:
+        protocol_helpers.ROBOT_DIR = robot_dir
+
+
+def _run(trace, code, namespace, simulating=True):
+    path = trace.path
+    try:
+        exec(code, namespace)
+        trace.metadata = namespace.get("metadata", {})
+        run = namespace["run"]
+
+        # Keep run()'s local variables when it returns, to name labware and pipettes in reports.
+        def profile(frame, event, arg):
+            if event == "return" and frame.f_code is run.__code__:
+                trace.names = {id(value): name for name, value in frame.f_locals.items()}
+
+        sys.setprofile(profile)
+        try:
+            run(ProtocolContext(trace, trace.metadata.get("apiLevel", "2.16"), simulating))
+        finally:
+            sys.setprofile(None)
+    except Exception as error:
+        trace.error = error
+        tb = error.__traceback__
+        while tb is not None:
+            if tb.tb_frame.f_code.co_filename == path:
+                trace.error_line = tb.tb_lineno
+            tb = tb.tb_next
+    return trace
@@ -0,0 +1,127 @@
+""" Reagent planner: the least each reagent tube has to be filled with for a run of a number of samples.
+
+    python reagent_plan.py DNArepFin.py -n 24
+    python reagent_plan.py BarcodeLigationFin.py -n 3 --set include_standard_curve=True
+    python reagent_plan.py AdapterligationFin.py -n 5
+
+The protocol is replayed with protocol_trace.py for n samples (pools for adapter ligation, set as in capacity.py), and every
+aspiration, mix and dispense of each declared reagent is followed in order. A tube has to hold, at each step, what was taken
+before it, what the step takes (or the whole mix volume for a mix), and its dead volume: what the tip can't reach, at least
+SUBMERGE_DEPTH above its lowest aspiration height by the height model of protocol_helpers.LiquidTracker, and no less than
+TUBE_DEAD_VOL in a tube or ETHANOL_DEAD_VOL in a falcon tube. The minimum fill is the largest of these.
+
+The minimum fill is printed next to the volume the protocol declares for the run. A reagent is flagged when its minimum fill
+is more than the protocol declares: when the run takes more than that the tube runs dry halfway, and otherwise the last
+aspirations reach the dead volume or the mixes draw air. It is also flagged when its minimum fill is more than its tube holds,
+with the number of tubes to split it over. If the protocol stops early, e.g.
+out of tips, the volumes cover the run up to there. The exit code is 1 if any reagent is flagged or the protocol stops early.
+"""
+import argparse
+import math
+import os
+import sys
+
+import capacity
+import preflight
+import protocol_helpers
+import protocol_trace
+
+
+TUBE_DEAD_VOL = 5 # µL a kit tube keeps that the pipette can't reach, as the protocols assume
+HEIGHTS = protocol_helpers.LiquidTracker()
+
+
+def dead_volume(well):
+    """ µL of a well that the pipette can't take. """
+    floor = protocol_helpers.ETHANOL_DEAD_VOL if "falcon" in well.parent.load_name else TUBE_DEAD_VOL
+    if not well.diameter:
+        return floor
+    # The height model is monotonic, so the volume at the lowest usable surface is found by bisection.
+    surface = protocol_helpers.MIN_HEIGHT + protocol_helpers.SUBMERGE_DEPTH
+    low, high = 0.0, well.max_volume or preflight._capacity(well)
+    for _ in range(50):
+        middle = (low + high)/2
+        low, high = (middle, high) if HEIGHTS.height(well, middle) < surface else (low, middle)
+    return max(floor, math.ceil(high))
+
+
+def plan(trace):
+    """ The minimum fill of each declared reagent of a Trace, as dicts in declaration order with "reagent", "well",
+    "declared", "taken" (most µL the run has taken at any point), "fill" (the minimum fill), "dead" and "tubes" (tubes it needs).
+    """
+    reagents = {}
+    for entry in trace.commands:
+        well = entry.get("well")
+        if entry["command"] == "load_liquid":
+            reagents[well] = {"reagent": entry["liquid"], "well": well, "declared": entry["volume"], "taken": 0.0,
+                              "net": 0.0, "fill": 0.0, "dead": dead_volume(well)}
+        elif well in reagents:
+            reagent = reagents[well]
+            # "net" is what has been taken so far, less what was dispensed back.
+            if entry["command"] == "aspirate":
+                reagent["net"] += entry["volume"]
+                reagent["taken"] = max(reagent["taken"], reagent["net"])
+                reagent["fill"] = max(reagent["fill"], reagent["net"] + reagent["dead"])
+            elif entry["command"] == "mix":
+                reagent["fill"] = max(reagent["fill"], reagent["net"] + entry["volume"] + reagent["dead"])
+            elif entry["command"] == "dispense":
+                reagent["net"] -= entry["volume"]
+
+    for reagent in reagents.values():
+        reagent["fill"] = math.ceil(reagent["fill"]*10)/10
+        capacity_vol = reagent["well"].max_volume
+        if reagent["fill"] <= capacity_vol or capacity_vol <= reagent["dead"]:
+            reagent["tubes"] = 1
+        else:
+            reagent["tubes"] = math.ceil((reagent["fill"] - reagent["dead"])/(capacity_vol - reagent["dead"]))
+    return [reagent for reagent in reagents.values() if reagent["taken"] > 0]
+
+
+def _ml(volume):
+    return f"{round(volume/1000, 1):g}mL" if volume >= 1000 else f"{round(volume, 1):g}µL"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plans the minimum fill of each reagent tube for a run of n samples.")
+    parser.add_argument("protocol", help="Protocol file, e.g. DNArepFin.py")
+    parser.add_argument("-n", "--samples", type=int, help="Samples (pools for adapter ligation), default: the protocol's own")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="Replace a top-level parameter of the protocol, as in preflight.py")
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.samples is not None:
+        sweep = capacity.SWEEPS.get(os.path.basename(args.protocol))
+        if sweep is None:
+            sys.exit(f"No sample parameter for {os.path.basename(args.protocol)}, add it to capacity.SWEEPS or use --set.")
+        overrides[sweep[0]] = sweep[1](args.samples)
+    for setting in args.set:
+        key, _, value = setting.partition("=")
+        overrides[key.strip()] = preflight.parse_value(value.strip())
+
+    trace = protocol_trace.record(args.protocol, **overrides)
+    if trace.error is not None:
+        print(f"{os.path.basename(args.protocol)} stops at line {trace.error_line} with {type(trace.error).__name__}: {trace.error}")
+        if not any(entry["command"] == "load_liquid" for entry in trace.commands):
+            sys.exit(1)
+        print("The volumes below only cover the run up to there.")
+
+    flagged = 0
+    print(f"{'Reagent':16}{'Tube':30}{'Takes':>9}{'Fill':>9}{'Declared':>10}")
+    for reagent in plan(trace):
+        flags = []
+        if reagent["declared"] < reagent["taken"] - 0.05:
+            flags.append(f"runs dry, {_ml(reagent['taken'] - reagent['declared'])} short")
+        elif reagent["declared"] < reagent["fill"] - 0.05:
+            flags.append(f"fill {_ml(reagent['fill'] - reagent['declared'])} more than declared")
+        if reagent["tubes"] > 1:
+            flags.append(f"more than the {_ml(reagent['well'].max_volume)} tube holds, split over {reagent['tubes']} tubes "
+                         f"of {_ml(math.ceil((reagent['fill'] - reagent['dead'])/reagent['tubes'] + reagent['dead']))}")
+        flagged += bool(flags)
+        print(f"{reagent['reagent']:16}{trace.name(reagent['well']):30}{_ml(reagent['taken']):>9}{_ml(reagent['fill']):>9}"
+              f"{_ml(reagent['declared']):>10}  {'; '.join('! ' + flag for flag in flags)}")
+    print(f"{os.path.basename(args.protocol)}: {flagged} reagents flagged.")
+    sys.exit(1 if flagged or trace.error is not None else 0)
+
+
+if __name__ == "__main__":
+    main()